@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# One pass aggregation of a value column (e.g. BLOCK_FLIGHT_VARIANCE) over several dimensions at once. For every
+# dimension the cube holds the count, mean and sum of squared differences from the mean (m2) of each group, which is
+# enough to give count/sum/mean/variance and to serve both the top k and bottom k groups without going back to the rows.
+#
+# Cubes built from separate chunks or partitions can be merged (see MergeAggregationCubes), so streamed data can be
+# aggregated one chunk at a time and a new dimension is just another entry in the list rather than another full scan.
+#
+# With a weight column (e.g. SAMPLE_WEIGHT of a sample, see FlightSampling) each row counts weight times, so the counts
+# and means are estimates for all the rows the sample stands for.
+
+
+# Integer group codes for a column - categoricals already have them, anything else gets factorized
+def GetGroupCodes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), pd.Index(column.cat.categories, name=column.name)
+    codes, labels = pd.factorize(column)
+    return codes, pd.Index(labels, name=column.name)
+
+
+# count/mean/m2 of the value for each group of one dimension, groups with no values are left out
+def AggregateDimension(frame, dimension, value, weight=None):
+    codes, labels = GetGroupCodes(frame[dimension])
+    values = frame[value].to_numpy(dtype='float64')
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    weights = None if weight is None else frame[weight].to_numpy(dtype='float64')[valid]
+
+    count = np.bincount(codes, weights=weights, minlength=len(labels))
+    total = np.bincount(codes, weights=values if weights is None else values * weights, minlength=len(labels))
+    mean = np.divide(total, count, out=np.zeros(len(labels)), where=count > 0)
+    squares = (values - mean[codes]) ** 2
+    m2 = np.bincount(codes, weights=squares if weights is None else squares * weights, minlength=len(labels))
+
+    cube = pd.DataFrame({'count': count, 'mean': mean, 'm2': m2}, index=labels)
+    return cube[cube['count'] > 0]
+
+
+def BuildAggregationCube(frame, dimensions, value='BLOCK_FLIGHT_VARIANCE', weight=None):
+    return {dimension: AggregateDimension(frame, dimension, value, weight) for dimension in dimensions}
+
+
+# Combine the partial results for the same groups (parallel variance formula), groups only in one side are kept as is
+def MergeDimension(left, right):
+    left, right = left.align(right, join='outer', fill_value=0)
+    count = left['count'] + right['count']
+    delta = right['mean'] - left['mean']
+    merged = pd.DataFrame({
+        'count': count,
+        'mean': left['mean'] + delta * right['count'] / count,
+        'm2': left['m2'] + right['m2'] + delta ** 2 * left['count'] * right['count'] / count,
+    })
+    if pd.api.types.is_integer_dtype(left['count']) and pd.api.types.is_integer_dtype(right['count']):
+        merged['count'] = merged['count'].astype('int64')   # weighted counts aren't whole numbers
+    return merged
+
+
+def MergeAggregationCubes(*cubes):
+    merged = {}
+    for cube in cubes:
+        for dimension, partial in cube.items():
+            merged[dimension] = MergeDimension(merged[dimension], partial) if dimension in merged else partial
+    return merged
+
+
+# Build the cube from a stream of chunks, e.g. BuildAggregationCubeFromChunks(GetFlightsDataChunks(), ['AIRLINE'])
+def BuildAggregationCubeFromChunks(chunks, dimensions, value='BLOCK_FLIGHT_VARIANCE'):
+    cube = {}
+    for chunk in chunks:
+        cube = MergeAggregationCubes(cube, BuildAggregationCube(chunk, dimensions, value))
+    return cube
+
+
+# count, sum, mean and (sample) variance of the value for each group of a dimension
+def GetCubeStatistics(cube, dimension):
+    partial = cube[dimension]
+    statistics = pd.DataFrame({
+        'count': partial['count'],
+        'sum': partial['mean'] * partial['count'],
+        'mean': partial['mean'],
+        'variance': partial['m2'] / (partial['count'] - 1).where(partial['count'] > 1),
+    })
+    return statistics
+
+
+# Top (or bottom) k groups of a dimension by one of the statistics. Returned in the same shape as
+# frame[[dimension, value]].groupby([dimension]).mean().nlargest(k, [value]) so it can be plotted the same way
+def GetTopK(cube, dimension, k, largest=True, statistic='mean', value='BLOCK_FLIGHT_VARIANCE'):
+    column = GetCubeStatistics(cube, dimension)[[statistic]].rename(columns={statistic: value})
+    if largest:
+        return column.nlargest(k, [value])
+    return column.nsmallest(k, [value])
+
+
+# Cube <-> flat frame (one row per dimension/group) so a cube can be saved to parquet. Group values are saved as text
+def CubeToFrame(cube):
+    frames = [partial.rename_axis('group').reset_index().assign(dimension=dimension)
+              for dimension, partial in cube.items()]
+    if not frames:
+        return pd.DataFrame(columns=['dimension', 'group', 'count', 'mean', 'm2'])
+    frame = pd.concat(frames, ignore_index=True)
+    frame['group'] = frame['group'].astype(str)
+    return frame[['dimension', 'group', 'count', 'mean', 'm2']]
+
+
+def CubeFromFrame(frame):
+    return {dimension: partial.set_index(pd.Index(partial['group'], name=dimension))[['count', 'mean', 'm2']]
+            for dimension, partial in frame.groupby('dimension', sort=False)}
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import ManufacturerRules
+from DataProfiler import HashRows
+from DatasetCache import GetCodeFingerprint
+from DatasetSchema import ApplyAircraftSchema
+from LoadandCleanDatasets import AIRCRAFT_CLEANING_VERSION, AIRCRAFT_CSV_DTYPES, AIRCRAFT_SOURCE_FILE, \
+    CleanAircraftData
+from RegistrationIndex import LoadRegistrationIndex
+
+# Stored aircraft table kept up to date from the monthly snapshots of the OpenSky aircraft database, cleaning and
+# writing only the rows that changed instead of re-cleaning the whole snapshot:
+#
+#   store/aircraft/aircraft.parquet         cleaned aircraft (same rows as GetGlobalAircraftData on the latest snapshot)
+#   store/aircraft/fingerprints.parquet     hash of every raw row of the latest snapshot
+#   store/aircraft/changes/<snapshot>.parquet   the inserts, updates and deletes each snapshot made (audit)
+#   store/aircraft/manifest.json            the snapshots applied, with their change counts
+#
+# Rows are matched on the registration (plus its occurrence number for the few registrations that appear more than
+# once). Each raw row is hashed on its values, and only rows that are new or whose hash changed are cleaned. The
+# cleaned rows are hashed again and compared with the stored rows: new registration = insert, different values =
+# update, gone (or now filtered out by the cleaning) = delete. The ID column is the row number in the snapshot file so
+# it is left out of the hashes and just refreshed for every row.
+#
+# New registrations are added to the registration index. The index is only ever appended to (keys have to stay the
+# same), so deleted registrations keep their key. If the aircraft cleaning code changes the table is rebuilt.
+#
+#   python AircraftSnapshots.py aircraft-database-complete-2022-12.csv
+#   aircraft = LoadAircraftTable()      # in place of GetGlobalAircraftData()
+
+AIRCRAFT_STORE_DIRECTORY = os.environ.get('UCDPA_AIRCRAFT_STORE_DIR', os.path.join('store', 'aircraft'))
+AIRCRAFT_KEY = ['Registration', 'OCCURRENCE']
+AIRCRAFT_CHANGES = ['insert', 'update', 'delete']
+
+
+def GetAircraftCleaningFingerprint():
+    return GetCodeFingerprint([CleanAircraftData, ManufacturerRules]) + '-' + str(AIRCRAFT_CLEANING_VERSION)
+
+
+def GetAircraftStorePath(name, directory=None):
+    return os.path.join(directory or AIRCRAFT_STORE_DIRECTORY, name)
+
+
+def ReadAircraftManifest(directory=None):
+    try:
+        with open(GetAircraftStorePath('manifest.json', directory)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'cleaning': GetAircraftCleaningFingerprint(), 'snapshots': []}
+
+
+def WriteAircraftManifest(manifest, directory=None):
+    temppath = GetAircraftStorePath('manifest.json.tmp', directory)
+    with open(temppath, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temppath, GetAircraftStorePath('manifest.json', directory))
+
+
+def WriteStoreFrame(frame, name, directory=None):
+    temppath = GetAircraftStorePath(name + '.tmp', directory)
+    frame.to_parquet(temppath, index=False)
+    os.replace(temppath, GetAircraftStorePath(name, directory))
+
+
+def ReadStoreFrame(name, directory=None):
+    path = GetAircraftStorePath(name, directory)
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+
+# Hash of each row's values, leaving out the ID and occurrence number. The cleaned rows are hashed as text so a column
+# read with a different dtype in another snapshot hashes the same. The raw rows are hashed as they are, which is much
+# quicker - a column that comes back with another dtype just means its rows are all cleaned again
+def HashAircraftRows(frame, astext=True):
+    values = frame[[column for column in frame.columns if column not in ('ID', 'OCCURRENCE')]]
+    return HashRows(values.astype(str) if astext else values)
+
+
+# Raw snapshot rows with a registration (the cleaning drops the rest), with their occurrence number and raw hash
+def ReadSnapshot(sourcefile):
+    raw = pd.read_csv(sourcefile, dtype=AIRCRAFT_CSV_DTYPES)
+    raw = raw.rename(columns={raw.columns[0]: 'ID'}).dropna(subset=['Registration'])
+    # nearly every registration appears once, so only count the occurrences of the ones that don't
+    raw['OCCURRENCE'] = np.zeros(len(raw), dtype='int32')
+    repeated = raw['Registration'].isin(raw.loc[raw['Registration'].duplicated(), 'Registration'])
+    raw.loc[repeated, 'OCCURRENCE'] = raw[repeated].groupby('Registration').cumcount().astype('int32')
+    return raw.assign(RAW_HASH=HashAircraftRows(raw, astext=False))
+
+
+# Keys of the rows on the left whose hash isn't the same on the right (new or changed) and of the right not on the left
+def DiffHashes(left, right, hashcolumn):
+    joined = left[AIRCRAFT_KEY + [hashcolumn]].merge(right[AIRCRAFT_KEY + [hashcolumn]], on=AIRCRAFT_KEY, how='outer',
+                                                     suffixes=('', '_OLD'), indicator=True)
+    changed = joined[(joined['_merge'] == 'left_only')
+                     | ((joined['_merge'] == 'both') & (joined[hashcolumn] != joined[hashcolumn + '_OLD']))]
+    return changed, joined[joined['_merge'] == 'right_only']
+
+
+# Rows of the frame whose key is in keys - compared as a hash of the key columns, much quicker than a MultiIndex
+def HashKeys(frame):
+    return HashRows(frame[AIRCRAFT_KEY].astype({'Registration': object, 'OCCURRENCE': 'int64'}))
+
+
+def IsKeyIn(frame, keys):
+    return pd.Index(HashKeys(frame)).isin(HashKeys(keys))
+
+
+# The audit rows: new values for inserts/updates (with the columns that changed) and the old values for deletes
+def GetChanges(new, old):
+    joined = new[AIRCRAFT_KEY + ['ROW_HASH']].merge(old[AIRCRAFT_KEY + ['ROW_HASH']], on=AIRCRAFT_KEY, how='outer',
+                                                    suffixes=('', '_OLD'), indicator=True)
+    inserts = joined.loc[joined['_merge'] == 'left_only', AIRCRAFT_KEY]
+    updates = joined.loc[(joined['_merge'] == 'both') & (joined['ROW_HASH'] != joined['ROW_HASH_OLD']), AIRCRAFT_KEY]
+    deletes = joined.loc[joined['_merge'] == 'right_only', AIRCRAFT_KEY]
+
+    changes = [new[IsKeyIn(new, inserts)].assign(CHANGE='insert', CHANGED_COLUMNS=''),
+               old[IsKeyIn(old, deletes)].assign(CHANGE='delete', CHANGED_COLUMNS='')]
+    if len(updates):
+        after = new[IsKeyIn(new, updates)].set_index(AIRCRAFT_KEY)
+        before = old.set_index(AIRCRAFT_KEY).loc[after.index, after.columns]
+        columns = [column for column in after.columns if column not in ('ID', 'ROW_HASH')]
+        # missing values come back from parquet as None rather than NaN
+        different = after[columns].astype(object).fillna('').astype(str).to_numpy() \
+            != before[columns].astype(object).fillna('').astype(str).to_numpy()
+        changed = [','.join(np.array(columns)[row]) for row in different]
+        changes.append(after.reset_index().assign(CHANGE='update', CHANGED_COLUMNS=changed))
+    changes = pd.concat(changes, ignore_index=True).drop(columns=['ROW_HASH'])
+    return changes[['CHANGE'] + [column for column in changes.columns if column != 'CHANGE']]
+
+
+# Apply a snapshot to the stored aircraft table. Returns the summary of what changed
+def IngestAircraftSnapshot(sourcefile, name=None, directory=None):
+    directory = directory or AIRCRAFT_STORE_DIRECTORY
+    manifest = ReadAircraftManifest(directory)
+    if manifest['cleaning'] != GetAircraftCleaningFingerprint():
+        # cleaning code has changed - clean every row again (the change history is kept)
+        for storedname in ['aircraft.parquet', 'fingerprints.parquet']:
+            if os.path.exists(GetAircraftStorePath(storedname, directory)):
+                os.remove(GetAircraftStorePath(storedname, directory))
+        manifest['cleaning'] = GetAircraftCleaningFingerprint()
+    os.makedirs(os.path.join(directory, 'changes'), exist_ok=True)
+    started = time.time()
+
+    raw = ReadSnapshot(sourcefile)
+    fingerprints = ReadStoreFrame('fingerprints.parquet', directory)
+    table = ReadStoreFrame('aircraft.parquet', directory)
+    if fingerprints is None or table is None:
+        fingerprints = pd.DataFrame({'Registration': pd.Series(dtype=object), 'OCCURRENCE': pd.Series(dtype='int32'),
+                                     'RAW_HASH': pd.Series(dtype='uint64')})
+        table = None
+
+    # clean only the new/changed raw rows
+    changedraw, removedraw = DiffHashes(raw, fingerprints, 'RAW_HASH')
+    cleaned = CleanAircraftData(raw[IsKeyIn(raw, changedraw)].drop(columns=['RAW_HASH']))
+    cleaned = cleaned.assign(ROW_HASH=HashAircraftRows(cleaned))
+
+    # the stored rows those raw rows replace
+    if table is None:
+        table = cleaned.iloc[:0]
+    affected = pd.concat([changedraw[AIRCRAFT_KEY], removedraw[AIRCRAFT_KEY]], ignore_index=True)
+    replaced = IsKeyIn(table, affected)
+    changes = GetChanges(cleaned, table[replaced])
+    table = pd.concat([table[~replaced], cleaned], ignore_index=True)
+
+    # the ID is the row number in the snapshot file - take it from the new snapshot for every row
+    table = table.drop(columns=['ID']).merge(raw[AIRCRAFT_KEY + ['ID']], on=AIRCRAFT_KEY, how='left')[table.columns]
+    table = table.sort_values('ID', kind='stable').reset_index(drop=True)
+
+    name = name or os.path.splitext(os.path.basename(sourcefile))[0]
+    WriteStoreFrame(table, 'aircraft.parquet', directory)
+    WriteStoreFrame(raw[AIRCRAFT_KEY + ['RAW_HASH']], 'fingerprints.parquet', directory)
+    WriteStoreFrame(changes, os.path.join('changes', name + '.parquet'), directory)
+    LoadRegistrationIndex(changes.loc[changes['CHANGE'] == 'insert', 'Registration'])
+
+    summary = {'snapshot': name, 'source': os.path.abspath(sourcefile), 'applied': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'raw_rows': len(raw), 'raw_rows_cleaned': len(changedraw), 'raw_rows_removed': len(removedraw),
+               'rows': len(table),
+               'seconds': round(time.time() - started, 2)}
+    summary.update({change + 's': int((changes['CHANGE'] == change).sum()) for change in AIRCRAFT_CHANGES})
+    manifest['snapshots'].append(summary)
+    WriteAircraftManifest(manifest, directory)
+    return summary
+
+
+# The stored aircraft table in the compact schema - same columns as GetGlobalAircraftData()
+def LoadAircraftTable(directory=None):
+    table = pd.read_parquet(GetAircraftStorePath('aircraft.parquet', directory))
+    return ApplyAircraftSchema(table.drop(columns=['OCCURRENCE', 'ROW_HASH']))
+
+
+# The inserts, updates and deletes of every snapshot applied (or just the one named), oldest first
+def GetAircraftChanges(name=None, directory=None):
+    names = [snapshot['snapshot'] for snapshot in ReadAircraftManifest(directory)['snapshots']
+             if name is None or snapshot['snapshot'] == name]
+    frames = [pd.read_parquet(GetAircraftStorePath(os.path.join('changes', snapshot + '.parquet'), directory))
+              .assign(SNAPSHOT=snapshot) for snapshot in dict.fromkeys(names)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['CHANGE', 'SNAPSHOT'])
+
+
+def RunAircraftSnapshotCommandLine(arguments=None):
+    parser = argparse.ArgumentParser(description='Apply an aircraft database snapshot to the stored aircraft table')
+    parser.add_argument('snapshot', nargs='?', default=AIRCRAFT_SOURCE_FILE, help='snapshot csv file')
+    parser.add_argument('--name', help='name the change audit is saved under (default the file name)')
+    parser.add_argument('--rebuild', action='store_true', help='clear the stored table and clean every row again')
+    options = parser.parse_args(arguments)
+    if options.rebuild:
+        for storedname in ['aircraft.parquet', 'fingerprints.parquet']:
+            if os.path.exists(GetAircraftStorePath(storedname)):
+                os.remove(GetAircraftStorePath(storedname))
+    summary = IngestAircraftSnapshot(options.snapshot, options.name)
+    print('Applied ' + summary['snapshot'] + ': ' + str(summary['inserts']) + ' inserts, ' + str(summary['updates'])
+          + ' updates, ' + str(summary['deletes']) + ' deletes (' + str(summary['raw_rows_cleaned']) + ' of '
+          + str(summary['raw_rows']) + ' rows cleaned, ' + str(summary['rows']) + ' aircraft) in '
+          + str(summary['seconds']) + 's')
+
+
+if __name__ == '__main__':
+    RunAircraftSnapshotCommandLine()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Client for the aviationstack API (airports, airlines etc. lookup data).
+#  - the pages of a list are fetched (up to API_MAX_PAGES by default), the ones after the first in parallel on a thread
+#    pool
+#  - one shared requests session so the connections are reused
+#  - timeout on every request and retries with exponential backoff on connection errors, 429 and 5xx responses
+#  - each page is cached on disk for API_CACHE_TTL seconds, keyed on the endpoint and parameters
+#  - results come back as a flat DataFrame
+# The base url and cache folder can be changed (AVIATIONSTACK_BASE_URL / UCDPA_API_CACHE_DIR) so the client can be
+# pointed at a local stub server, or run with offline=True against previously recorded cache files.
+# The access key comes from AVIATIONSTACK_ACCESS_KEY (or accesskey=). It is only needed for pages not in the cache.
+
+API_BASE_URL = os.environ.get('AVIATIONSTACK_BASE_URL', 'http://api.aviationstack.com/v1')
+API_ACCESS_KEY = os.environ.get('AVIATIONSTACK_ACCESS_KEY')
+API_CACHE_DIRECTORY = os.environ.get('UCDPA_API_CACHE_DIR', os.path.join('cache', 'api'))
+API_CACHE_TTL = 24 * 60 * 60  # seconds
+API_PAGE_SIZE = 100  # max page size on the free plan
+API_TIMEOUT = 30  # seconds
+API_RETRIES = 3
+API_BACKOFF = 1.0  # seconds, doubled after each retry
+API_WORKERS = 8
+API_MAX_PAGES = int(os.environ.get('UCDPA_API_MAX_PAGES', '20'))  # default page limit per list, each page uses quota
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+API_SESSIONS = {}
+
+
+class AviationStackError(Exception):
+    pass
+
+
+# Which API_CACHE_TTL period it is now. It moves on once per TTL, so anything built from the API data (e.g. the
+# lookups stage checkpoint - see main.py) can use it in its key to be refreshed as the cached pages expire
+def GetCachePeriod(ttl=API_CACHE_TTL):
+    return int(time.time() // ttl)
+
+
+def GetSession():
+    if 'session' not in API_SESSIONS:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=API_WORKERS, pool_maxsize=API_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        API_SESSIONS['session'] = session
+    return API_SESSIONS['session']
+
+
+# The access key is left out of the cache key - the data doesn't depend on who asked for it
+def GetPageCachePath(endpoint, params, cachedirectory):
+    key = json.dumps({'endpoint': endpoint, 'params': params}, sort_keys=True)
+    return os.path.join(cachedirectory, endpoint + '_' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def ReadCachedPage(path, ttl):
+    try:
+        with open(path) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if ttl is not None and time.time() - cached['fetched'] > ttl:
+        return None
+    return cached['response']
+
+
+def WriteCachedPage(path, response):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temppath = path + '.tmp'
+    with open(temppath, 'w') as file:
+        json.dump({'fetched': time.time(), 'response': response}, file)
+    os.replace(temppath, path)
+
+
+def RequestPage(url, params, timeout, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            response = GetSession().get(url, params=params, timeout=timeout)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.json()
+            error = AviationStackError('HTTP ' + str(response.status_code) + ' from ' + url)
+        except (requests.ConnectionError, requests.Timeout) as requesterror:
+            error = requesterror
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    raise error
+
+
+# One page of an endpoint, from the disk cache if it is fresh enough
+def GetPage(endpoint, params, baseurl=None, accesskey=None, cachedirectory=None, ttl=API_CACHE_TTL, offline=False,
+            timeout=API_TIMEOUT, retries=API_RETRIES, backoff=API_BACKOFF):
+    path = GetPageCachePath(endpoint, params, cachedirectory or API_CACHE_DIRECTORY)
+    page = ReadCachedPage(path, None if offline else ttl)
+    if page is not None:
+        return page
+    if offline:
+        raise AviationStackError('No cached response for ' + endpoint + ' ' + json.dumps(params, sort_keys=True))
+
+    accesskey = accesskey or API_ACCESS_KEY
+    if not accesskey:
+        raise AviationStackError('No aviationstack access key - set AVIATIONSTACK_ACCESS_KEY to fetch ' + endpoint
+                                 + ' (or use offline=True with recorded pages)')
+    url = (baseurl or API_BASE_URL).rstrip('/') + '/' + endpoint
+    page = RequestPage(url, dict(params, access_key=accesskey), timeout, retries, backoff)
+    if 'error' in page:
+        raise AviationStackError(endpoint + ': ' + json.dumps(page['error']))
+    WriteCachedPage(path, page)
+    return page
+
+
+# The pages of a list endpoint (e.g. 'airports', 'airlines') as a DataFrame. The first page gives the total, the rest
+# are fetched in parallel. maxpages limits the number of pages as each page counts against the API plan's quota
+# (maxpages=None fetches every page)
+def GetAviationStackData(endpoint, params=None, pagesize=API_PAGE_SIZE, maxpages=API_MAX_PAGES, workers=API_WORKERS,
+                         **options):
+    params = dict(params or {}, limit=pagesize)
+    first = GetPage(endpoint, dict(params, offset=0), **options)
+    total = first.get('pagination', {}).get('total', len(first['data']))
+
+    offsets = list(range(pagesize, total, pagesize))
+    if maxpages is not None and len(offsets) > maxpages - 1:
+        print(endpoint + ': fetching ' + str(maxpages) + ' of ' + str(len(offsets) + 1) + ' pages (maxpages)')
+        offsets = offsets[:max(maxpages - 1, 0)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = list(pool.map(lambda offset: GetPage(endpoint, dict(params, offset=offset), **options), offsets))
+
+    records = [record for page in [first] + pages for record in page['data']]
+    return pd.json_normalize(records)
@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+import main
+from ChartRenderer import ConfigureCharts, TakeDeferredCharts
+from DatasetSchema import ApplyAircraftSchema, ApplyFlightsSchema
+from Instrumentation import ConfigureInstrumentation, Measure, TakeMeasurements
+from LoadandCleanDatasets import AIRCRAFT_CSV_DTYPES, AIRCRAFT_SOURCE_FILE, CleanAircraftData, CleanFlightsData, \
+    FLIGHTS_CSV_DTYPES, FLIGHTS_SOURCE_FILE
+from SyntheticData import GenerateSyntheticData, SYNTHETIC_SIZES
+from UtilisationRollup import UtilisationRollup
+
+# Times and memory profiles each stage of the analysis on a dataset folder (e.g. one made by SyntheticData):
+#   load          - parse the raw csv files
+#   clean         - clean and convert both datasets to the compact schema
+#   merge         - join flights to aircraft, utilisation rollup, delay buckets and merged profile (main.MergeDatasets)
+#   aggregations  - section 2 aggregation cube and top/bottom 25s (main.AnalyseBlockTime)
+#   utilisation   - utilisation rollup build, a 3500 aircraft fleet lookup and section 3 (main.AnalyseFleetUtilisation)
+#   delays        - section 4 delay analysis from the delay buckets (main.AnalyseDelays)
+# The charts are recorded but not drawn, so only the analysis itself is timed. Each stage is measured with the
+# instrumentation (see Instrumentation): wall and CPU time, the peak memory allocated while it ran (tracemalloc), the
+# process peak RSS and the rows in/out.
+#
+# Each run is appended as one JSON line to benchmarks/history.jsonl along with the git commit and library versions,
+# and the times are compared with the last run on the same dataset, e.g.
+#   python Benchmark.py --size small
+#   python Benchmark.py --directory synthetic/full --no-memory
+# tracemalloc slows down code that makes lots of small Python objects, use --no-memory for the cleanest times.
+
+BENCHMARK_DIRECTORY = os.environ.get('UCDPA_BENCHMARK_DIR', 'benchmarks')
+BENCHMARK_HISTORY = 'history.jsonl'
+BENCHMARK_FLEET_SIZE = 3500
+
+
+@contextlib.contextmanager
+def MeasureStage(stage, rowsin=None):
+    with Measure(stage, rowsin) as measurement:
+        yield measurement
+    print(stage.ljust(14) + str(measurement['seconds']).rjust(10) + 's'
+          + ('  peak ' + str(measurement['peak_mb']) + 'MB' if 'peak_mb' in measurement else ''))
+
+
+# The analysis prints a lot - keep it out of the benchmark output
+def RunQuietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    TakeDeferredCharts()
+    return result
+
+
+def RunBenchmark(directory, memory=True):
+    ConfigureCharts(mode='deferred')
+    ConfigureInstrumentation(enabled=True, memory=memory, logfile=None)
+    TakeMeasurements()
+    previousdirectory = os.getcwd()
+    os.chdir(directory)  # the stages read/write the source files, cache and reports relative to here
+    try:
+        with MeasureStage('load') as measurement:
+            aircraft = pd.read_csv(AIRCRAFT_SOURCE_FILE, dtype=AIRCRAFT_CSV_DTYPES)
+            flights = pd.read_csv(FLIGHTS_SOURCE_FILE, dtype=FLIGHTS_CSV_DTYPES)
+            measurement['rows_out'] = len(flights) + len(aircraft)
+
+        with MeasureStage('clean', len(flights) + len(aircraft)) as measurement:
+            aircraft = ApplyAircraftSchema(CleanAircraftData(aircraft))
+            flights = ApplyFlightsSchema(CleanFlightsData(flights))
+            measurement['rows_out'] = len(flights) + len(aircraft)
+
+        with MeasureStage('merge', len(flights)) as measurement:
+            merged = RunQuietly(main.MergeDatasets, aircraft, flights)
+            measurement['rows_out'] = len(merged['df'])
+
+        with MeasureStage('aggregations', len(merged['df'])):
+            RunQuietly(main.AnalyseBlockTime, merged['df'])
+
+        with MeasureStage('utilisation', len(flights)) as measurement:
+            utilisation = UtilisationRollup(flights, merged['registrations'])
+            fleet = aircraft['Registration'].sample(min(BENCHMARK_FLEET_SIZE, len(aircraft)), random_state=0)
+            measurement['rows_out'] = len(utilisation.GetFleet(fleet))
+            random.seed(0)
+            RunQuietly(main.AnalyseFleetUtilisation, aircraft, flights, utilisation)
+
+        with MeasureStage('delays', len(merged['df'])):
+            RunQuietly(main.AnalyseDelays, merged['delays'], merged['df'])
+    finally:
+        os.chdir(previousdirectory)
+    # only the stages themselves, not any steps measured inside them
+    return [measurement for measurement in TakeMeasurements() if measurement['depth'] == 0]
+
+
+def GetGitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ReadHistory():
+    try:
+        with open(os.path.join(BENCHMARK_DIRECTORY, BENCHMARK_HISTORY)) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except OSError:
+        return []
+
+
+def AppendHistory(record):
+    os.makedirs(BENCHMARK_DIRECTORY, exist_ok=True)
+    with open(os.path.join(BENCHMARK_DIRECTORY, BENCHMARK_HISTORY), 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+# Change in time of each stage since the last run on the same dataset (and with the same memory setting)
+def PrintComparison(record, history):
+    previous = [run for run in history if run['dataset'] == record['dataset'] and run['memory'] == record['memory']]
+    if not previous:
+        return
+    before = {stage['step']: stage for stage in previous[-1]['stages']}
+    print('Compared with ' + str(previous[-1]['commit']) + ' at ' + previous[-1]['timestamp'] + ':')
+    for stage in record['stages']:
+        if stage['step'] in before and before[stage['step']]['seconds']:
+            change = 100 * (stage['seconds'] / before[stage['step']]['seconds'] - 1)
+            print('  ' + stage['step'].ljust(14) + ('%+.1f%%' % change).rjust(9))
+
+
+def RunBenchmarkCommandLine(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the analysis stages')
+    parser.add_argument('--size', help='generate (if needed) and use synthetic data: rows or one of '
+                                       + ', '.join(SYNTHETIC_SIZES))
+    parser.add_argument('--directory', help='folder with the flights and aircraft csv files')
+    parser.add_argument('--no-memory', action='store_true', help="don't trace memory (quicker, cleaner times)")
+    options = parser.parse_args(arguments)
+
+    directory = options.directory or os.path.join('synthetic', options.size or 'small')
+    if not os.path.exists(os.path.join(directory, FLIGHTS_SOURCE_FILE)):
+        size = options.size or 'small'
+        GenerateSyntheticData(SYNTHETIC_SIZES[size] if size in SYNTHETIC_SIZES else int(size), directory)
+
+    stages = RunBenchmark(directory, memory=not options.no_memory)
+    record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': GetGitCommit(),
+              'dataset': os.path.normpath(directory), 'memory': not options.no_memory,
+              'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+              'stages': stages, 'total_seconds': round(sum(stage['seconds'] for stage in stages), 4)}
+    history = ReadHistory()
+    PrintComparison(record, history)
+    AppendHistory(record)
+    return record
+
+
+if __name__ == '__main__':
+    RunBenchmarkCommandLine()
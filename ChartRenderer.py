@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# Runs the chart functions in Charts.py. Two modes:
+#   interactive - (default) draw the chart and plt.show() it, same as running the analysis in pycharm
+#   headless    - save every chart to file (png/svg) without a display. The charts are handed to a pool of worker
+#                 processes so they render in parallel with the rest of the analysis, and matplotlib/seaborn are only
+#                 imported by the workers. Call FinishCharts() at the end of the run to wait for them.
+#   deferred     - only record the charts (see TakeDeferredCharts). Used in worker processes (e.g. StartupLoader) so
+#                 the charts they ask for are handed back and rendered by the main process
+# The mode can be set with the UCDPA_CHART_MODE environment variable (e.g. for scheduled jobs) or ConfigureCharts().
+# Saved charts are named after the chart (e.g. charts/delay_by_month.png) so a chart always goes to the same file
+# whichever stages are run (see Pipeline) and a re-run overwrites it rather than adding another copy.
+
+CHART_SETTINGS = {
+    'mode': os.environ.get('UCDPA_CHART_MODE', 'interactive'),
+    'directory': os.environ.get('UCDPA_CHART_DIR', 'charts'),
+    'formats': os.environ.get('UCDPA_CHART_FORMATS', 'png').split(','),
+    'workers': None,  # None = one per cpu
+}
+
+# Charts submitted in this run, in order: (file name stem, future or list of files)
+RENDERED_CHARTS = []
+CHART_POOL = []
+# Charts recorded in deferred mode: (name, drawfunction, args, kwargs)
+DEFERRED_CHARTS = []
+
+
+def ConfigureCharts(mode=None, directory=None, formats=None, workers=None):
+    for setting, value in (('mode', mode), ('directory', directory), ('formats', formats), ('workers', workers)):
+        if value is not None:
+            CHART_SETTINGS[setting] = value
+
+
+def IsHeadless():
+    return CHART_SETTINGS['mode'] == 'headless'
+
+
+# The file name (without the extension) for a chart. A name used more than once in a run gets _2, _3 etc.
+def GetChartFileStem(name):
+    filestem = os.path.join(CHART_SETTINGS['directory'], re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_'))
+    used = {stem for stem, result in RENDERED_CHARTS}
+    candidate, copy = filestem, 1
+    while candidate in used:
+        copy += 1
+        candidate = filestem + '_' + str(copy)
+    return candidate
+
+
+# Draw the chart with the Agg (no display) backend and save it in each format. Runs in the worker processes
+def DrawAndSaveChart(filestem, drawfunction, args, kwargs, formats):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    try:
+        drawfunction(*args, **kwargs)
+        files = []
+        for fileformat in formats:
+            plt.gcf().savefig(filestem + '.' + fileformat, bbox_inches='tight')
+            files.append(filestem + '.' + fileformat)
+        return files
+    finally:
+        plt.close('all')
+
+
+# The pool forks so the workers don't need to re-import main.py. Where fork isn't available (Windows) the charts are
+# saved one at a time in this process instead
+def GetChartPool():
+    if not CHART_POOL and 'fork' in multiprocessing.get_all_start_methods():
+        CHART_POOL.append(ProcessPoolExecutor(max_workers=CHART_SETTINGS['workers'],
+                                              mp_context=multiprocessing.get_context('fork')))
+    return CHART_POOL[0] if CHART_POOL else None
+
+
+# Show or save a chart. name is used for the file name in headless mode, drawfunction is one of the functions in
+# Charts.py and args/kwargs are passed to it
+def RenderChart(name, drawfunction, *args, **kwargs):
+    if CHART_SETTINGS['mode'] == 'deferred':
+        DEFERRED_CHARTS.append((name, drawfunction, args, kwargs))
+        return
+    if not IsHeadless():
+        import matplotlib.pyplot as plt
+        drawfunction(*args, **kwargs)
+        plt.show()
+        return
+
+    os.makedirs(CHART_SETTINGS['directory'], exist_ok=True)
+    filestem = GetChartFileStem(name)
+    pool = GetChartPool()
+    if pool is None:
+        RENDERED_CHARTS.append((filestem, DrawAndSaveChart(filestem, drawfunction, args, kwargs,
+                                                           CHART_SETTINGS['formats'])))
+    else:
+        RENDERED_CHARTS.append((filestem, pool.submit(DrawAndSaveChart, filestem, drawfunction, args, kwargs,
+                                                      CHART_SETTINGS['formats'])))
+
+
+# The charts recorded in deferred mode, to be passed on to RenderChart by another process
+def TakeDeferredCharts():
+    charts = list(DEFERRED_CHARTS)
+    DEFERRED_CHARTS.clear()
+    return charts
+
+
+# Wait for all the charts to be saved and shut down the pool. Returns the list of files written. A chart that fails
+# is reported but doesn't stop the others
+def FinishCharts():
+    files = []
+    for filestem, result in RENDERED_CHARTS:
+        try:
+            files.extend(result.result() if hasattr(result, 'result') else result)
+        except Exception as error:
+            print('Chart ' + filestem + ' failed: ' + repr(error))
+    if CHART_POOL:
+        CHART_POOL.pop().shutdown()
+    if IsHeadless():
+        print(str(len(files)) + ' chart files saved to ' + CHART_SETTINGS['directory'])
+    RENDERED_CHARTS.clear()
+    return files
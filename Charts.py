@@ -0,0 +1,77 @@
+# Chart drawing functions used by main.py and LoadandCleanDatasets.py. Each function takes data that has already been
+# aggregated and draws one figure. They are run through ChartRenderer.RenderChart which either shows the figure or saves
+# it to file, possibly in a separate worker process - so matplotlib/seaborn are only imported inside the functions and
+# the functions must stay at module level.
+
+
+# Bar chart with the % of missing values per column
+def DrawMissingValues(missing, title):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(9, 9))
+    plt.title(title, fontsize=16, fontweight='bold')
+    sns.barplot(x=missing.values, y=missing.index, palette='Blues_r')
+    plt.xlim(0, 1)
+
+
+def DrawCorrelationMatrix(corrmat, title, label):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.subplots(figsize=(12, 9))
+    sns.heatmap(corrmat, vmax=.8, square=True)
+    plt.title(title, fontsize=14)
+    plt.ylabel(label)
+    plt.xlabel(label)
+
+
+# Pie chart of the counts with a bar chart of the same counts beside it. order sets the order of the bars (defaults to
+# the order of the counts) and legendloc adds a legend to both charts
+def DrawPieAndCount(counts, title=None, figsize=(14, 6), explode=None, order=None, legendloc=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    f, ax = plt.subplots(1, 2, figsize=figsize)
+    counts.plot.pie(explode=explode, autopct='%1.1f%%', ax=ax[0], shadow=True)
+    ax[0].set_ylabel('')
+    sns.barplot(x=counts.index, y=counts.values, order=counts.index if order is None else order, ax=ax[1])
+    if title is not None:
+        ax[0].set_title(title)
+        ax[1].set_title(title)
+        ax[1].set_ylabel('')
+        ax[1].set_xlabel('')
+    if legendloc is not None:
+        ax[0].legend(ncol=2, loc=legendloc)
+        ax[1].legend(ncol=2, loc=legendloc)
+
+
+# Standard pandas plot of a series/frame. legend: None keeps the pandas legend, False hides it or a dict of
+# plt.legend arguments
+def DrawFramePlot(data, kind='line', figsize=None, subplots=False, title=None, xlabel=None, ylabel=None, legend=None):
+    import matplotlib.pyplot as plt
+
+    data.plot(kind=kind, figsize=figsize, subplots=subplots)
+    if legend is False:
+        plt.legend('', frameon=False)  # hide legend
+    elif legend is not None:
+        plt.legend(**legend)
+    if title is not None:
+        plt.title(title, fontsize=14)
+    if ylabel is not None:
+        plt.ylabel(ylabel)
+    if xlabel is not None:
+        plt.xlabel(xlabel)
+
+
+# Two line charts side by side, e.g. average and total delay by month
+def DrawSideBySide(left, lefttitle, right, righttitle, figsize=(14, 8), legendloc='upper right'):
+    import matplotlib.pyplot as plt
+
+    f, ax = plt.subplots(1, 2, figsize=figsize)
+    left.plot(ax=ax[0])
+    ax[0].set_title(lefttitle)
+    right.plot(ax=ax[1])
+    ax[1].set_title(righttitle)
+    ax[0].legend(ncol=2, loc=legendloc)
+    ax[1].legend(ncol=2, loc=legendloc)
@@ -0,0 +1,144 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Pearson correlation matrix of the numeric columns built up one chunk at a time, so it works on streamed/partitioned
+# data (GetFlightsDataChunks, the flight store) as well as a frame in memory, and memory use only depends on the chunk
+# size. Same result as frame.corr(): each pair of columns uses the rows where both have a value.
+#
+# For every pair of columns the accumulator keeps the number of rows, the means, the sums of squared differences and
+# the sum of cross products of differences (co-moment). Chunks and accumulators from other processes are merged with
+# the parallel variance formula, which stays accurate where raw sums of squares would lose precision.
+#
+# With sample set only that fraction of the rows (chosen with a seeded random number per row) is used, which is much
+# quicker for a first look. The result then includes confidence intervals from the Fisher z transform.
+#
+# With weight set each row counts that many times - e.g. SAMPLE_WEIGHT for a stratified sample (see FlightSampling),
+# where small strata are oversampled, so the correlation is an estimate for all the flights. Columns that aren't data
+# (e.g. the sampling columns) can be left out of the default columns with exclude.
+
+CORRELATION_CHUNKSIZE = 500000
+CORRELATION_CONFIDENCE = 0.95
+
+
+def GetNumericColumns(frame, exclude=()):
+    return [column for column in frame.columns
+            if pd.api.types.is_numeric_dtype(frame[column].dtype) and column not in exclude]
+
+
+# Slices of a frame in memory, so a large frame isn't copied to float64 all at once
+def IterFrameChunks(frame, chunksize=CORRELATION_CHUNKSIZE):
+    for start in range(0, len(frame), chunksize):
+        yield frame.iloc[start:start + chunksize]
+
+
+class CorrelationAccumulator:
+    # Matrices are columns x columns: [i, j] is for column i over the rows where columns i and j both have a value.
+    # count is the (weighted) number of rows and rows the number of rows actually seen, used for the intervals
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.count = np.zeros((size, size))
+        self.rows = np.zeros((size, size))
+        self.mean = np.zeros((size, size))
+        self.m2 = np.zeros((size, size))
+        self.comoment = np.zeros((size, size))
+
+    def Add(self, chunk, weight=None):
+        values = chunk[self.columns].to_numpy(dtype='float64')
+        valid = ~np.isnan(values)
+        # shift each column by its first value - the result is the same but the sums below stay small, and whole
+        # number columns stay whole so a column with only one value over a pair's rows gives exactly 0 (no correlation)
+        first = valid.argmax(axis=0)
+        shift = np.where(valid.any(axis=0), values[first, np.arange(values.shape[1])], 0)
+        values = np.where(valid, values - shift, 0)
+        valid = valid.astype('float64')
+        weights = None if weight is None else chunk[weight].to_numpy(dtype='float64')[:, None]
+        weighted = valid if weights is None else valid * weights
+
+        other = CorrelationAccumulator(self.columns)
+        other.rows = valid.T @ valid
+        other.count = weighted.T @ valid
+        sums = values.T @ weighted
+        mean = np.divide(sums, other.count, out=np.zeros_like(sums), where=other.count > 0)
+        other.mean = mean + shift[:, None]
+        other.m2 = (values ** 2).T @ weighted - sums * mean
+        other.comoment = (values if weights is None else values * weights).T @ values - sums * mean.T
+        self.Merge(other)
+
+    def Merge(self, other):
+        count = self.count + other.count
+        weight = np.divide(self.count * other.count, count, out=np.zeros_like(count), where=count > 0)
+        delta = other.mean - self.mean
+        self.m2 = self.m2 + other.m2 + delta ** 2 * weight
+        self.comoment = self.comoment + other.comoment + delta * delta.T * weight
+        self.mean = self.mean + np.divide(delta * other.count, count, out=np.zeros_like(count), where=count > 0)
+        self.count = count
+        self.rows = self.rows + other.rows
+
+    def GetCorrelation(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = self.comoment / np.sqrt(self.m2 * self.m2.T)
+        correlation[(self.m2 <= 0) | (self.m2.T <= 0) | (self.count < 1)] = np.nan
+        return pd.DataFrame(np.clip(correlation, -1, 1), index=self.columns, columns=self.columns)
+
+    # Fisher z confidence interval of each correlation (needs more than 3 rows for the pair)
+    def GetConfidenceIntervals(self, confidence=CORRELATION_CONFIDENCE):
+        correlation = self.GetCorrelation()
+        z = np.arctanh(correlation.to_numpy().clip(-0.999999, 0.999999))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = NormalDist().inv_cdf(0.5 + confidence / 2) / np.sqrt(np.where(self.rows > 3, self.rows - 3, np.nan))
+        lower = pd.DataFrame(np.tanh(z - error), index=self.columns, columns=self.columns)
+        upper = pd.DataFrame(np.tanh(z + error), index=self.columns, columns=self.columns)
+        return lower, upper
+
+
+def AccumulateCorrelation(chunks, columns=None, sample=None, seed=0, weight=None, exclude=()):
+    random = np.random.default_rng(seed)
+    accumulator = None
+    for chunk in chunks:
+        if accumulator is None:
+            accumulator = CorrelationAccumulator(columns or GetNumericColumns(chunk, list(exclude) + [weight]))
+        if sample is not None:
+            chunk = chunk[random.random(len(chunk)) < sample]
+        accumulator.Add(chunk, weight)
+    return accumulator
+
+
+# Accumulate each source in a worker process - readfunction(source) returns the chunk(s) of one source, e.g.
+#   AccumulateCorrelationInParallel(partfiles, pd.read_parquet, columns)
+# readfunction must be a module level function. Without fork (Windows) the sources are done one at a time
+def AccumulateCorrelationInParallel(sources, readfunction, columns, sample=None, seed=0, workers=None):
+    arguments = [(readfunction, source, columns, sample, seed + number) for number, source in enumerate(sources)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            accumulators = list(pool.map(AccumulateSource, arguments))
+    else:
+        accumulators = [AccumulateSource(argument) for argument in arguments]
+
+    accumulator = CorrelationAccumulator(columns)
+    for other in accumulators:
+        if other is not None:
+            accumulator.Merge(other)
+    return accumulator
+
+
+def AccumulateSource(argument):
+    readfunction, source, columns, sample, seed = argument
+    chunks = readfunction(source)
+    return AccumulateCorrelation([chunks] if isinstance(chunks, pd.DataFrame) else chunks, columns, sample, seed)
+
+
+# Correlation matrix of a frame or an iterable of chunks - same as frame.corr() on the numeric columns.
+# With sample (a fraction of the rows) returns (correlation, lower, upper) with the confidence intervals. weight is a
+# column of row weights and exclude the columns to leave out when columns isn't given
+def GetCorrelationMatrix(data, columns=None, sample=None, seed=0, confidence=CORRELATION_CONFIDENCE, weight=None,
+                         exclude=()):
+    chunks = IterFrameChunks(data) if isinstance(data, pd.DataFrame) else data
+    accumulator = AccumulateCorrelation(chunks, columns, sample, seed, weight, exclude)
+    if sample is None:
+        return accumulator.GetCorrelation()
+    return (accumulator.GetCorrelation(),) + accumulator.GetConfidenceIntervals(confidence)
@@ -0,0 +1,251 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Data profiling. Replaces the separate info(), describe(), isnull().sum() and duplicated() calls with one profile per
+# cleaning stage holding, for every column, the null count/rate, distinct count and a numeric summary, plus the number
+# of duplicate rows (found by hashing each row rather than comparing them). The profiles for each stage of a dataset
+# are collected in a ProfileReport and written out as JSON and HTML with the change between stages.
+#
+# Streamed data is profiled one chunk at a time with ChunkedProfile. Counts, nulls, mean/std and min/max are exact.
+# Quantiles come from a bottom-k sample and with approximate=True the distinct counts and duplicate rows use
+# HyperLogLog so the memory used doesn't grow with the data. HyperLogLog is within a couple of % of the distinct count,
+# so the approximate duplicate row count (rows - distinct rows) is only a rough guide when duplicates are rare.
+# Columns that aren't data (e.g. the sampling columns of a sampled dataset) can be left out of a report with exclude.
+
+REPORT_DIRECTORY = os.environ.get('UCDPA_REPORT_DIR', 'reports')
+QUANTILES = [0.25, 0.5, 0.75]
+QUANTILE_SAMPLE_SIZE = 10000
+HLL_PRECISION = 12
+
+
+def IsNumeric(column):
+    return pd.api.types.is_numeric_dtype(column.dtype) and not pd.api.types.is_bool_dtype(column.dtype)
+
+
+def HashRows(frame):
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def HashValues(column):
+    return pd.util.hash_pandas_object(column.dropna(), index=False).to_numpy()
+
+
+# mean and std are filled in by the caller - the quantiles come from the values passed in, which may be a sample
+def SummariseNumbers(minimum, maximum, quantilevalues):
+    summary = {'mean': None, 'std': None, 'min': None, 'max': None}
+    summary.update({'%d%%' % (quantile * 100): None for quantile in QUANTILES})
+    if len(quantilevalues) == 0:
+        return summary
+    summary.update({'min': float(minimum), 'max': float(maximum)})
+    summary.update({'%d%%' % (quantile * 100): float(value)
+                    for quantile, value in zip(QUANTILES, np.quantile(quantilevalues, QUANTILES))})
+    return summary
+
+
+# Profile of a whole frame in memory
+def ProfileFrame(frame):
+    rowhashes = HashRows(frame)
+    profile = {'rows': len(frame), 'duplicate_rows': int(len(rowhashes) - len(np.unique(rowhashes))), 'columns': {}}
+    for column in frame.columns:
+        values = frame[column]
+        nulls = int(values.isna().sum())
+        stats = {'dtype': str(values.dtype), 'nulls': nulls, 'null_rate': nulls / len(frame) if len(frame) else 0.0,
+                 'distinct': int(values.nunique())}
+        if IsNumeric(values):
+            numbers = values.dropna().to_numpy(dtype='float64')
+            if len(numbers) == 0:
+                stats.update(SummariseNumbers(None, None, numbers))
+            else:
+                stats.update(SummariseNumbers(numbers.min(), numbers.max(), numbers))
+                stats['mean'] = float(numbers.mean())
+                stats['std'] = float(numbers.std(ddof=1)) if len(numbers) > 1 else None
+        profile['columns'][column] = stats
+    return profile
+
+
+# HyperLogLog distinct count estimate from 64 bit hashes - 2^HLL_PRECISION one byte registers
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype='uint8')
+
+    def Add(self, hashes):
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype='uint64')
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype('int64')
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # position of the first 1 bit in the remaining bits (bits + 1 if they are all 0)
+        bitlength = np.where(rest > 0, np.frexp(rest.astype('float64'))[1], 0)
+        rank = np.minimum(bits - bitlength + 1, bits + 1).astype('uint8')
+        maximum = pd.Series(rank).groupby(index).max()
+        self.registers[maximum.index] = np.maximum(self.registers[maximum.index], maximum.to_numpy())
+
+    def Merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def Count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / np.sum(np.power(2.0, -self.registers.astype('float64')))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * size and zeros > 0:
+            estimate = size * np.log(size / zeros)  # small range correction
+        return int(round(estimate))
+
+
+# Uniform sample of at most size values kept by giving every value a random key and keeping the smallest keys.
+# Two samples merge by keeping the smallest keys of both
+class BottomKSample:
+    def __init__(self, size=QUANTILE_SAMPLE_SIZE, seed=0):
+        self.size = size
+        self.random = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.values = np.empty(0)
+
+    def Add(self, values):
+        self.Merge(self.random.random(len(values)), values)
+
+    def Merge(self, keys, values):
+        keys = np.concatenate([self.keys, keys])
+        values = np.concatenate([self.values, values])
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size)[:self.size]
+            keys, values = keys[keep], values[keep]
+        self.keys, self.values = keys, values
+
+
+# Profile built up one chunk at a time, e.g.
+#   profile = ChunkedProfile(approximate=True)
+#   for chunk in GetFlightsDataChunks():
+#       profile.Add(chunk)
+#   print(profile.Result())
+class ChunkedProfile:
+    def __init__(self, approximate=False):
+        self.approximate = approximate
+        self.rows = 0
+        self.columns = {}
+        self.rowhashes = HyperLogLog() if approximate else np.empty(0, dtype='uint64')
+
+    def Add(self, chunk):
+        self.rows += len(chunk)
+        rowhashes = HashRows(chunk)
+        if self.approximate:
+            self.rowhashes.Add(rowhashes)
+        else:
+            self.rowhashes = np.union1d(self.rowhashes, rowhashes)
+        for column in chunk.columns:
+            self.AddColumn(column, chunk[column])
+
+    def AddColumn(self, column, values):
+        if column not in self.columns:
+            self.columns[column] = {
+                'dtype': str(values.dtype), 'nulls': 0, 'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None,
+                'numeric': IsNumeric(values), 'sample': BottomKSample(seed=len(self.columns)),
+                'distinct': HyperLogLog() if self.approximate else set(),
+            }
+        stats = self.columns[column]
+        stats['nulls'] += int(values.isna().sum())
+        if self.approximate:
+            stats['distinct'].Add(HashValues(values))
+        else:
+            stats['distinct'].update(values.dropna().unique().tolist())
+        if stats['numeric']:
+            numbers = values.dropna().to_numpy(dtype='float64')
+            if len(numbers) == 0:
+                return
+            # merge this chunk's count/mean/m2 into the running totals (parallel variance formula)
+            count, mean = len(numbers), numbers.mean()
+            m2 = np.sum((numbers - mean) ** 2)
+            total = stats['count'] + count
+            delta = mean - stats['mean']
+            stats['m2'] += m2 + delta ** 2 * stats['count'] * count / total
+            stats['mean'] += delta * count / total
+            stats['count'] = total
+            stats['min'] = numbers.min() if stats['min'] is None else min(stats['min'], numbers.min())
+            stats['max'] = numbers.max() if stats['max'] is None else max(stats['max'], numbers.max())
+            stats['sample'].Add(numbers)
+
+    def Result(self):
+        distinctrows = self.rowhashes.Count() if self.approximate else len(self.rowhashes)
+        profile = {'rows': self.rows, 'duplicate_rows': max(self.rows - distinctrows, 0),
+                   'approximate': self.approximate, 'columns': {}}
+        for column, stats in self.columns.items():
+            distinct = stats['distinct'].Count() if self.approximate else len(stats['distinct'])
+            result = {'dtype': stats['dtype'], 'nulls': stats['nulls'],
+                      'null_rate': stats['nulls'] / self.rows if self.rows else 0.0, 'distinct': distinct}
+            if stats['numeric']:
+                result.update(SummariseNumbers(stats['min'], stats['max'], stats['sample'].values))
+                if stats['count']:
+                    result['mean'] = float(stats['mean'])
+                    result['std'] = float(np.sqrt(stats['m2'] / (stats['count'] - 1))) if stats['count'] > 1 else None
+            profile['columns'][column] = result
+        return profile
+
+
+# One row per column - used for printing and the html report
+def GetProfileTable(profile):
+    return pd.DataFrame.from_dict(profile['columns'], orient='index')
+
+
+def PrintProfile(name, profile):
+    print(name + ' - rows: ' + str(profile['rows']) + ', duplicate rows: ' + str(profile['duplicate_rows']))
+    print(GetProfileTable(profile))
+
+
+# Change between two stages: rows, duplicates and per column null rate/distinct count (columns added or removed
+# show as missing on one side)
+def CompareProfiles(before, after):
+    table = GetProfileTable(before)[['null_rate', 'distinct']].join(
+        GetProfileTable(after)[['null_rate', 'distinct']], how='outer', lsuffix='_before', rsuffix='_after')
+    return {'rows_before': before['rows'], 'rows_after': after['rows'],
+            'duplicate_rows_before': before['duplicate_rows'], 'duplicate_rows_after': after['duplicate_rows'],
+            'columns': json.loads(table.to_json(orient='index'))}
+
+
+# Profiles for each stage of one dataset, e.g. raw -> cleaned
+class ProfileReport:
+    def __init__(self, name, exclude=()):
+        self.name = name
+        self.exclude = list(exclude)
+        self.stages = {}
+
+    def AddStage(self, stage, frame, show=True):
+        profile = frame if isinstance(frame, dict) else ProfileFrame(frame.drop(columns=self.exclude, errors='ignore'))
+        self.stages[stage] = profile
+        if show:
+            PrintProfile(self.name + ' (' + stage + ')', profile)
+        return profile
+
+    def GetComparisons(self):
+        stages = list(self.stages)
+        return {before + ' -> ' + after: CompareProfiles(self.stages[before], self.stages[after])
+                for before, after in zip(stages, stages[1:])}
+
+    # Write <name>.json and <name>.html to the report folder
+    def Write(self, directory=None):
+        directory = directory or REPORT_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+        report = {'dataset': self.name, 'stages': self.stages, 'comparisons': self.GetComparisons()}
+        with open(os.path.join(directory, self.name + '.json'), 'w') as file:
+            json.dump(report, file, indent=2, default=str)
+
+        html = ['<html><head><title>Profile - ' + self.name + '</title></head><body>',
+                '<h1>Profile - ' + self.name + '</h1>']
+        for stage, profile in self.stages.items():
+            html.append('<h2>' + stage + ' - rows: ' + str(profile['rows']) + ', duplicate rows: '
+                        + str(profile['duplicate_rows']) + '</h2>')
+            html.append(GetProfileTable(profile).to_html(float_format=lambda value: '%.4g' % value))
+        for comparison, change in report['comparisons'].items():
+            html.append('<h2>' + comparison + ' - rows: ' + str(change['rows_before']) + ' -> '
+                        + str(change['rows_after']) + '</h2>')
+            table = pd.DataFrame.from_dict(change['columns'], orient='index')
+            html.append(table.to_html(float_format=lambda value: '%.4g' % value))
+        html.append('</body></html>')
+        with open(os.path.join(directory, self.name + '.html'), 'w') as file:
+            file.write('\n'.join(html))
@@ -0,0 +1,128 @@
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+# Columnar on-disk cache for the cleaned datasets. Parsing and cleaning the raw CSV files takes much longer than any of
+# the analysis that follows it, so the cleaned frames are saved to Parquet and reloaded on the next run.
+# A cached frame is only reused when the source file (size, modified time and content hash) and the cleaning logic
+# (version number and the source code of the cleaning functions) are the same as when the cache was written.
+
+CACHE_DIRECTORY = os.environ.get('UCDPA_CACHE_DIR', 'cache')
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+try:
+    import pyarrow  # noqa: F401 - only needed by pandas for reading/writing parquet
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+
+def GetCachePath(name, extension='parquet'):
+    return os.path.join(CACHE_DIRECTORY, name + '.' + extension)
+
+
+# Hash the full content of a file in blocks so large files don't need to be held in memory
+def GetFileHash(filename):
+    filehash = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            filehash.update(block)
+    return filehash.hexdigest()
+
+
+# Fingerprint of a source file. Hashing a 600MB CSV is not free, so the hash from the previous manifest is reused
+# if the size and modified time have not changed
+def GetFileFingerprint(filename, previous=None):
+    stat = os.stat(filename)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if previous is not None and previous.get('size') == fingerprint['size'] and previous.get('mtime') == fingerprint['mtime']:
+        fingerprint['sha1'] = previous['sha1']
+    else:
+        fingerprint['sha1'] = GetFileHash(filename)
+    return fingerprint
+
+
+# Fingerprint of the cleaning code - any edit to the functions or modules passed in will invalidate the cache
+def GetCodeFingerprint(codeobjects):
+    codehash = hashlib.sha1()
+    for codeobject in codeobjects:
+        codehash.update(inspect.getsource(codeobject).encode('utf-8'))
+    return codehash.hexdigest()
+
+
+# The schema is either a function that takes and returns the frame or a dict of column -> dtype. Only cast the
+# columns that exist in the frame - e.g. the first column name depends on how the csv was saved
+def ApplySchema(frame, schema):
+    if not schema:
+        return frame
+    if callable(schema):
+        return schema(frame)
+    schema = {column: dtype for column, dtype in schema.items() if column in frame.columns}
+    return frame.astype(schema, copy=False)
+
+
+def ReadManifest(name):
+    try:
+        with open(GetCachePath(name, 'json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def WriteManifest(name, manifest):
+    with open(GetCachePath(name, 'json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+def WriteCachedFrame(name, frame):
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    # write to a temp file first so a crash half way through never leaves a corrupt cache behind
+    temppath = GetCachePath(name, 'parquet.tmp')
+    frame.to_parquet(temppath, index=False)
+    os.replace(temppath, GetCachePath(name))
+
+
+# Load a cleaned dataset from the cache, or build it with buildfunction() and save it to the cache.
+#   name          - name of the cache entry (e.g. 'flights')
+#   sourcefile    - raw file the dataset is built from
+#   buildfunction - function with no arguments that reads and cleans the source file
+#   version       - cleaning logic version, bump this to force a rebuild
+#   schema        - dict of column -> dtype (or a function) applied to the cleaned frame before it is saved and after
+#                   it is loaded
+#   codeobjects   - functions/modules whose source code is part of the cache key
+#   read          - False makes sure the cache is up to date and returns its path instead of the frame (e.g. for a
+#                   worker process, so the frame isn't sent back through a pipe). Without pyarrow it is the frame
+def LoadCachedDataset(name, sourcefile, buildfunction, version, schema=None, codeobjects=(), read=True):
+    if not PARQUET_AVAILABLE:
+        print('pyarrow is not installed - ' + name + ' dataset cache disabled')
+        return ApplySchema(buildfunction(), schema)
+
+    manifest = ReadManifest(name)
+    previous = manifest['source'] if manifest else None
+    key = {
+        'source': GetFileFingerprint(sourcefile, previous),
+        'version': version,
+        'code': GetCodeFingerprint(codeobjects),
+    }
+
+    if manifest is not None and os.path.exists(GetCachePath(name)) \
+            and manifest['source']['sha1'] == key['source']['sha1'] \
+            and manifest['version'] == key['version'] and manifest['code'] == key['code']:
+        if manifest['source'] != key['source']:
+            # file was touched but the content is the same - record the new mtime so we skip hashing next time
+            WriteManifest(name, dict(manifest, source=key['source']))
+        if not read:
+            return GetCachePath(name)
+        print('Loading ' + name + ' dataset from cache - ' + GetCachePath(name))
+        return ApplySchema(pd.read_parquet(GetCachePath(name)), schema)
+
+    print('Building ' + name + ' dataset cache from ' + sourcefile)
+    frame = ApplySchema(buildfunction(), schema)
+    WriteCachedFrame(name, frame)
+    key['schema'] = {column: str(dtype) for column, dtype in frame.dtypes.items()}
+    key['rows'] = len(frame)
+    WriteManifest(name, key)
+    return frame if read else GetCachePath(name)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+# Compact in-memory schema for the cleaned datasets. Repeated strings (airlines, tails, airports, aircraft types etc.)
+# are stored as categoricals and the numeric fields are downcast to the smallest type that holds the values, which cuts
+# the memory used by the merged flights/aircraft frame several times over.
+#
+# Categories are shared between datasets through SHARED_CATEGORIES - e.g. TAIL_NUMBER in flights and Registration in
+# aircraft use the same 'registration' categories, so the two frames can be merged on the category codes.
+
+FLIGHTS_SCHEMA = {'ID': 'int32', 'YEAR': 'int16', 'MONTH': 'int8', 'DAY': 'int8', 'DAY_OF_WEEK': 'category',
+                  'AIRLINE': 'category', 'TAIL_NUMBER': 'category', 'ORIGIN_AIRPORT': 'category',
+                  'DESTINATION_AIRPORT': 'category', 'DEPARTURE_TIME': 'float32', 'DEPARTURE_DELAY': 'float32',
+                  'TAXI_OUT': 'float32', 'WHEELS_OFF': 'float32', 'SCHEDULED_TIME': 'float32', 'AIR_TIME': 'float32',
+                  'DISTANCE': 'int16', 'WHEELS_ON': 'float32', 'TAXI_IN': 'float32', 'ARRIVAL_TIME': 'float32',
+                  'ARRIVAL_DELAY': 'float32', 'DIVERTED': 'int8', 'CANCELLED': 'int8', 'CANCELLATION_REASON': 'category',
+                  'AIR_SYSTEM_DELAY': 'float32', 'SECURITY_DELAY': 'float32', 'AIRLINE_DELAY': 'float32',
+                  'LATE_AIRCRAFT_DELAY': 'float32', 'WEATHER_DELAY': 'float32', 'DEPARTURE_DATE': 'datetime64[ns]',
+                  'BLOCK_TIME': 'float32', 'BLOCK_FLIGHT_VARIANCE': 'float32', 'DELAY_STATUS': 'float32'}
+
+AIRCRAFT_SCHEMA = {'ID': 'int32', 'Registration': 'category', 'Manufacturer': 'category', 'Aircraft_type': 'category',
+                   'Aircraft_family': 'category'}
+
+# Which shared category dictionary each categorical column uses
+CATEGORY_DOMAINS = {'AIRLINE': 'airline', 'TAIL_NUMBER': 'registration', 'Registration': 'registration',
+                    'ORIGIN_AIRPORT': 'airport', 'DESTINATION_AIRPORT': 'airport', 'DAY_OF_WEEK': 'day_of_week',
+                    'Manufacturer': 'manufacturer', 'Aircraft_type': 'aircraft_type',
+                    'Aircraft_family': 'aircraft_family', 'CANCELLATION_REASON': 'cancellation_reason'}
+
+# domain -> pd.Index of categories. New values are only ever appended so existing codes never change
+SHARED_CATEGORIES = {
+    'day_of_week': pd.Index(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                            dtype=object),
+}
+
+
+# Add any new values in the column to the shared dictionary for its domain and encode against the full dictionary
+def EncodeSharedCategorical(values, domain):
+    known = SHARED_CATEGORIES.get(domain, pd.Index([], dtype=object))
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        found = values.cat.remove_unused_categories().cat.categories
+    else:
+        found = pd.Index(values.dropna().unique())
+    new = found[~found.isin(known)]
+    if len(new) > 0:
+        known = known.append(new.astype(object))
+        SHARED_CATEGORIES[domain] = known
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.set_categories(known)
+    return pd.Series(pd.Categorical(values, categories=known), index=values.index, name=values.name)
+
+
+# Integers are only downcast if every value fits in the smaller type and floats only if no precision is lost
+def ValuesFit(values, dtype):
+    if len(values) == 0:
+        return True
+    if np.issubdtype(dtype, np.integer):
+        if not pd.api.types.is_integer_dtype(values.dtype):
+            return False
+        limits = np.iinfo(dtype)
+        return limits.min <= values.min() and values.max() <= limits.max
+    if np.issubdtype(dtype, np.floating):
+        original = values.to_numpy(dtype='float64')
+        return np.array_equal(original.astype(dtype).astype('float64'), original, equal_nan=True)
+    return True
+
+
+def CompactColumn(values, column, dtype):
+    if dtype == 'category':
+        return EncodeSharedCategorical(values, CATEGORY_DOMAINS.get(column, column))
+    dtype = np.dtype(dtype)
+    if values.dtype == dtype:
+        return values
+    if (np.issubdtype(dtype, np.integer) or np.issubdtype(dtype, np.floating)) and not ValuesFit(values, dtype):
+        print('Column ' + column + ' does not fit in ' + str(dtype) + ' - leaving it as ' + str(values.dtype))
+        return values
+    return values.astype(dtype)
+
+
+# Memory used per column before and after compacting (in MB)
+def GetMemoryReport(before, after):
+    report = pd.DataFrame({'before_mb': before, 'after_mb': after}).div(1024 * 1024)
+    report.loc['TOTAL'] = report.sum()
+    report['reduction'] = report['before_mb'] / report['after_mb']
+    return report.round(2)
+
+
+# Apply the compact schema to a frame. Columns not in the schema are left as they are
+def ApplyCompactSchema(frame, schema, report=False):
+    if report:
+        before = frame.memory_usage(index=False, deep=True)
+    for column, dtype in schema.items():
+        if column in frame.columns:
+            frame[column] = CompactColumn(frame[column], column, dtype)
+    if report:
+        print(GetMemoryReport(before, frame.memory_usage(index=False, deep=True)))
+    return frame
+
+
+def ApplyFlightsSchema(flights, report=False):
+    return ApplyCompactSchema(flights, FLIGHTS_SCHEMA, report)
+
+
+def ApplyAircraftSchema(aircraft, report=False):
+    return ApplyCompactSchema(aircraft, AIRCRAFT_SCHEMA, report)
+
+
+# Frames encoded earlier can be missing categories added to the shared dictionary since (e.g. registrations only in
+# the aircraft dataset). Bring every shared categorical column up to the full dictionary - needed before merging or
+# concatenating frames, otherwise pandas falls back to comparing the strings. Existing codes don't change.
+def AlignSharedCategories(*frames):
+    for frame in frames:
+        for column, domain in CATEGORY_DOMAINS.items():
+            if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) \
+                    and domain in SHARED_CATEGORIES \
+                    and not frame[column].cat.categories.equals(SHARED_CATEGORIES[domain]):
+                frame[column] = frame[column].cat.set_categories(SHARED_CATEGORIES[domain])
+    return frames
@@ -0,0 +1,84 @@
+import pandas as pd
+
+# Flight, arrival delay and delay cause totals per day x airline x delay status x cancellation reason. Built in one
+# pass over the flights and kept instead of the rows for the delay analysis (section 4), so each delay/cancellation
+# chart and any daily/weekly/monthly roll-up is a small groupby of the buckets rather than a filter and scan of the full
+# frame, e.g.
+#   buckets = BuildDelayBuckets(df)
+#   RollUpDelays(buckets, 'week', by=['AIRLINE'], statuses=[1, 2])    # delayed flights per airline per week
+#
+# Each bucket has the number of flights, and for the arrival delay and each delay cause the sum and the number of
+# flights with a value (<column>_COUNT), so means can be worked out at any level. Totals of separate chunks/partitions
+# are combined with CombineDelayBuckets. Rows with no delay status/cancellation reason are kept in their own bucket so
+# the flights always add up to the number of rows. Flights from a sample (see FlightSampling) count SAMPLE_WEIGHT times,
+# so the totals are estimates for all the flights.
+
+DELAY_BUCKET_KEYS = ['DEPARTURE_DATE', 'AIRLINE', 'DELAY_STATUS', 'CANCELLATION_REASON']
+DELAY_CAUSES = ['LATE_AIRCRAFT_DELAY', 'AIRLINE_DELAY', 'WEATHER_DELAY', 'AIR_SYSTEM_DELAY', 'SECURITY_DELAY']
+DELAY_MEASURES = ['ARRIVAL_DELAY'] + DELAY_CAUSES
+DELAY_BUCKET_COLUMNS = ['FLIGHTS'] + DELAY_MEASURES + [measure + '_COUNT' for measure in DELAY_MEASURES]
+
+# Roll-up periods: name -> (column, function of the DEPARTURE_DATE column). Months are the month number (same as the
+# MONTH column), so months of different years are added together
+DELAY_PERIODS = {
+    'day': ('DEPARTURE_DATE', lambda dates: dates),
+    'week': ('WEEK', lambda dates: dates.dt.to_period('W').dt.start_time),
+    'month': ('MONTH', lambda dates: dates.dt.month),
+}
+
+
+# Group the rows on the bucket keys. Categorical keys are grouped on their codes (missing is -1) - pandas before 2.0
+# drops the missing values of categorical keys even with dropna=False
+def GroupByBucket(frame, values=None):
+    keys = [frame[key].cat.codes.rename(key) if isinstance(frame[key].dtype, pd.CategoricalDtype) else frame[key]
+            for key in DELAY_BUCKET_KEYS]
+    return (frame if values is None else values).groupby(keys, dropna=False, sort=False)
+
+
+def RestoreCategories(buckets, frame):
+    for key in DELAY_BUCKET_KEYS:
+        if isinstance(frame[key].dtype, pd.CategoricalDtype):
+            buckets[key] = pd.Categorical.from_codes(buckets[key], dtype=frame[key].dtype)
+    return buckets
+
+
+def BuildDelayBuckets(flights):
+    if 'SAMPLE_WEIGHT' in flights.columns:
+        measures = flights[DELAY_MEASURES].astype('float64')
+        weights = flights['SAMPLE_WEIGHT'].astype('float64')
+        values = pd.concat([weights.rename('FLIGHTS'), measures.mul(weights, axis=0),
+                            measures.notna().mul(weights, axis=0).add_suffix('_COUNT')], axis=1)
+        return RestoreCategories(GroupByBucket(flights, values).sum().reset_index(), flights)
+    grouped = GroupByBucket(flights)
+    buckets = grouped[DELAY_MEASURES].sum().astype('float64')
+    buckets = buckets.join(grouped[DELAY_MEASURES].count().add_suffix('_COUNT'))
+    buckets.insert(0, 'FLIGHTS', grouped.size())
+    return RestoreCategories(buckets.reset_index(), flights)
+
+
+# Add up the buckets with the same keys, e.g. buckets of different chunks
+def CombineDelayBuckets(buckets):
+    if isinstance(buckets, (list, tuple)):
+        buckets = pd.concat(buckets, ignore_index=True)
+    return RestoreCategories(GroupByBucket(buckets)[DELAY_BUCKET_COLUMNS].sum().reset_index(), buckets)
+
+
+# Totals per period (day, week or month) and any other bucket keys in by, for the delay statuses given (default all)
+def RollUpDelays(buckets, period='day', by=(), statuses=None):
+    if statuses is not None:
+        buckets = buckets[buckets['DELAY_STATUS'].isin(statuses)]
+    column, function = DELAY_PERIODS[period]
+    keys = [function(buckets['DEPARTURE_DATE']).rename(column)] + [buckets[key] for key in by]
+    return buckets.groupby(keys, observed=True)[DELAY_BUCKET_COLUMNS].sum()
+
+
+# Mean of a measure from its sum and count, e.g. GetDelayMean(RollUpDelays(buckets, 'month'), 'ARRIVAL_DELAY')
+def GetDelayMean(totals, measure):
+    return (totals[measure] / totals[measure + '_COUNT'].where(totals[measure + '_COUNT'] > 0)).rename(measure)
+
+
+# Flights per value of a bucket key, largest first - same as value_counts() on the flights
+def CountFlightsBy(buckets, column, statuses=None):
+    if statuses is not None:
+        buckets = buckets[buckets['DELAY_STATUS'].isin(statuses)]
+    return buckets.groupby(column, observed=False)['FLIGHTS'].sum().sort_values(ascending=False).rename(column)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+# Derived flight columns. Each derived column is declared once in FLIGHT_DERIVATIONS below and calculated with a single
+# vectorized pass over the columns it needs. Used by the flights loader (full and streaming) and should be used by any
+# future flight feeds so the derived fields are always calculated the same way.
+
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+
+# 1970-01-01 (day 0 of datetime64[D]) was a Thursday
+EPOCH_DAY_OF_WEEK = 3
+
+# Change cancellations cause to something more manageable
+CANCELLATION_CODES = {'A': '0', 'B': '1', 'C': '2', 'D': '3'}
+
+# Delay status levels: flight was on time (0), slightly delayed (1), highly delayed (2), diverted (3), or cancelled (4)
+SLIGHT_DELAY_MINUTES = 15
+HIGH_DELAY_MINUTES = 60
+
+
+# Convert the separate YEAR, MONTH, DAY fields into a single date using integer date math (months since 1970 plus day)
+# rather than building and parsing a yyyymmdd number
+def DeriveDepartureDate(flights):
+    months = (flights['YEAR'].to_numpy(dtype='int64') - 1970) * 12 + flights['MONTH'].to_numpy(dtype='int64') - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (flights['DAY'].to_numpy(dtype='int64') - 1)
+    return days.astype('datetime64[ns]')
+
+
+# Day name looked up from the number of days since 1970
+def DeriveDayOfWeek(flights):
+    days = flights['DEPARTURE_DATE'].to_numpy().astype('datetime64[D]').astype('int64')
+    return DAY_NAMES[(days + EPOCH_DAY_OF_WEEK) % 7]
+
+
+# BLOCK_TIME to compare against AIR_TIME. This needs to include taxi in and out time as we want to get the total time
+# we have the engines running
+def DeriveBlockTime(flights):
+    return flights['AIR_TIME'] + flights['TAXI_OUT'] + flights['TAXI_IN']
+
+
+def DeriveBlockFlightVariance(flights):
+    return flights['BLOCK_TIME'] - flights['AIR_TIME']
+
+
+# Conditions are checked in priority order so cancelled beats diverted beats the arrival delay. Flights with no arrival
+# delay that were not diverted or cancelled have no status
+def DeriveDelayStatus(flights):
+    arrivaldelay = flights['ARRIVAL_DELAY'].to_numpy(dtype='float64')
+    conditions = [flights['CANCELLED'].to_numpy() == 1,
+                  flights['DIVERTED'].to_numpy() == 1,
+                  arrivaldelay >= HIGH_DELAY_MINUTES,
+                  arrivaldelay >= SLIGHT_DELAY_MINUTES,
+                  arrivaldelay < SLIGHT_DELAY_MINUTES]
+    return np.select(conditions, [4, 3, 2, 1, 0], default=np.nan)
+
+
+# Map the reason letters to codes with a single lookup array. Anything that isn't a known letter is left as it is
+def DeriveCancellationCode(flights):
+    reasons = flights['CANCELLATION_REASON'].to_numpy(dtype=object, copy=True)
+    positions = pd.Categorical(reasons, categories=list(CANCELLATION_CODES)).codes
+    known = positions >= 0
+    reasons[known] = np.array(list(CANCELLATION_CODES.values()), dtype=object)[positions[known]]
+    return reasons
+
+
+# (column, function) pairs evaluated in order - a derivation can use the columns derived before it
+FLIGHT_DERIVATIONS = [
+    ('DEPARTURE_DATE', DeriveDepartureDate),
+    ('DAY_OF_WEEK', DeriveDayOfWeek),
+    ('BLOCK_TIME', DeriveBlockTime),
+    ('BLOCK_FLIGHT_VARIANCE', DeriveBlockFlightVariance),
+    ('DELAY_STATUS', DeriveDelayStatus),
+    ('CANCELLATION_REASON', DeriveCancellationCode),
+]
+
+
+def DeriveFlightColumns(flights, derivations=FLIGHT_DERIVATIONS):
+    for column, derivation in derivations:
+        flights[column] = derivation(flights)
+    return flights
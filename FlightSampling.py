@@ -0,0 +1,209 @@
+import argparse
+import os
+import sys
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Seeded stratified sample of the flights for quick runs of the whole analysis - replaces cutting the csv down to its
+# first 5000 rows, which were all early January flights. The csv is read once, a chunk at a time, and every row gets a
+# random number from a hash of the seed and its row number, so a seed always picks the same rows whatever the chunk
+# size. The rows are stratified by MONTH x AIRLINE x ORIGIN_AIRPORT and each stratum keeps its rows with the lowest
+# numbers:
+#   fraction f - round(f x the rows of the stratum), at least 1
+#   rows n     - the same with f = n / the rows in the file (so a few more than n with the minimum of 1 per stratum)
+# Only the rows that can still be picked are held while reading: the rows below a threshold (SAMPLE_OVERSAMPLING x f,
+# or for a row count lowered as the file is read so about SAMPLE_OVERSAMPLING x n are held) and the lowest row of every
+# stratum.
+#
+# The sampled rows get SAMPLE_STRATUM, SAMPLE_WEIGHT (rows in the stratum / rows sampled from it) and SAMPLE_SIZE (rows
+# sampled from the stratum), which is all the estimates below need, e.g.
+#   EstimateTotals(df, 'MONTH')                      flights per month scaled up to the full file, with error bounds
+#   EstimateTotals(df, 'MONTH', 'AIR_TIME')          total air time per month
+#   EstimateMeans(df, 'AIRLINE', 'ARRIVAL_DELAY')    mean arrival delay per airline (ratio estimate)
+# The error bounds come from the stratified variance (with the finite population correction) and are +/- the normal
+# quantile for SAMPLE_CONFIDENCE. Rows left out after sampling (flights with no aircraft in the merge, or filtered out
+# before calling) count as outside the group, so the estimates are still for all the flights in the file.
+#
+# Off by default. Turned on with UCDPA_SAMPLE=0.05 (a fraction) or UCDPA_SAMPLE_ROWS=200000, the seed with
+# UCDPA_SAMPLE_SEED, ConfigureSampling() or on the main.py command line: python main.py --sample 0.05 --seed 7
+
+SAMPLE_SETTINGS = {
+    'fraction': float(os.environ['UCDPA_SAMPLE']) if os.environ.get('UCDPA_SAMPLE') else None,
+    'rows': int(os.environ['UCDPA_SAMPLE_ROWS']) if os.environ.get('UCDPA_SAMPLE_ROWS') else None,
+    'seed': int(os.environ.get('UCDPA_SAMPLE_SEED', '0')),
+}
+
+SAMPLE_STRATA = ['MONTH', 'AIRLINE', 'ORIGIN_AIRPORT']
+SAMPLE_COLUMNS = ['SAMPLE_STRATUM', 'SAMPLE_WEIGHT', 'SAMPLE_SIZE']    # bookkeeping, not flight data
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_OVERSAMPLING = 2     # rows held while reading per row that will be sampled
+SAMPLE_CHUNKSIZE = 500000
+
+
+# Set the sample size - a fraction or a row count (neither turns sampling off). The seed is only changed if given
+def ConfigureSampling(fraction=None, rows=None, seed=None):
+    if fraction is not None and not 0 < fraction <= 1:
+        raise ValueError('sample fraction must be more than 0 and at most 1')
+    if fraction is not None and rows is not None:
+        raise ValueError('give a sample fraction or a number of rows, not both')
+    SAMPLE_SETTINGS['fraction'] = fraction
+    SAMPLE_SETTINGS['rows'] = rows
+    if seed is not None:
+        SAMPLE_SETTINGS['seed'] = seed
+
+
+def IsSamplingEnabled():
+    return SAMPLE_SETTINGS['fraction'] is not None or SAMPLE_SETTINGS['rows'] is not None
+
+
+# The settings if sampling is on, otherwise None. Part of the load stage key (see Pipeline) so a sampled run and a full
+# run don't use each other's checkpoints
+def GetSampleSettings():
+    return dict(SAMPLE_SETTINGS) if IsSamplingEnabled() else None
+
+
+# Name for the cached sample, e.g. flights-sample-f0.05-seed0
+def GetSampleName(name, settings):
+    size = 'f' + str(settings['fraction']) if settings['fraction'] is not None else 'n' + str(settings['rows'])
+    return name + '-sample-' + size + '-seed' + str(settings['seed'])
+
+
+# True if the frame is (or was made from) a sample
+def IsSample(frame):
+    return 'SAMPLE_WEIGHT' in frame.columns
+
+
+# Uniform random number in [0, 1) for rows start to start + count of the file
+def GetRandomNumbers(start, count, seed):
+    seedhash = pd.util.hash_array(np.array([seed], dtype='uint64'))[0]
+    hashes = pd.util.hash_array(np.arange(start, start + count, dtype='uint64') ^ seedhash)
+    return (hashes >> np.uint64(11)).astype('float64') * 2.0 ** -53
+
+
+# Lowest numbered row of every stratum
+def GetLowestRows(frame):
+    return frame.sort_values('SAMPLE_RANDOM', kind='stable').drop_duplicates(SAMPLE_STRATA)
+
+
+# Keep the rows below the (keep + 1)th lowest number. Returns the rows and the new threshold
+def PruneCandidates(candidates, keep, threshold):
+    numbers = np.concatenate([candidate['SAMPLE_RANDOM'].to_numpy() for candidate in candidates])
+    if len(numbers) <= keep:
+        return candidates, threshold
+    threshold = np.partition(numbers, keep)[keep]
+    return [candidate[candidate['SAMPLE_RANDOM'] < threshold] for candidate in candidates], threshold
+
+
+# Read the stratified sample of a csv (fraction or rows) in one pass. Returns the sampled rows in file order
+def ReadFlightsSample(sourcefile, dtype=None, fraction=None, rows=None, seed=0, chunksize=SAMPLE_CHUNKSIZE):
+    threshold = 1.0 if rows is not None else min(1.0, SAMPLE_OVERSAMPLING * fraction)
+    populations, candidates, lowest, held = [], [], None, 0
+    start = 0
+    with pd.read_csv(sourcefile, dtype=dtype, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(start, start + len(chunk), name='SAMPLE_ROW')
+            numbers = GetRandomNumbers(start, len(chunk), seed)
+            start += len(chunk)
+            populations.append(chunk.groupby(SAMPLE_STRATA, dropna=False, sort=False).size().rename('POPULATION'))
+
+            chunk['SAMPLE_RANDOM'] = numbers
+            candidates.append(chunk[numbers < threshold])
+            lowest = GetLowestRows(chunk if lowest is None else pd.concat([lowest, GetLowestRows(chunk)]))
+            held += len(candidates[-1])
+            # for a row count keep the lowest SAMPLE_OVERSAMPLING x rows seen so far - rows above that can't be picked
+            if rows is not None and held > 2 * SAMPLE_OVERSAMPLING * rows:
+                candidates, threshold = PruneCandidates(candidates, SAMPLE_OVERSAMPLING * rows, threshold)
+                held = sum(len(candidate) for candidate in candidates)
+    if rows is not None:
+        # and once more at the end, so the rows held are the lowest of the whole file whatever the chunk size
+        candidates, threshold = PruneCandidates(candidates, SAMPLE_OVERSAMPLING * rows, threshold)
+
+    # rows and target sample size of every stratum
+    strata = pd.concat(populations).reset_index().groupby(SAMPLE_STRATA, dropna=False, sort=False)['POPULATION'].sum()
+    strata = strata.reset_index()
+    fraction = fraction if rows is None else min(1.0, rows / max(start, 1))
+    strata['TARGET'] = np.maximum(np.round(strata['POPULATION'] * fraction), 1)
+    strata['SAMPLE_STRATUM'] = np.arange(len(strata), dtype='int32')
+
+    # the lowest numbered rows of each stratum up to its target. If a stratum has fewer rows held than its target all
+    # of them are used - still a simple random sample of the stratum, just a smaller one
+    sample = pd.concat(candidates + [lowest])
+    sample = sample[~sample.index.duplicated()].sort_values('SAMPLE_RANDOM', kind='stable')
+    sample = sample.reset_index().merge(strata, on=SAMPLE_STRATA, how='left', sort=False)
+    sample = sample[sample.groupby('SAMPLE_STRATUM').cumcount() < sample['TARGET']]
+    size = sample.groupby('SAMPLE_STRATUM')['SAMPLE_STRATUM'].transform('size')
+    sample = sample.assign(SAMPLE_WEIGHT=sample['POPULATION'] / size, SAMPLE_SIZE=size.astype('int32'))
+    sample = sample.sort_values('SAMPLE_ROW').drop(columns=['SAMPLE_ROW', 'SAMPLE_RANDOM', 'POPULATION', 'TARGET'])
+    print('Sampled ' + str(len(sample)) + ' of ' + str(start) + ' flights from ' + str(len(strata)) + ' strata ('
+          + ', '.join(SAMPLE_STRATA) + ') with seed ' + str(seed))
+    return sample.reset_index(drop=True)
+
+
+# Estimate and variance of the total of values (NaN = not in the group) for each group number (-1 = no group)
+def SumStrata(frame, groups, values):
+    valid = (groups >= 0) & ~np.isnan(values)
+    sums = pd.DataFrame({'group': groups[valid], 'stratum': frame['SAMPLE_STRATUM'].to_numpy()[valid],
+                         'value': values[valid], 'square': values[valid] ** 2,
+                         'weight': frame['SAMPLE_WEIGHT'].to_numpy()[valid], 'size': frame['SAMPLE_SIZE'].to_numpy()[valid]})
+    sums = sums.groupby(['group', 'stratum']).agg(value=('value', 'sum'), square=('square', 'sum'),
+                                                   sampled=('value', 'size'), weight=('weight', 'first'),
+                                                   size=('size', 'first'))
+    # N^2 (1 - n/N) s^2 / n per stratum, with N = weight x n and s^2 over all n sampled rows (0 outside the group)
+    weight, size = sums['weight'], sums['size']
+    spread = ((sums['square'] - sums['value'] ** 2 / size) / (size - 1).where(size > 1)).fillna(0).clip(lower=0)
+    return pd.DataFrame({'estimate': weight * sums['value'], 'variance': weight * (weight - 1) * size * spread,
+                         'sampled': sums['sampled']}).groupby(level='group').sum()
+
+
+# Group number of every row (-1 if a key is missing) and the group keys in the same order
+def GetGroups(frame, by):
+    grouped = frame.groupby(by, observed=True)
+    return grouped.ngroup().to_numpy(), grouped.size().index
+
+
+def AddErrorBounds(estimates, confidence):
+    bound = NormalDist().inv_cdf(0.5 + confidence / 2) * estimates['standard_error']
+    return estimates.assign(lower=estimates['estimate'] - bound, upper=estimates['estimate'] + bound)
+
+
+# Estimated total of value (or the number of flights if no value) for each group of by in all the flights, with
+# standard error and lower/upper error bounds
+def EstimateTotals(frame, by, value=None, confidence=SAMPLE_CONFIDENCE):
+    groups, keys = GetGroups(frame, by)
+    values = np.ones(len(frame)) if value is None else frame[value].to_numpy(dtype='float64')
+    totals = SumStrata(frame, groups, values).reindex(range(len(keys)), fill_value=0).set_index(keys)
+    estimates = pd.DataFrame({'estimate': totals['estimate'], 'standard_error': np.sqrt(totals['variance']),
+                              'sampled': totals['sampled'].astype('int64')})
+    return AddErrorBounds(estimates, confidence)
+
+
+# Estimated mean of value for each group of by (total of value / number of flights with a value), with standard error
+# (linearised ratio variance) and lower/upper error bounds
+def EstimateMeans(frame, by, value, confidence=SAMPLE_CONFIDENCE):
+    groups, keys = GetGroups(frame, by)
+    values = frame[value].to_numpy(dtype='float64')
+    totals = SumStrata(frame, groups, values)
+    counts = SumStrata(frame, groups, np.where(np.isnan(values), np.nan, 1.0))
+    means = totals['estimate'] / counts['estimate']
+    residuals = values - means.reindex(groups).to_numpy()
+    errors = np.sqrt(SumStrata(frame, groups, residuals)['variance']) / counts['estimate']
+    estimates = pd.DataFrame({'estimate': means, 'standard_error': errors, 'sampled': totals['sampled']})
+    estimates = estimates.reindex(range(len(keys))).set_index(keys)
+    return AddErrorBounds(estimates, confidence).dropna(subset=['estimate'])
+
+
+# Take the sampling options off the command line (the rest are returned for the caller to parse), e.g.
+#   RunPipelineCommandLine(STAGES, ParseSampleArguments())
+def ParseSampleArguments(arguments=None):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--sample', type=float, help='use a stratified sample of this fraction of the flights')
+    parser.add_argument('--sample-rows', type=int, help='use a stratified sample of about this many flights')
+    parser.add_argument('--seed', type=int, help='seed for the sample')
+    options, remaining = parser.parse_known_args(sys.argv[1:] if arguments is None else arguments)
+    if options.sample is not None or options.sample_rows is not None:
+        ConfigureSampling(options.sample, options.sample_rows, options.seed)
+    elif options.seed is not None:
+        SAMPLE_SETTINGS['seed'] = options.seed
+    return remaining
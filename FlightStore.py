@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import AggregationCube
+import DatasetSchema
+import DelayBuckets
+import FlightDerivations
+import UtilisationRollup as UtilisationRollupModule
+from AggregationCube import BuildAggregationCube, CubeFromFrame, CubeToFrame, MergeAggregationCubes
+from DataProfiler import HashRows
+from DatasetCache import GetCodeFingerprint
+from DatasetSchema import AlignSharedCategories, ApplyFlightsSchema
+from DelayBuckets import BuildDelayBuckets, CombineDelayBuckets
+from LoadandCleanDatasets import CleanFlightsData, FLIGHTS_CHUNKSIZE, FLIGHTS_CLEANING_VERSION, FLIGHTS_CSV_DTYPES, \
+    FLIGHTS_DROPPED_COLUMNS, FLIGHTS_SOURCE_FILE
+from UtilisationRollup import SummariseUtilisation, UtilisationRollup
+
+# Month partitioned store of cleaned flights for a rolling window (e.g. the last 3 months) that is topped up from
+# daily/monthly feeds instead of re-reading and re-cleaning the whole file on every run.
+#
+#   store/flights/YEAR=2015/MONTH=03[/AIRLINE=AA]/part-<hash>.parquet
+#
+# Each partition has a single part. An ingest first sorts the raw rows of every chunk into their partitions (spilled
+# to a temporary folder so only one partition is in memory at a time), then works through the partitions. Every raw
+# row is hashed on its content and the part is named by the hash of its rows, so what is stored never depends on
+# where the chunk boundaries fell. The row hashes are saved with the part: a new ingest only cleans rows that aren't
+# stored yet (or, with replace, swaps the partition's part if its rows are different). After an ingest the partitions
+# that have dropped out of the window are deleted.
+#
+# Each part also has its aggregates (see STORE_AGGREGATES) saved next to it, so window level totals are a merge of
+# the small per part results rather than a scan of the rows. manifest.json lists the partitions, parts and row counts.
+# If the cleaning code changes the stored parts are out of date and the store is cleared on the next ingest. If the
+# aggregation code changes only the saved aggregates are deleted - they are built again from the parts when next used.
+
+STORE_DIRECTORY = os.environ.get('UCDPA_STORE_DIR', os.path.join('store', 'flights'))
+STORE_WINDOW_MONTHS = 3
+
+# Layout of the parts - bump when that changes so an existing store is rebuilt rather than misread
+STORE_LAYOUT_VERSION = 2
+
+# The raw row hashes of a part are saved next to it under this name
+PART_ROW_HASHES = 'rowhashes'
+
+# Dimensions of the BLOCK_FLIGHT_VARIANCE cube kept for each part (flights columns only - the aircraft columns need
+# the join so are aggregated after the merge)
+STORE_CUBE_DIMENSIONS = ['MONTH', 'AIRLINE', 'ORIGIN_AIRPORT', 'DAY_OF_WEEK']
+
+
+def BuildVarianceCubeFrame(part):
+    return CubeToFrame(BuildAggregationCube(part, STORE_CUBE_DIMENSIONS, 'BLOCK_FLIGHT_VARIANCE'))
+
+
+# Aggregates saved alongside every part: name -> function(cleaned part) returning a DataFrame. A new entry is filled
+# in for the existing parts the first time it is asked for (see GetStoreAggregateFrames)
+STORE_AGGREGATES = {
+    'variance_cube': BuildVarianceCubeFrame,
+    'utilisation_month': lambda part: SummariseUtilisation(part, 'month'),
+    'utilisation_day': lambda part: SummariseUtilisation(part, 'day'),
+    'delay_buckets': BuildDelayBuckets,
+}
+
+
+def GetAggregatesFingerprint():
+    return GetCodeFingerprint([AggregationCube, UtilisationRollupModule, DelayBuckets, BuildVarianceCubeFrame]) + \
+        '-' + ','.join(STORE_CUBE_DIMENSIONS)
+
+
+def GetCleaningFingerprint():
+    return GetCodeFingerprint([CleanFlightsData, FlightDerivations, DatasetSchema]) + '-' + \
+        str(FLIGHTS_CLEANING_VERSION) + '-' + str(STORE_LAYOUT_VERSION)
+
+
+def GetManifestPath(directory):
+    return os.path.join(directory, 'manifest.json')
+
+
+def ReadStoreManifest(directory=None):
+    try:
+        with open(GetManifestPath(directory or STORE_DIRECTORY)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'cleaning': GetCleaningFingerprint(), 'aggregates': GetAggregatesFingerprint(), 'partitions': {}}
+
+
+def WriteStoreManifest(manifest, directory=None):
+    directory = directory or STORE_DIRECTORY
+    os.makedirs(directory, exist_ok=True)
+    temppath = GetManifestPath(directory) + '.tmp'
+    with open(temppath, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temppath, GetManifestPath(directory))
+
+
+# Months counted from year 0 so the window is a simple range
+def GetMonthNumber(year, month):
+    return int(year) * 12 + int(month) - 1
+
+
+def GetPartitionKey(year, month, airline=None):
+    key = 'YEAR=%d/MONTH=%02d' % (int(year), int(month))
+    if airline is not None:
+        key += '/AIRLINE=' + str(airline)
+    return key
+
+
+def GetPartPath(directory, partition, parthash, aggregate=None):
+    filename = 'part-' + parthash + ('.' + aggregate if aggregate else '') + '.parquet'
+    return os.path.join(directory, *partition.split('/'), filename)
+
+
+def GetNewestMonth(manifest):
+    months = [GetMonthNumber(entry['year'], entry['month']) for entry in manifest['partitions'].values()]
+    return max(months) if months else None
+
+
+# Content hash of each raw row. read_csv gives a column int64 in one chunk and float64 in another depending on
+# whether the chunk has a null in it, so the numbers are hashed as float64 to get the same hash from any chunking
+def GetRowHashes(rows):
+    numeric = rows.select_dtypes('number').columns
+    return HashRows(rows.astype(dict.fromkeys(numeric, 'float64')))
+
+
+# The hash of a part from the hashes of its rows - the same rows in the same order always give the same part
+def GetPartHash(rowhashes):
+    return hashlib.sha1(np.ascontiguousarray(rowhashes, dtype='uint64').tobytes()).hexdigest()
+
+
+def ReadPartRowHashes(directory, partition, parthash):
+    return pd.read_parquet(GetPartPath(directory, partition, parthash, PART_ROW_HASHES))['ROW_HASH'].to_numpy()
+
+
+def WritePart(directory, partition, parthash, part, rowhashes):
+    path = GetPartPath(directory, partition, parthash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    pd.DataFrame({'ROW_HASH': rowhashes}).to_parquet(GetPartPath(directory, partition, parthash, PART_ROW_HASHES),
+                                                     index=False)
+    for name, buildfunction in STORE_AGGREGATES.items():
+        buildfunction(part).to_parquet(GetPartPath(directory, partition, parthash, name), index=False)
+
+
+def RemovePart(directory, partition, parthash):
+    for aggregate in [None, PART_ROW_HASHES] + list(STORE_AGGREGATES):
+        path = GetPartPath(directory, partition, parthash, aggregate)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Delete the saved aggregates of every part if the code that builds them has changed since they were saved
+def ExpireStoreAggregates(directory, manifest):
+    if manifest.get('aggregates') == GetAggregatesFingerprint():
+        return
+    print('Flight store aggregation code has changed - the saved aggregates will be rebuilt')
+    for partition, parthash in GetStoreParts(directory, manifest):
+        for name in STORE_AGGREGATES:
+            path = GetPartPath(directory, partition, parthash, name)
+            if os.path.exists(path):
+                os.remove(path)
+        manifest['partitions'][partition]['parts'][parthash]['aggregates'] = []
+    manifest['aggregates'] = GetAggregatesFingerprint()
+    WriteStoreManifest(manifest, directory)
+
+
+# Delete the partitions more than windowmonths before asof (a date, default the newest month in the store)
+def ExpirePartitions(windowmonths=STORE_WINDOW_MONTHS, asof=None, directory=None, manifest=None):
+    directory = directory or STORE_DIRECTORY
+    manifest = manifest or ReadStoreManifest(directory)
+    newest = GetNewestMonth(manifest) if asof is None else GetMonthNumber(asof.year, asof.month)
+    if newest is None:
+        return []
+
+    expired = [partition for partition, entry in manifest['partitions'].items()
+               if GetMonthNumber(entry['year'], entry['month']) <= newest - windowmonths]
+    for partition in expired:
+        shutil.rmtree(os.path.join(directory, *partition.split('/')), ignore_errors=True)
+        del manifest['partitions'][partition]
+    WriteStoreManifest(manifest, directory)
+    return expired
+
+
+# Add raw flights rows (an iterable of DataFrames straight from read_csv) to the store. Returns counts of what was done
+#   byairline     - partition by YEAR/MONTH/AIRLINE rather than YEAR/MONTH
+#   windowmonths  - size of the rolling window, None keeps everything. Rows already outside the window (relative to
+#                   the newest month seen so far) aren't cleaned at all
+#   replace       - the chunks are a full re-extract of the months in them (e.g. a corrected monthly file) rather than
+#                   new rows, so each of those partitions is swapped for just the rows in this ingest. Without it rows
+#                   that are already stored (e.g. a growing month file read again) are skipped and the rest added
+def IngestFlights(chunks, byairline=False, windowmonths=STORE_WINDOW_MONTHS, replace=False, directory=None):
+    directory = directory or STORE_DIRECTORY
+    manifest = ReadStoreManifest(directory)
+    if manifest['cleaning'] != GetCleaningFingerprint():
+        print('Flights cleaning code has changed - clearing the flight store ' + directory)
+        shutil.rmtree(directory, ignore_errors=True)
+        manifest = {'cleaning': GetCleaningFingerprint(), 'aggregates': GetAggregatesFingerprint(), 'partitions': {}}
+    ExpireStoreAggregates(directory, manifest)
+
+    keys = ['YEAR', 'MONTH', 'AIRLINE'] if byairline else ['YEAR', 'MONTH']
+    newest = GetNewestMonth(manifest)
+    summary = {'rows_read': 0, 'rows_cleaned': 0, 'rows_outside_window': 0, 'rows_already_stored': 0,
+               'parts_added': 0, 'parts_unchanged': 0, 'parts_removed': 0}
+    os.makedirs(directory, exist_ok=True)
+    spilldirectory = tempfile.mkdtemp(prefix='ingest-', dir=directory)
+    try:
+        # Sort the raw rows into their partitions, hashing each row as it goes
+        spilled = {}
+        spillnumber = 0
+        for chunk in chunks:
+            summary['rows_read'] += len(chunk)
+            chunknewest = int((chunk['YEAR'].astype('int64') * 12 + chunk['MONTH'].astype('int64') - 1).max())
+            newest = chunknewest if newest is None else max(newest, chunknewest)
+            chunk = chunk.assign(ROW_HASH=GetRowHashes(chunk))
+            for values, rows in chunk.groupby(keys, sort=False, dropna=False):
+                year, month = values[0], values[1]
+                if windowmonths is not None and GetMonthNumber(year, month) <= newest - windowmonths:
+                    summary['rows_outside_window'] += len(rows)
+                    continue
+                partition = GetPartitionKey(year, month, values[2] if byairline else None)
+                spillpath = os.path.join(spilldirectory, '%08d.parquet' % spillnumber)
+                spillnumber += 1
+                rows.to_parquet(spillpath, index=False)
+                spill = spilled.setdefault(partition, {'year': int(year), 'month': int(month), 'rows': 0, 'paths': []})
+                spill['rows'] += len(rows)
+                spill['paths'].append(spillpath)
+
+        # Then build each partition's part from all of its rows
+        for partition, spill in spilled.items():
+            if windowmonths is not None and GetMonthNumber(spill['year'], spill['month']) <= newest - windowmonths:
+                summary['rows_outside_window'] += spill['rows']
+                continue
+            rows = pd.concat([pd.read_parquet(path) for path in spill['paths']], ignore_index=True)
+            rowhashes = rows.pop('ROW_HASH').to_numpy()
+            entry = manifest['partitions'].setdefault(partition, {'year': spill['year'], 'month': spill['month'],
+                                                                  'parts': {}})
+            stored = list(entry['parts'])
+            part = None
+            if stored and not replace:
+                storedhashes = np.concatenate([ReadPartRowHashes(directory, partition, parthash)
+                                               for parthash in stored])
+                new = ~np.isin(rowhashes, storedhashes)
+                summary['rows_already_stored'] += int((~new).sum())
+                rows, rowhashes = rows[new], rowhashes[new]
+                if len(rows) > 0:
+                    part = pd.concat(AlignSharedCategories(
+                        *[ApplyFlightsSchema(pd.read_parquet(GetPartPath(directory, partition, parthash)))
+                          for parthash in stored], ApplyFlightsSchema(CleanFlightsData(rows))), ignore_index=True)
+                    rowhashes = np.concatenate([storedhashes, rowhashes])
+            elif stored != [GetPartHash(rowhashes)]:
+                part = ApplyFlightsSchema(CleanFlightsData(rows))
+            if part is None:
+                summary['parts_unchanged'] += 1
+                continue
+
+            # The new part is written and listed before the old one is removed, so the partition is always readable
+            parthash = GetPartHash(rowhashes)
+            WritePart(directory, partition, parthash, part, rowhashes)
+            entry['parts'] = {parthash: {'rows': len(part), 'aggregates': sorted(STORE_AGGREGATES)}}
+            WriteStoreManifest(manifest, directory)  # after every part so an interrupted ingest can pick up again
+            for oldhash in stored:
+                RemovePart(directory, partition, oldhash)
+            summary['rows_cleaned'] += len(rows)
+            summary['parts_added'] += 1
+            summary['parts_removed'] += len(stored)
+    finally:
+        shutil.rmtree(spilldirectory, ignore_errors=True)
+
+    WriteStoreManifest(manifest, directory)
+    summary['partitions_expired'] = ExpirePartitions(windowmonths, directory=directory, manifest=manifest) \
+        if windowmonths is not None else []
+    return summary
+
+
+# Ingest a raw flights csv (e.g. the latest daily/monthly extract) in chunks
+def IngestFlightsFile(sourcefile=FLIGHTS_SOURCE_FILE, chunksize=FLIGHTS_CHUNKSIZE, **options):
+    reader = pd.read_csv(sourcefile, dtype=FLIGHTS_CSV_DTYPES, chunksize=chunksize,
+                         usecols=lambda column: column not in FLIGHTS_DROPPED_COLUMNS)
+    with reader:
+        return IngestFlights(reader, **options)
+
+
+# (partition, part hash) of every part in the store, oldest partition first
+def GetStoreParts(directory=None, manifest=None):
+    manifest = manifest or ReadStoreManifest(directory)
+    partitions = sorted(manifest['partitions'].items(),
+                        key=lambda item: (GetMonthNumber(item[1]['year'], item[1]['month']), item[0]))
+    return [(partition, parthash) for partition, entry in partitions for parthash in entry['parts']]
+
+
+# Stream the stored parts one at a time (same idea as GetFlightsDataChunks). columns limits the columns read
+def IterFlightStore(columns=None, directory=None):
+    directory = directory or STORE_DIRECTORY
+    for partition, parthash in GetStoreParts(directory):
+        yield ApplyFlightsSchema(pd.read_parquet(GetPartPath(directory, partition, parthash), columns=columns))
+
+
+# The whole window as one frame
+def LoadFlightStore(columns=None, directory=None):
+    parts = list(IterFlightStore(columns, directory))
+    if not parts:
+        return ApplyFlightsSchema(pd.DataFrame(columns=columns or []))
+    parts = AlignSharedCategories(*parts)
+    return pd.concat(parts, ignore_index=True)
+
+
+# The saved aggregate frames of every part in the window. Parts written before an aggregate was added get it
+# built from the part and saved now
+def GetStoreAggregateFrames(name, directory=None):
+    directory = directory or STORE_DIRECTORY
+    manifest = ReadStoreManifest(directory)
+    ExpireStoreAggregates(directory, manifest)
+    frames = []
+    for partition, parthash in GetStoreParts(directory, manifest):
+        path = GetPartPath(directory, partition, parthash, name)
+        if not os.path.exists(path):
+            part = ApplyFlightsSchema(pd.read_parquet(GetPartPath(directory, partition, parthash)))
+            STORE_AGGREGATES[name](part).to_parquet(path, index=False)
+            entry = manifest['partitions'][partition]['parts'][parthash]
+            entry['aggregates'] = sorted(set(entry.get('aggregates', [])) | {name})
+            WriteStoreManifest(manifest, directory)
+        frames.append(pd.read_parquet(path))
+    return frames
+
+
+# BLOCK_FLIGHT_VARIANCE cube (see AggregationCube) for the whole window, merged from the per part cubes. Note the
+# group labels come back as text
+def GetStoreVarianceCube(directory=None):
+    return MergeAggregationCubes(*[CubeFromFrame(frame) for frame in GetStoreAggregateFrames('variance_cube', directory)])
+
+
+# Per tail utilisation (see UtilisationRollup) for the whole window, from the per part summaries
+def GetStoreUtilisationRollup(registrations, period='month', directory=None):
+    return UtilisationRollup.FromSummaries(GetStoreAggregateFrames('utilisation_' + period, directory), registrations,
+                                           period)
+
+
+# Delay buckets (see DelayBuckets) for the whole window, e.g. RollUpDelays(GetStoreDelayBuckets(), 'week')
+def GetStoreDelayBuckets(directory=None):
+    return CombineDelayBuckets(GetStoreAggregateFrames('delay_buckets', directory))
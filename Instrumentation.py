@@ -0,0 +1,184 @@
+import contextlib
+import functools
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Records how long each step of a run takes and how much memory it uses. Steps are measured with the Instrumented
+# decorator or the Measure context manager, e.g.
+#   @Instrumented()
+#   def GetFlightsData(...):
+#
+#   with Measure('merge', rowsin=len(flights)) as measurement:
+#       ...
+#       measurement['rows_out'] = len(df)
+# For each step: wall time, CPU time (of the whole process, so it includes other threads running at the same time), the
+# peak memory allocated while it ran (tracemalloc, only with memory on as it slows down code that makes lots of small
+# Python objects), the peak RSS of the process so far and the rows in/out (DataFrames passed in and returned - the
+# rows of every frame in a returned dict/tuple are added up). Steps inside steps are recorded with their depth.
+#
+# Off by default. Turned on with UCDPA_INSTRUMENT=1 (or =memory to also trace memory) or ConfigureInstrumentation().
+# When off the decorator only checks a flag and calls the function. When on each step is written as a JSON line to
+# reports/instrumentation.jsonl (UCDPA_INSTRUMENT_LOG) as it finishes, and PrintInstrumentationSummary() prints a
+# table of the steps at the end of the run. Steps measured in worker processes are written to the log by the worker;
+# use TakeMeasurements() there and AddMeasurements() here to get them in the summary (see StartupLoader).
+
+INSTRUMENTATION_SETTINGS = {
+    'enabled': os.environ.get('UCDPA_INSTRUMENT', '') not in ('', '0'),
+    'memory': os.environ.get('UCDPA_INSTRUMENT', '') == 'memory',
+    'logfile': os.environ.get('UCDPA_INSTRUMENT_LOG', os.path.join('reports', 'instrumentation.jsonl')),
+}
+
+MEASUREMENTS = []   # finished steps of this run, in the order they finished
+RUN_ID = time.strftime('%Y%m%dT%H%M%S') + '-' + str(os.getpid())
+STEP_STACK = threading.local()
+LOG_LOCK = threading.Lock()
+
+
+# Change the settings (only the ones given). logfile=None stops the JSON log
+def ConfigureInstrumentation(enabled=None, memory=None, logfile=''):
+    if enabled is not None:
+        INSTRUMENTATION_SETTINGS['enabled'] = enabled
+    if memory is not None:
+        INSTRUMENTATION_SETTINGS['memory'] = memory
+    if logfile != '':
+        INSTRUMENTATION_SETTINGS['logfile'] = logfile
+
+
+def IsInstrumentationEnabled():
+    return INSTRUMENTATION_SETTINGS['enabled']
+
+
+def GetPeakRSS():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+# Rows in a frame, or the total rows of the frames in a dict/list/tuple. None if there aren't any
+def GetRowCount(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        counts = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+
+def WriteMeasurement(measurement):
+    logfile = INSTRUMENTATION_SETTINGS['logfile']
+    if not logfile:
+        return
+    with LOG_LOCK:
+        if os.path.dirname(logfile):
+            os.makedirs(os.path.dirname(logfile), exist_ok=True)
+        with open(logfile, 'a') as file:
+            file.write(json.dumps(measurement, default=str) + '\n')
+
+
+# Measure the code in the with block. Yields the measurement dict - set 'rows_out' (or anything else to log) on it.
+# Nested steps each get their own memory peak: the peak is reset at the start of a step and the higher peak of the
+# step it is inside is kept on that step so it isn't lost
+@contextlib.contextmanager
+def Measure(name, rowsin=None):
+    if not INSTRUMENTATION_SETTINGS['enabled']:
+        yield {}
+        return
+    stack = STEP_STACK.__dict__.setdefault('steps', [])
+    memory = INSTRUMENTATION_SETTINGS['memory']
+    startedtracing = memory and not tracemalloc.is_tracing()
+    if startedtracing:
+        tracemalloc.start()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['innerpeak'] = max(stack[-1]['innerpeak'], peak)
+        tracemalloc.reset_peak()
+    measurement = {'run': RUN_ID, 'pid': os.getpid(), 'step': name, 'started': round(time.time(), 4),
+                   'depth': len(stack), 'parent': stack[-1]['measurement']['step'] if stack else None,
+                   'rows_in': rowsin}
+    step = {'measurement': measurement, 'innerpeak': 0, 'startmemory': current if memory else 0}
+    stack.append(step)
+    started, cpustarted = time.perf_counter(), time.process_time()
+    try:
+        yield measurement
+    finally:
+        measurement['seconds'] = round(time.perf_counter() - started, 4)
+        measurement['cpu_seconds'] = round(time.process_time() - cpustarted, 4)
+        stack.pop()
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], step['innerpeak'])
+            measurement['peak_mb'] = round((peak - step['startmemory']) / (1024 * 1024), 1)
+            if stack:
+                stack[-1]['innerpeak'] = max(stack[-1]['innerpeak'], peak)
+            if startedtracing:
+                tracemalloc.stop()
+        measurement['peak_rss_mb'] = GetPeakRSS()
+        MEASUREMENTS.append(measurement)
+        WriteMeasurement(measurement)
+
+
+# Decorator version of Measure - name defaults to the function name. The rows in are the rows of the DataFrames
+# passed in and the rows out the rows of the DataFrame(s) returned
+def Instrumented(name=None):
+    def Decorate(function):
+        stepname = name or function.__name__
+
+        @functools.wraps(function)
+        def Wrapper(*args, **kwargs):
+            if not INSTRUMENTATION_SETTINGS['enabled']:
+                return function(*args, **kwargs)
+            with Measure(stepname, GetRowCount(list(args) + list(kwargs.values()))) as measurement:
+                result = function(*args, **kwargs)
+                measurement['rows_out'] = GetRowCount(result)
+            return result
+        return Wrapper
+    return Decorate
+
+
+# Return and clear the steps measured so far (e.g. in a worker process, to pass back to the main process)
+def TakeMeasurements():
+    measurements = list(MEASUREMENTS)
+    del MEASUREMENTS[:]
+    return measurements
+
+
+def AddMeasurements(measurements):
+    MEASUREMENTS.extend(measurements)
+
+
+def FormatValue(value, suffix=''):
+    return '-' if value is None else str(value) + suffix
+
+
+# Table of the steps measured in this run, in the order they started (children indented under their parent)
+def PrintInstrumentationSummary(measurements=None):
+    measurements = MEASUREMENTS if measurements is None else measurements
+    if not measurements:
+        return
+    print('Step'.ljust(36) + 'Wall'.rjust(10) + 'CPU'.rjust(10) + 'Peak'.rjust(10) + 'RSS'.rjust(10)
+          + 'Rows in'.rjust(12) + 'Rows out'.rjust(12))
+    # a step finishes after the steps inside it - order by start time to show parents first
+    ordered = sorted(measurements, key=lambda measurement: measurement['started'])
+    for measurement in ordered:
+        print(('  ' * measurement['depth'] + measurement['step'])[:35].ljust(36)
+              + FormatValue(measurement['seconds'], 's').rjust(10)
+              + FormatValue(measurement['cpu_seconds'], 's').rjust(10)
+              + FormatValue(measurement.get('peak_mb'), 'MB').rjust(10)
+              + FormatValue(measurement['peak_rss_mb'], 'MB').rjust(10)
+              + FormatValue(measurement['rows_in']).rjust(12)
+              + FormatValue(measurement.get('rows_out')).rjust(12))
@@ -1,26 +1,80 @@
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import requests
-import json
-
-from pandas.io.json import json_normalize
-
-
-def GetGlobalAircraftData():
+import functools
+
+import DatasetSchema
+import FlightDerivations
+import FlightSampling
+import ManufacturerRules
+from AviationStackClient import GetAviationStackData
+from ChartRenderer import RenderChart
+from Charts import DrawMissingValues
+from DataProfiler import GetProfileTable, ProfileReport
+from DatasetCache import LoadCachedDataset
+from DatasetSchema import ApplyAircraftSchema, ApplyFlightsSchema
+from FlightDerivations import DeriveFlightColumns
+from FlightSampling import GetSampleName, GetSampleSettings, ReadFlightsSample, SAMPLE_COLUMNS
+from Instrumentation import Instrumented
+from ManufacturerRules import NormaliseManufacturers
+
+AIRCRAFT_SOURCE_FILE = "aircraft-database-complete-2022-11-cleaned.csv"
+FLIGHTS_SOURCE_FILE = "flights-2015.csv"
+
+# Version of the cleaning logic for each dataset. The cleaned datasets are cached (see DatasetCache) and the cache is
+# rebuilt whenever the source file, the cleaning functions or these versions change - bump to force a rebuild
+AIRCRAFT_CLEANING_VERSION = 1
+FLIGHTS_CLEANING_VERSION = 2
+
+# Explicit dtypes for the raw csv columns. Airport codes are a mix of letters and numbers in the flights file so
+# without these pandas guesses a different type per block of rows
+FLIGHTS_CSV_DTYPES = {'AIRLINE': str, 'TAIL_NUMBER': str, 'ORIGIN_AIRPORT': str, 'DESTINATION_AIRPORT': str,
+                      'CANCELLATION_REASON': str}
+AIRCRAFT_CSV_DTYPES = {'Registration': str, 'Manufacturer': str, 'Company': str, 'Aircraft_type': str,
+                       'Aircraft_family': str}
+
+# Raw flights columns not used in the analysis
+FLIGHTS_DROPPED_COLUMNS = ['FLIGHT_NUMBER', 'SCHEDULED_DEPARTURE', 'ELAPSED_TIME', 'SCHEDULED_ARRIVAL']
+
+# Number of rows read per chunk in streaming mode - this sets the peak memory used by GetFlightsDataChunks
+FLIGHTS_CHUNKSIZE = 500000
+
+
+# cacheonly=True returns the path of the up to date parquet cache instead of the frame (see LoadCachedDataset)
+@Instrumented()
+def GetGlobalAircraftData(usecache=True, cacheonly=False):
     # General Aircraft DataSet. This contains a globabl DB of aircraft of several types. For the purpose of my analysis
     # I am only interested in large commercial aircraft so this will need to be cleaned up to suit my needs.
     # Source: https://www.kaggle.com/datasets/ahmedeltom/open-air-traffic-data-opensky-netwrok?select=aircraft-database-complete-2022-11-cleaned.csv
 
+    # The cleaned dataset is cached so the csv only gets parsed and cleaned when it (or the cleaning code) changes.
+    # Note: the before/after data summaries are only shown when the cache is rebuilt
+    if not usecache:
+        return ReadAndCleanAircraftData()
+    return LoadCachedDataset('aircraft', AIRCRAFT_SOURCE_FILE, ReadAndCleanAircraftData, AIRCRAFT_CLEANING_VERSION,
+                             ApplyAircraftSchema, [ReadAndCleanAircraftData, CleanAircraftData, ManufacturerRules,
+                                                   DatasetSchema], read=not cacheonly)
+
+
+def ReadAndCleanAircraftData():
     # load full aircraft DB
-    df = pd.read_csv("aircraft-database-complete-2022-11-cleaned.csv")
+    df = pd.read_csv(AIRCRAFT_SOURCE_FILE, dtype=AIRCRAFT_CSV_DTYPES)
+
+    # Show raw data - nulls, distinct values, numeric summary and duplicate rows are all profiled in one go and saved
+    # to reports/aircraft.json/html with the before/after comparison (see DataProfiler)
+    report = ProfileReport('aircraft')
+    ShowMissingValues('BEFORE', 'AIRCRAFT', report.AddStage('raw', df))  # show missing values before and after cleaning
+
+    df = CleanAircraftData(df)
 
-    # Show raw data
-    print(df.info())  # commenting out - used for dev purposes [will clean up later]
-    print(df.describe())
-    ShowMissingValues('BEFORE', 'AIRCRAFT', df)  # function to show missing values before and after data cleaning
+    # Convert to the compact schema (categoricals and smaller numeric types) and show the memory saved per column
+    df = ApplyAircraftSchema(df, report=True)
 
+    ShowMissingValues('AFTER', 'AIRCRAFT', report.AddStage('cleaned', df))  # show missing values after cleaning
+    report.Write()
+
+    return df
+
+
+def CleanAircraftData(df):
     # Cleaning the data for my usage
     # -------------------------------
     # Fix the column name and set to ID for the first column
@@ -30,24 +84,15 @@ def GetGlobalAircraftData():
     # I only care about large commercial aircraft in my dataset so filtering out for Manufacturer of Airbus, Boeing & ATR
     # Also, manufacturer is sparcely filled out however I can use company instead if manufacturer is blank,
     # before filtering on manufacturer I need to fill na with Company.
-    df['Manufacturer'].fillna(df['Company'], inplace=True)
-
-    missing = df[df['Manufacturer'].isnull() & df['Aircraft_type'].str.contains('Boeing')]
-    # print(missing.head(20)) # commenting out - used for dev purposes
-
-    # If Manufacturer is still null then check and derive the Manufacturer from Aircraft type
-    df['Manufacturer'] = np.where(df['Aircraft_type'].str.contains('ATR') & df['Manufacturer'].isnull(), 'ATR', df['Manufacturer'])
-    df['Manufacturer'] = np.where(df['Aircraft_type'].str.contains('Airbus') & df['Manufacturer'].isnull(), 'AIRBUS', df['Manufacturer'])
-    df['Manufacturer'] = np.where(df['Aircraft_type'].str.contains('Boeing') & df['Manufacturer'].isnull(), 'BOEING', df['Manufacturer'])
+    # If Manufacturer is still null then check and derive the Manufacturer from Aircraft type (ATR, then Airbus, then
+    # Boeing) and convert to upper before filtering just in case.
+    # All done once per distinct Manufacturer/Company/Aircraft type rather than on every row - see ManufacturerRules
+    df = NormaliseManufacturers(df)
 
     # Check for missing core fields? commenting out now as only using for analysis purposes when developing
     # missing = df[df['Registration'].isnull()] #change to check different columns
     # print(missing.head(20))
 
-    # Now filter the dataset to only show the core manufacturers but convert to upper first just in case
-    df['Manufacturer'] = df['Manufacturer'].str.upper()
-    df = df.loc[df['Manufacturer'].isin(['AIRBUS', 'BOEING', 'ATR'])]
-
     # Now drop columns we probably wont use
     df = df.drop(['Line_number', 'Classification', 'Emitter', 'Company'], axis=1)
 
@@ -56,73 +101,91 @@ def GetGlobalAircraftData():
     # print(missing.info()) # commenting out - used during dev
     df = df.dropna(subset=['Registration'])
 
-    # Check if we have any duplicates - both work and show no duplicates
-    print(df.duplicated(keep='last'))
-    print(df.loc[df.duplicated(), :])
-
-    ShowMissingValues('AFTER', 'AIRCRAFT', df)  # function to show missing values before and after data cleaning
-    print(df.describe())
+    # Check if we have any duplicates - see duplicate_rows in the 'cleaned' stage of the profile report (no duplicates)
 
     return df
 
 
-def GetFlightsData():
+# cacheonly=True returns the path of the up to date parquet cache instead of the frame (see LoadCachedDataset)
+@Instrumented()
+def GetFlightsData(usecache=True, cacheonly=False):
     # load flights data from 2015. This dataset is old however I wanted a dataset of flight details and delay
     # information that contained the aircraft tail number for future analysis
     # Source dataset - https://www.kaggle.com/code/pierrekos/analysis-and-prediction-of-aircraft-delays/data?select=flights.csv
 
-    # This a large dataset to load each time during development so cuting down the size to make it quicker to run the code.
-    # ################## DON'T FORGET TO CHANGE THIS LATER ##################################
-    # ---------------Swap comment lines below for first and last run ----------------------------------
-    flights = pd.read_csv("flights-2015.csv")
-    # flights = pd.read_csv("flights-2015-shortfile.csv")
+    # Parsing the 5.8 million rows is the slowest part of the whole run so the cleaned dataset is cached in a columnar
+    # file. Warm runs load the cache in seconds. Note: the before/after data summaries are only shown on a rebuild
+
+    # This a large dataset to load each time during development - for quicker runs turn on sampling (python main.py
+    # --sample 0.05) to use a seeded stratified sample of the flights instead. The sample is cached separately from the
+    # full dataset - see FlightSampling
+    sample = GetSampleSettings()
+    buildfunction = functools.partial(ReadAndCleanFlightsData, sample)
+    if not usecache:
+        return buildfunction()
+    return LoadCachedDataset('flights' if sample is None else GetSampleName('flights', sample), FLIGHTS_SOURCE_FILE,
+                             buildfunction, FLIGHTS_CLEANING_VERSION, ApplyFlightsSchema,
+                             [ReadAndCleanFlightsData, CleanFlightsData, FlightDerivations, DatasetSchema,
+                              FlightSampling], read=not cacheonly)
+
+
+def ReadAndCleanFlightsData(sample=None):
+    # The full file, or the stratified sample of it (one pass over the file) when sampling is on. Replaces cutting the
+    # file down to its first 5000 rows for development runs, which only had early January flights in it
+    if sample is None:
+        flights = pd.read_csv(FLIGHTS_SOURCE_FILE, dtype=FLIGHTS_CSV_DTYPES)
+    else:
+        flights = ReadFlightsSample(FLIGHTS_SOURCE_FILE, FLIGHTS_CSV_DTYPES, sample['fraction'], sample['rows'],
+                                    sample['seed'])
+
+    # Show raw data - profiled in one pass and saved to reports/flights.json/html (see DataProfiler)
+    report = ProfileReport('flights' if sample is None else 'flights-sample', exclude=SAMPLE_COLUMNS)
+    ShowMissingValues('BEFORE', 'FLIGHTS', report.AddStage('raw', flights))  # show missing values before and after cleaning
+
+    flights = CleanFlightsData(flights)
+
+    # Convert to the compact schema (categoricals and smaller numeric types) and show the memory saved per column
+    flights = ApplyFlightsSchema(flights, report=True)
 
-    # As per above - Using for quicker runs while developing - create small dataset with 500 rows - Only run once
-    # flights = flights.iloc[:5000,:]
-    # flights.to_csv("flights-2015-shortfile.csv")
+    ShowMissingValues('AFTER', 'FLIGHTS', report.AddStage('cleaned', flights))  # show missing values after cleaning
+    report.Write()
+
+    return flights
 
-    # Show raw data
-    print(flights.info())  # commenting out - used during dev
-    print(flights.describe())
-    ShowMissingValues('BEFORE', 'FLIGHTS', flights)  # function to show missing values before and after data cleaning
 
-    # Creating new column to convert separate date time fields into single column and create a day column
-    flights['DEPARTURE_DATE'] = pd.to_datetime(flights.YEAR * 10000 + flights.MONTH * 100 + flights.DAY, format='%Y%m%d')
+# Streaming version of GetFlightsData for datasets that won't fit in memory (e.g. multi-year or global feeds).
+# The csv is read chunksize rows at a time and each chunk is cleaned and yielded, so peak memory depends on the chunk
+# size rather than the size of the file. Note: each chunk has the categories known when it was read, so call
+# AlignSharedCategories on the chunks before concatenating them. Aggregations can consume the chunks directly, e.g.
+#   for chunk in GetFlightsDataChunks():
+#       totals = totals.add(chunk.groupby('MONTH')['AIR_TIME'].sum(), fill_value=0)
+def GetFlightsDataChunks(chunksize=FLIGHTS_CHUNKSIZE, sourcefile=FLIGHTS_SOURCE_FILE):
+    reader = pd.read_csv(sourcefile, dtype=FLIGHTS_CSV_DTYPES, chunksize=chunksize,
+                         usecols=lambda column: column not in FLIGHTS_DROPPED_COLUMNS)
+    with reader:
+        for chunk in reader:
+            yield ApplyFlightsSchema(CleanFlightsData(chunk))
 
-    flights['DAY_OF_WEEK'] = flights['DEPARTURE_DATE'].dt.day_name()
 
-    # Create a new column called BLOCK_TIME to compare against AIR_TIME.
-    # This column need to include taxi in and out time. We want to get the total time we have the engines running
-    flights['BLOCK_TIME'] = flights.AIR_TIME + flights.TAXI_OUT + flights.TAXI_IN
-    flights['BLOCK_FLIGHT_VARIANCE'] = flights.BLOCK_TIME - flights.AIR_TIME
+# Note: every step in here must only depend on the values in the same row - GetFlightsDataChunks runs it on one chunk
+# of the file at a time
+def CleanFlightsData(flights):
+    # Add the derived columns - DEPARTURE_DATE, DAY_OF_WEEK, BLOCK_TIME, BLOCK_FLIGHT_VARIANCE, DELAY_STATUS and the
+    # cancellation codes. See FlightDerivations for how each one is calculated
+    flights = DeriveFlightColumns(flights)
 
     # Fix the column name and set to ID for the first column
     flights.rename(columns={flights.columns[0]: 'ID'}, inplace=True)
     flights.set_index(['ID'])
 
-    # Add status level for delay levels
-    for dataset in flights:
-        flights.loc[flights['ARRIVAL_DELAY'] <= 15, 'DELAY_STATUS'] = 0
-        flights.loc[flights['ARRIVAL_DELAY'] >= 15, 'DELAY_STATUS'] = 1
-        flights.loc[flights['ARRIVAL_DELAY'] >= 60, 'DELAY_STATUS'] = 2
-        flights.loc[flights['DIVERTED'] == 1, 'DELAY_STATUS'] = 3
-        flights.loc[flights['CANCELLED'] == 1, 'DELAY_STATUS'] = 4
-
-    # Change cancellations cause to something more manageable
-    flights.loc[flights["CANCELLATION_REASON"] == "A", 'CANCELLATION_REASON'] = "0"
-    flights.loc[flights["CANCELLATION_REASON"] == "B", 'CANCELLATION_REASON'] = "1"
-    flights.loc[flights["CANCELLATION_REASON"] == "C", 'CANCELLATION_REASON'] = "2"
-    flights.loc[flights["CANCELLATION_REASON"] == "D", 'CANCELLATION_REASON'] = "3"
-
     # dropping the unwanted data
     # flights = flights.drop('YEAR', 1)  # Converted to date
     # flights = flights.drop("MONTH", 1)  # Converted to date
     # flights = flights.drop("DAY", 1)  # Converted to date
     # flights = flights.drop("DAY_OF_WEEK", 1)
-    flights = flights.drop("FLIGHT_NUMBER", 1)
-    flights = flights.drop("SCHEDULED_DEPARTURE", 1)
-    flights = flights.drop("ELAPSED_TIME", 1)
-    flights = flights.drop("SCHEDULED_ARRIVAL", 1)
+    # All dropped in one go - each separate drop made another full copy of the frame. The streaming reader skips
+    # these columns when parsing so only drop the ones that are actually there
+    flights = flights.drop(columns=[column for column in FLIGHTS_DROPPED_COLUMNS if column in flights.columns])
     # Note: these may be used for later analysis but geting rid for now (Note2: adding back in for delay analysis)
     # flights = flights.drop("DIVERTED", 1)
     # flights = flights.drop("CANCELLED", 1)
@@ -135,56 +198,30 @@ def GetFlightsData():
 
     # print(flights.head(12)) #commenting out - used for dev
 
-    ShowMissingValues('AFTER', 'FLIGHTS', flights)  # function to show missing values before and after data cleaning
-    print(flights.info())  # commenting out - used during dev
-    print(flights.describe())
-
     return flights
 
 
-# Generic function to show missing values in a dataframe before and after data cleaning
-def ShowMissingValues(when, datasetname, dataframe):
+# Generic function to show missing values in a dataframe before and after data cleaning. Takes the profile of the
+# dataframe (see DataProfiler.ProfileFrame) so the nulls aren't counted again
+def ShowMissingValues(when, datasetname, profile):
     # TODO: Remove this line at the end. Saving time while in dev
     # return
 
-    missing = dataframe.isnull().sum().div(dataframe.shape[0]).sort_values(ascending=False)
-    plt.figure(figsize=(9, 9))
+    missing = GetProfileTable(profile)['null_rate'].astype('float64').sort_values(ascending=False)
     title = 'Missing values (%) - ' + datasetname + ' - (' + when + ')'
-    plt.title(title, fontsize=16, fontweight='bold')
-    sns.barplot(x=missing.values, y=missing.index, palette='Blues_r')
-    plt.xlim(0, 1)
-    plt.show()
+    RenderChart(title, DrawMissingValues, missing, title)
 
     return
 
 
-def GetAirportsListFromAPI():
+# Lookup data from the aviationstack API. The pages (up to API_MAX_PAGES, pass maxpages=None for all of them) are
+# fetched in parallel and cached on disk for a day so repeat runs don't use up the API quota - see AviationStackClient.
+# Returned as a DataFrame
+def GetAirportsListFromAPI(**options):
     # airports
-    request = requests.get('http://api.aviationstack.com/v1/airports?access_key=636cee5fb0b4a0b713e5c16e2f595e3e')
-    data = request.json()
-    # for p in data['data']:
-    #    print(p['airport_name'])
-
-    # res = json_normalize(data)
-    # print(res)
-
-    # return as dataframe - commented out - used in testing
-    # return pd.DataFrame(res)
-    # return json
-    return data
+    return GetAviationStackData('airports', **options)
 
 
-def GetAirlinesListFromAPI():
+def GetAirlinesListFromAPI(**options):
     # airlines
-    request = requests.get('http://api.aviationstack.com/v1/airlines?access_key=636cee5fb0b4a0b713e5c16e2f595e3e')
-    data = request.json()
-    # for p in data['data']:
-    #    print(p['airline_name'] + ' - ' + p['icao_code'])
-
-    # res = json_normalize(data)
-    # print(res)
-
-    # return as dataframe - commented out - used in testing
-    # return pd.DataFrame(res)
-    # return json
-    return data
\ No newline at end of file
+    return GetAviationStackData('airlines', **options)
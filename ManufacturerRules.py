@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from DatasetCache import CACHE_DIRECTORY, GetCachePath
+
+# Manufacturer clean up for the aircraft dataset. The rules are only run once per distinct Manufacturer / Company /
+# Aircraft_type combination (a few thousand in the global aircraft DB) and the result is copied back to every row with
+# the group code, rather than running str.contains/str.upper over the full columns for each manufacturer.
+#
+# For each combination the manufacturer is:
+#   Manufacturer, or Company if that is blank, or else the first rule in MANUFACTURER_RULES whose pattern is found in
+#   Aircraft_type (in order, so an earlier rule wins) - then upper cased
+# and the aircraft are kept if it is one of KEPT_MANUFACTURERS. To add a manufacturer (e.g. Embraer) add a rule and
+# add it to the kept list.
+#
+# The Aircraft_type -> manufacturer results of the rules are saved in the cache folder and reused on the next rebuild
+# as long as the rules haven't changed.
+
+MANUFACTURER_RULES = [
+    ('ATR', 'ATR'),
+    ('Airbus', 'AIRBUS'),
+    ('Boeing', 'BOEING'),
+    # ('Embraer', 'EMBRAER'),
+    # ('Bombardier', 'BOMBARDIER'),
+]
+KEPT_MANUFACTURERS = ['AIRBUS', 'BOEING', 'ATR']
+MANUFACTURER_MEMO_NAME = 'manufacturer_rules'
+
+
+def CompileManufacturerRules(rules=MANUFACTURER_RULES):
+    return [(re.compile(pattern), manufacturer) for pattern, manufacturer in rules]
+
+
+def GetRulesFingerprint(rules):
+    return hashlib.sha1(json.dumps(rules).encode('utf-8')).hexdigest()
+
+
+def ResolveAircraftType(aircrafttype, compiledrules):
+    if not isinstance(aircrafttype, str):
+        return None
+    for pattern, manufacturer in compiledrules:
+        if pattern.search(aircrafttype):
+            return manufacturer
+    return None
+
+
+def ReadManufacturerMemo(rules):
+    try:
+        with open(GetCachePath(MANUFACTURER_MEMO_NAME, 'json')) as file:
+            memo = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return memo['types'] if memo.get('rules') == GetRulesFingerprint(rules) else {}
+
+
+def WriteManufacturerMemo(rules, types):
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    with open(GetCachePath(MANUFACTURER_MEMO_NAME, 'json'), 'w') as file:
+        json.dump({'rules': GetRulesFingerprint(rules), 'types': types}, file, indent=2, sort_keys=True)
+
+
+# Manufacturer for each distinct combination (rows of a frame with Manufacturer, Company and Aircraft_type)
+def ResolveManufacturers(combinations, rules=MANUFACTURER_RULES):
+    compiledrules = CompileManufacturerRules(rules)
+    memo = ReadManufacturerMemo(rules)
+    size = len(memo)
+    resolved = []
+    for manufacturer, company, aircrafttype in combinations.itertuples(index=False):
+        if pd.isnull(manufacturer):
+            manufacturer = company
+        if pd.isnull(manufacturer) and isinstance(aircrafttype, str):
+            if aircrafttype not in memo:
+                memo[aircrafttype] = ResolveAircraftType(aircrafttype, compiledrules)
+            manufacturer = memo[aircrafttype]
+        resolved.append(manufacturer.upper() if isinstance(manufacturer, str) else None)
+    if len(memo) > size:
+        WriteManufacturerMemo(rules, memo)
+    return np.array(resolved + [None], dtype=object)  # the extra entry is for code -1
+
+
+# Fill in and upper case the manufacturer and keep only the aircraft of KEPT_MANUFACTURERS
+def NormaliseManufacturers(df, rules=MANUFACTURER_RULES, kept=KEPT_MANUFACTURERS):
+    columns = ['Manufacturer', 'Company', 'Aircraft_type']
+    codes = df.groupby(columns, dropna=False, sort=False).ngroup().to_numpy()
+    firstrows = np.unique(codes, return_index=True)[1]
+    manufacturers = ResolveManufacturers(df[columns].iloc[firstrows], rules)
+
+    keep = np.isin(manufacturers, kept)
+    df = df.assign(Manufacturer=manufacturers[codes])
+    return df.loc[keep[codes]]
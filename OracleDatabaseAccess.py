@@ -1,27 +1,166 @@
+import os
+
 import pandas as pd
-import cx_Oracle
 import sqlalchemy
 
 from sqlalchemy.exc import SQLAlchemyError
 
-def getoracledataset(tableorviewname):
-    schema = input("Enter connection schema:")
-    schemapwd = input("Enter connection schema password:")
-    server = input("Enter full server name:")
-    serversid = input("Enter Server SID:")
-    tablename = tableorviewname
+from DatasetCache import GetCachePath, CACHE_DIRECTORY
+
+# Extract tables/views from the corporate Oracle DB (e.g. my fleet).
+#  - one pooled engine per connection string, reused across calls instead of a new engine every time
+#  - only the columns asked for are selected and the WHERE predicate runs in the database
+#  - rows are fetched in chunks (cx_Oracle arraysize / pandas chunksize) so large extracts don't need to fit in memory
+#  - with cachename set the chunks are written straight to a parquet file in the dataset cache
+# Any SQLAlchemy connection string works, so a local SQLite database can stand in for Oracle when testing.
+#
+# The connection details come from ORACLE_CONNECTION_STRING or ORACLE_SCHEMA / ORACLE_PASSWORD / ORACLE_SERVER /
+# ORACLE_SID and are only prompted for if those aren't set.
+
+ORACLE_PORT = 1521
+ORACLE_ARRAYSIZE = 5000  # rows per round trip to the database
+ORACLE_CHUNKSIZE = 100000  # rows per DataFrame chunk
+ORACLE_ENGINES = {}
+
+
+def GetOracleConnectionString():
+    if os.environ.get('ORACLE_CONNECTION_STRING'):
+        return os.environ['ORACLE_CONNECTION_STRING']
+    schema = os.environ.get('ORACLE_SCHEMA') or input("Enter connection schema:")
+    schemapwd = os.environ.get('ORACLE_PASSWORD') or input("Enter connection schema password:")
+    server = os.environ.get('ORACLE_SERVER') or input("Enter full server name:")
+    serversid = os.environ.get('ORACLE_SID') or input("Enter Server SID:")
+    url = sqlalchemy.engine.URL.create('oracle+cx_oracle', username=schema, password=schemapwd, host=server,
+                                       port=ORACLE_PORT, database=serversid)
+    return url.render_as_string(hide_password=False)
+
+
+# Pooled engine, created on first use. Without a connection string the default Oracle connection is used (and the
+# details only prompted for once per run)
+def GetOracleEngine(connectionstring=None, arraysize=ORACLE_ARRAYSIZE):
+    key = connectionstring or 'default'
+    if key not in ORACLE_ENGINES:
+        connectionstring = connectionstring or GetOracleConnectionString()
+        options = {'pool_pre_ping': True}
+        if connectionstring.startswith('oracle'):
+            options['arraysize'] = arraysize
+        ORACLE_ENGINES[key] = sqlalchemy.create_engine(connectionstring, **options)
+    return ORACLE_ENGINES[key]
+
+
+def CloseOracleEngines():
+    for engine in ORACLE_ENGINES.values():
+        engine.dispose()
+    ORACLE_ENGINES.clear()
+
+
+# SELECT <columns> FROM <table> WHERE <where>. The names are quoted by SQLAlchemy, the where clause is passed through
+# as SQL so use :name bind parameters (see params) for any values rather than pasting them in
+def BuildSelect(tableorviewname, columns=None, where=None):
+    schema, _, tablename = tableorviewname.rpartition('.')
+    table = sqlalchemy.table(tablename, schema=schema or None)
+    if columns:
+        query = sqlalchemy.select(*[sqlalchemy.column(column) for column in columns]).select_from(table)
+    else:
+        query = sqlalchemy.select(sqlalchemy.text('*')).select_from(table)
+    if where:
+        query = query.where(sqlalchemy.text(where))
+    return query
+
+
+# Stream the table/view as DataFrame chunks of chunksize rows
+def getoracledatasetchunks(tableorviewname, columns=None, where=None, params=None, chunksize=ORACLE_CHUNKSIZE,
+                           connectionstring=None):
+    query = BuildSelect(tableorviewname, columns, where)
+    with GetOracleEngine(connectionstring).connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(query, connection, params=params, chunksize=chunksize):
+            yield chunk
+
+
+# The writer's schema with the columns that were all null so far (Arrow null type) given the type they have in table
+def PromoteNullFields(schema, table):
+    import pyarrow
+
+    fields = [table.schema.field(field.name) if pyarrow.types.is_null(field.type) and field.name in table.schema.names
+              else field for field in schema]
+    return pyarrow.schema(fields, metadata=schema.metadata)
+
+
+# Start a new file with the promoted schema and copy the row groups already written into it (only happens when a
+# column was all null in the first chunks, one row group at a time so it doesn't need the whole file in memory)
+def RewriteWithSchema(writer, temppath, schema):
+    import pyarrow.parquet
+
+    writer.close()
+    oldpath = temppath + '.old'
+    os.replace(temppath, oldpath)
+    try:
+        written = pyarrow.parquet.ParquetFile(oldpath)
+        writer = pyarrow.parquet.ParquetWriter(temppath, schema)
+        for rowgroup in range(written.num_row_groups):
+            writer.write_table(written.read_row_group(rowgroup).cast(schema))
+    finally:
+        os.remove(oldpath)
+    return writer
+
 
-    oracle_connection_string = 'oracle+cx_oracle://' + schema + ':' + schemapwd + '@' + server + ':1521/' + serversid
-    engine = sqlalchemy.create_engine(oracle_connection_string)
+# Write the chunks to cache/<cachename>.parquet one row group at a time. The schema comes from the first chunk, except
+# that a column with only nulls in it so far takes its type from the first chunk that has values. Nothing is left
+# behind if it fails part way
+def WriteChunksToCache(cachename, chunks):
+    import pyarrow
+    import pyarrow.parquet
 
-    data = pd.read_sql("SELECT * FROM " + tablename, engine)
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    temppath = GetCachePath(cachename, 'parquet.tmp')
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(temppath, table.schema)
+            else:
+                schema = PromoteNullFields(writer.schema, table)
+                if not schema.equals(writer.schema):
+                    writer = RewriteWithSchema(writer, temppath, schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        raise
+    if writer is None:
+        return None
+    os.replace(temppath, GetCachePath(cachename))
+    return GetCachePath(cachename)
 
-    #For test purposes load to csv file and print
-    data.to_csv('test_' + tablename + '.csv')
-    print(data.head(25))
 
+# Load a table/view (e.g. my fleet) into a DataFrame.
+#   columns          - list of columns to select (default all)
+#   where / params   - filter applied in the database, e.g. where='FLEET_TYPE = :fleet', params={'fleet': 'A320'}
+#   chunksize        - rows fetched per chunk
+#   cachename        - also save the result to the dataset cache as cache/<cachename>.parquet
+#   debugcsv         - write test_<table>.csv and print the first rows (what the dev version always did)
+def getoracledataset(tableorviewname, columns=None, where=None, params=None, chunksize=ORACLE_CHUNKSIZE,
+                     connectionstring=None, cachename=None, debugcsv=False):
+    chunks = getoracledatasetchunks(tableorviewname, columns, where, params, chunksize, connectionstring)
+    try:
+        if cachename is not None:
+            path = WriteChunksToCache(cachename, chunks)
+            data = pd.read_parquet(path) if path else pd.DataFrame(columns=columns)
+        else:
+            data = pd.concat(list(chunks), ignore_index=True)
+    except SQLAlchemyError as error:
+        print('Failed to extract ' + tableorviewname + ': ' + str(error))
+        raise
 
-    #TODO - Check do I need to specifically need to close connection here
-    engine.dispose()
+    if debugcsv:
+        #For test purposes load to csv file and print
+        data.to_csv('test_' + tableorviewname + '.csv')
+        print(data.head(25))
 
     return data
@@ -0,0 +1,203 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from AggregationCube import BuildAggregationCube, GetTopK, MergeAggregationCubes
+from DatasetSchema import ApplyAircraftSchema
+from LoadandCleanDatasets import FLIGHTS_CHUNKSIZE, GetFlightsDataChunks, GetGlobalAircraftData
+from RegistrationIndex import JoinFlightsToAircraft, LoadRegistrationIndex, UpdateRegistrationIndex
+
+# Out of core, multi core groupby of the merged dataset. The merged rows are written to disk split into partitions -
+# by month, or by a hash of TAIL_NUMBER so every tail is in exactly one partition - one chunk at a time, so the full
+# merged frame is never held in memory:
+#
+#   partitions/merged/MONTH=2015-01/part-00000.parquet ...     or     partitions/merged/TAIL=07/part-00000.parquet ...
+#
+# The aggregations then run on one partition per worker process and only the small per partition results come back.
+# They are combined with reducers that can be merged:
+#   sum, count       - added up
+#   mean             - sum and count added up, divided at the end
+#   min, max         - min/max of the partition results
+# plus top k: with tail partitions every tail's rows are in one partition, so a groupby that includes TAIL_NUMBER has
+# no groups split across partitions and each partition only needs to send back its own top k. Otherwise the top k is
+# taken after combining. The BLOCK_FLIGHT_VARIANCE cube (see AggregationCube) merges the same way, e.g.
+#   WritePartitions(IterMergedChunks(aircraft, GetFlightsDataChunks()), by='tail')
+#   PartitionedGroupBy(['MONTH'], [('DELAY_MINUTES', 'ARRIVAL_DELAY', 'sum'), ('FLIGHTS', 'ARRIVAL_DELAY', 'count')])
+#   PartitionedAggregationCube(['AIRLINE', 'ORIGIN_AIRPORT'])
+#
+# Runs the section 2 analysis this way from the command line: python PartitionedGroupBy.py --by tail --workers 8
+# Without fork (Windows) the partitions are done one after another in this process.
+
+PARTITION_DIRECTORY = os.environ.get('UCDPA_PARTITION_DIR', os.path.join('partitions', 'merged'))
+PARTITION_COUNT = 16    # number of TAIL_NUMBER hash partitions
+PARTITION_MODES = ['month', 'tail']
+
+# reducer -> (partial columns, how each is combined)
+PARTIAL_REDUCERS = {
+    'sum': [('sum', 'sum')],
+    'count': [('count', 'sum')],
+    'mean': [('sum', 'sum'), ('count', 'sum')],
+    'min': [('min', 'min')],
+    'max': [('max', 'max')],
+}
+
+
+# Partition name of every row of a chunk
+def GetPartitionNames(chunk, by='month', partitions=PARTITION_COUNT):
+    if by == 'month':
+        return 'MONTH=' + chunk['DEPARTURE_DATE'].dt.strftime('%Y-%m')
+    # hash of the text so the partition of a tail is the same whatever its categories/dtype in the chunk
+    hashes = pd.util.hash_array(chunk['TAIL_NUMBER'].astype(str).to_numpy(dtype=object))
+    return pd.Series(hashes % partitions, index=chunk.index).map(lambda number: 'TAIL=%02d' % number)
+
+
+# Flights chunks joined to the aircraft (same as the merge in main.py, including dropping flights with no aircraft type)
+def IterMergedChunks(aircraft, flightchunks):
+    registrations = LoadRegistrationIndex(aircraft['Registration'])
+    for chunk in flightchunks:
+        registrations = UpdateRegistrationIndex(registrations, chunk['TAIL_NUMBER'])
+        merged, coverage = JoinFlightsToAircraft(chunk, aircraft, registrations)
+        yield merged.dropna(subset=['Aircraft_type'])
+
+
+# Write the chunks to the partition folders (replacing what was there). Returns {partition: rows}
+def WritePartitions(chunks, by='month', partitions=PARTITION_COUNT, directory=None):
+    directory = directory or PARTITION_DIRECTORY
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    rows = {}
+    for number, chunk in enumerate(chunks):
+        for partition, part in chunk.groupby(GetPartitionNames(chunk, by, partitions), sort=False):
+            os.makedirs(os.path.join(directory, partition), exist_ok=True)
+            part.to_parquet(os.path.join(directory, partition, 'part-%05d.parquet' % number), index=False)
+            rows[partition] = rows.get(partition, 0) + len(part)
+    with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+        json.dump({'by': by, 'partitions': partitions, 'rows': rows}, file, indent=2)
+    return rows
+
+
+def ReadPartitionManifest(directory=None):
+    with open(os.path.join(directory or PARTITION_DIRECTORY, 'manifest.json')) as file:
+        return json.load(file)
+
+
+# [(partition, [part files])] in partition order
+def GetPartitions(directory=None):
+    directory = directory or PARTITION_DIRECTORY
+    return [(partition, [os.path.join(directory, partition, name)
+                         for name in sorted(os.listdir(os.path.join(directory, partition)))])
+            for partition in sorted(ReadPartitionManifest(directory)['rows'])]
+
+
+# The rows of one partition (only the columns asked for)
+def ReadPartition(files, columns=None):
+    return pd.concat([pd.read_parquet(path, columns=columns) for path in files], ignore_index=True)
+
+
+# Run function(partition frame, *arguments) on every partition in the process pool and return the results
+def RunInPartitions(function, arguments=(), columns=None, directory=None, workers=None):
+    tasks = [(function, files, columns, arguments) for partition, files in GetPartitions(directory)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            return list(pool.map(RunPartitionTask, tasks))
+    return [RunPartitionTask(task) for task in tasks]
+
+
+def RunPartitionTask(task):
+    function, files, columns, arguments = task
+    return function(ReadPartition(files, columns), *arguments)
+
+
+# Partial results of one partition: a column per (output, partial) e.g. ('DELAY', 'sum'), ('DELAY', 'count') for a mean
+def GroupPartition(frame, keys, aggregations, topk=None):
+    grouped = frame.groupby(keys, observed=True)
+    partials = {}
+    for output, column, reducer in aggregations:
+        for partial, combine in PARTIAL_REDUCERS[reducer]:
+            partials[(output, partial)] = grouped[column].agg(partial)
+    partial = pd.DataFrame(partials)
+    return FinishGroupBy(partial, aggregations, topk, combined=False) if topk is not None else partial
+
+
+# Combine the partial columns with the same keys, then work out the outputs (e.g. mean = sum / count)
+def CombinePartials(partials, keys, aggregations):
+    frame = pd.concat(partials)
+    combine = {(output, partial): how for output, column, reducer in aggregations
+               for partial, how in PARTIAL_REDUCERS[reducer]}
+    return frame.groupby(level=list(range(len(keys)))).agg(combine)
+
+
+def FinishGroupBy(partial, aggregations, topk=None, combined=True):
+    result = pd.DataFrame(index=partial.index)
+    for output, column, reducer in aggregations:
+        if reducer == 'mean':
+            count = partial[(output, 'count')]
+            result[output] = partial[(output, 'sum')] / count.where(count > 0)
+        else:
+            result[output] = partial[(output, PARTIAL_REDUCERS[reducer][0][0])]
+    if topk is None:
+        return result
+    output, k, largest = topk
+    top = result.nlargest(k, output) if largest else result.nsmallest(k, output)
+    # a partition's own top k goes back with its partial columns so they can still be combined
+    return top if combined else partial.loc[top.index]
+
+
+# groupby(keys) of the partitioned dataset with each output worked out by a reducer:
+#   aggregations - [(output column, source column, 'sum'/'count'/'mean'/'min'/'max')]
+#   topk         - (output column, k, largest) to only return the top (or bottom) k groups
+def PartitionedGroupBy(keys, aggregations, topk=None, directory=None, workers=None):
+    keys = list(keys)
+    columns = sorted(set(keys) | {column for output, column, reducer in aggregations})
+    # each group is in one partition when partitioned on the tail and grouped by it, so each partition can cut down to
+    # its own top k
+    disjoint = ReadPartitionManifest(directory)['by'] == 'tail' and 'TAIL_NUMBER' in keys
+    partials = RunInPartitions(GroupPartition, (keys, aggregations, topk if disjoint else None), columns, directory,
+                               workers)
+    return FinishGroupBy(CombinePartials(partials, keys, aggregations), aggregations, topk)
+
+
+# AggregationCube of the partitioned dataset - a cube per partition merged together
+def PartitionedAggregationCube(dimensions, value='BLOCK_FLIGHT_VARIANCE', directory=None, workers=None):
+    cubes = RunInPartitions(BuildAggregationCube, (dimensions, value), list(dimensions) + [value], directory, workers)
+    return MergeAggregationCubes(*cubes)
+
+
+def RunPartitionedCommandLine(arguments=None):
+    parser = argparse.ArgumentParser(description='Partition the merged dataset and run the section 2 aggregations on it '
+                                                 'in parallel')
+    parser.add_argument('--by', choices=PARTITION_MODES, default='month', help='partition by month or tail hash')
+    parser.add_argument('--partitions', type=int, default=PARTITION_COUNT, help='number of tail hash partitions')
+    parser.add_argument('--workers', type=int, help='worker processes (default one per core)')
+    parser.add_argument('--reuse', action='store_true', help='use the partitions already written')
+    options = parser.parse_args(arguments)
+
+    if not options.reuse:
+        aircraft = ApplyAircraftSchema(GetGlobalAircraftData())
+        rows = WritePartitions(IterMergedChunks(aircraft, GetFlightsDataChunks(FLIGHTS_CHUNKSIZE)), options.by,
+                               options.partitions)
+        print('Wrote ' + str(sum(rows.values())) + ' rows to ' + str(len(rows)) + ' partitions in ' + PARTITION_DIRECTORY)
+
+    # Section 2 - highest and lowest 25 block to air time variance for each dimension
+    dimensions = ['Aircraft_type', 'Aircraft_family', 'AIRLINE', 'ORIGIN_AIRPORT']
+    cube = PartitionedAggregationCube(dimensions, workers=options.workers)
+    for dimension in dimensions:
+        print(GetTopK(cube, dimension, 25, largest=True))
+        print(GetTopK(cube, dimension, 25, largest=False))
+
+    # Most flown tails and delay minutes by month
+    print(PartitionedGroupBy(['TAIL_NUMBER'], [('FLIGHTS', 'AIR_TIME', 'count'), ('AIR_TIME', 'AIR_TIME', 'sum'),
+                                               ('LONGEST_FLIGHT', 'AIR_TIME', 'max')],
+                             topk=('AIR_TIME', 25, True), workers=options.workers))
+    print(PartitionedGroupBy(['MONTH'], [('DELAY_MINUTES', 'ARRIVAL_DELAY', 'sum'),
+                                         ('AVERAGE_DELAY', 'ARRIVAL_DELAY', 'mean'),
+                                         ('SHORTEST_DELAY', 'ARRIVAL_DELAY', 'min')], workers=options.workers))
+
+
+if __name__ == '__main__':
+    RunPartitionedCommandLine()
@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+
+from DatasetCache import GetCodeFingerprint, GetFileFingerprint
+from Instrumentation import GetRowCount, Measure
+
+# Runs the analysis as a list of named stages (load, merge and each analysis section). Each stage declares the outputs
+# of other stages it needs, and the outputs of a stage are saved to a checkpoint file so a later run can start from
+# there instead of repeating everything upstream - e.g. changing a chart in section 4 only re-runs section 4.
+#
+# A checkpoint is reused when its key matches. The key is a hash of the stage's code, its source files (if any), its
+# settings (if any) and the content hash of each of its inputs, so a change anywhere upstream invalidates everything below it, but a stage
+# that is re-run and gives exactly the same output leaves the stages below it valid.
+#
+# Stages with checkpoint=False (the analysis sections - their output is the charts) are always run when asked for.
+# Each stage run and checkpoint read is a step in the instrumentation (see Instrumentation).
+#
+#   python main.py                  run every stage, reusing the checkpoints that are up to date
+#   python main.py section4         run section 4 (and only what it needs that isn't checkpointed)
+#   python main.py merge --force    re-run the merge and everything it needs, ignoring the checkpoints
+#   python main.py --list           show the stages and whether their checkpoints are up to date
+
+CHECKPOINT_DIRECTORY = os.environ.get('UCDPA_CHECKPOINT_DIR', 'checkpoints')
+
+
+# A stage:
+#   name        - used on the command line and for the checkpoint file
+#   function    - called with the inputs as keyword arguments and returns a dict of its outputs
+#   inputs      - names of the outputs of earlier stages the function needs
+#   outputs     - names of the outputs it returns
+#   checkpoint  - save the outputs so later runs can reuse them
+#   codeobjects - functions/modules whose source is part of the key (the function itself is always included)
+#   sourcefiles - files the stage reads, part of the key
+#   restore     - function applied to the outputs when they are read back from a checkpoint
+#   settings    - function returning the run settings (JSON) that change the outputs, part of the key
+def Stage(name, function, inputs=(), outputs=(), checkpoint=True, codeobjects=(), sourcefiles=(), restore=None,
+          settings=None):
+    return {'name': name, 'function': function, 'inputs': list(inputs), 'outputs': list(outputs),
+            'checkpoint': checkpoint, 'codeobjects': [function] + list(codeobjects),
+            'sourcefiles': list(sourcefiles), 'restore': restore, 'settings': settings}
+
+
+def GetCheckpointPath(name, extension='pkl'):
+    return os.path.join(CHECKPOINT_DIRECTORY, name + '.' + extension)
+
+
+def ReadCheckpointManifest(name):
+    try:
+        with open(GetCheckpointPath(name, 'json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Writes to the file and hashes what is written, so the content hash doesn't need a second pass over the checkpoint
+class HashingWriter:
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha1()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+
+def WriteCheckpointManifest(name, manifest):
+    with open(GetCheckpointPath(name, 'json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+# The manifest also keeps the fingerprints of the stage's source files (size, modified time and sha1) so the next run
+# only hashes them again if they have changed
+def WriteCheckpoint(name, key, outputs, sources=None):
+    os.makedirs(CHECKPOINT_DIRECTORY, exist_ok=True)
+    temppath = GetCheckpointPath(name, 'pkl.tmp')
+    with open(temppath, 'wb') as file:
+        writer = HashingWriter(file)
+        pickle.dump(outputs, writer, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temppath, GetCheckpointPath(name))
+    manifest = {'key': key, 'hash': writer.hash.hexdigest(), 'sources': sources or {}}
+    WriteCheckpointManifest(name, manifest)
+    return manifest['hash']
+
+
+def ReadCheckpoint(name):
+    with open(GetCheckpointPath(name), 'rb') as file:
+        return pickle.load(file)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = {stage['name']: stage for stage in stages}
+        self.order = [stage['name'] for stage in stages]
+        self.producers = {output: stage['name'] for stage in stages for output in stage['outputs']}
+        self.hashes = {}    # stage -> content hash of its outputs (once known to be up to date)
+        self.outputs = {}   # stage -> outputs held in memory
+
+    def GetInputStages(self, name):
+        inputs = []
+        for output in self.stages[name]['inputs']:
+            if self.producers[output] not in inputs:
+                inputs.append(self.producers[output])
+        return inputs
+
+    # Fingerprints of the stage's source files. The sha1 in the checkpoint manifest is reused while the size and
+    # modified time are the same (see DatasetCache.GetFileFingerprint), so checking whether a checkpoint is up to date
+    # doesn't hash the whole flights csv every time
+    def GetSourceFingerprints(self, name, manifest):
+        previous = (manifest or {}).get('sources', {})
+        return {sourcefile: GetFileFingerprint(sourcefile, previous.get(sourcefile))
+                for sourcefile in self.stages[name]['sourcefiles']}
+
+    def GetKey(self, name, inputhashes, sources):
+        stage = self.stages[name]
+        key = {'code': GetCodeFingerprint(stage['codeobjects']),
+               'sources': [sources[sourcefile]['sha1'] for sourcefile in stage['sourcefiles']],
+               'inputs': inputhashes}
+        settings = stage['settings']() if stage['settings'] is not None else None
+        if settings is not None:    # left out when there are none so the key is the same as a stage without settings
+            key['settings'] = settings
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    # Make sure the stage's outputs are up to date - from its checkpoint if that is still valid, otherwise by running
+    # it - and return the content hash of the outputs. The outputs themselves are only read when they are needed
+    def Resolve(self, name, force=False, run=False):
+        if name in self.hashes and not run:
+            return self.hashes[name]
+        stage = self.stages[name]
+        inputhashes = {inputstage: self.Resolve(inputstage, force) for inputstage in self.GetInputStages(name)}
+        manifest = ReadCheckpointManifest(name) if stage['checkpoint'] else None
+        sources = self.GetSourceFingerprints(name, manifest)
+        key = self.GetKey(name, inputhashes, sources)
+
+        if not run and not force and manifest is not None and manifest['key'] == key \
+                and os.path.exists(GetCheckpointPath(name)):
+            print('Stage ' + name + ' - using checkpoint ' + GetCheckpointPath(name))
+            if manifest.get('sources') != sources:
+                # a source was touched but the content is the same - record the new mtime so it isn't hashed next time
+                WriteCheckpointManifest(name, dict(manifest, sources=sources))
+            self.hashes[name] = manifest['hash']
+            return self.hashes[name]
+
+        print('Stage ' + name + ' - running')
+        arguments = {}
+        for inputstage in self.GetInputStages(name):
+            arguments.update(self.GetOutputs(inputstage))
+        arguments = {output: arguments[output] for output in stage['inputs']}
+        with Measure('stage ' + name, GetRowCount(arguments)) as measurement:
+            outputs = stage['function'](**arguments) or {}
+            measurement['rows_out'] = GetRowCount(outputs)
+        self.outputs[name] = outputs
+        self.hashes[name] = WriteCheckpoint(name, key, outputs, sources) if stage['checkpoint'] else key
+        return self.hashes[name]
+
+    def GetOutputs(self, name):
+        if name not in self.outputs:
+            with Measure('checkpoint ' + name) as measurement:
+                outputs = ReadCheckpoint(name)
+                if self.stages[name]['restore'] is not None:
+                    outputs = self.stages[name]['restore'](outputs)
+                measurement['rows_out'] = GetRowCount(outputs)
+            self.outputs[name] = outputs
+        return self.outputs[name]
+
+    # Run the stages asked for (all of them by default) in pipeline order
+    def Run(self, targets=None, force=False):
+        for name in self.order:
+            if targets is None or name in targets:
+                self.Resolve(name, force, run=not self.stages[name]['checkpoint'] or force)
+
+    # A stage needs to run if its checkpoint is missing, out of date or anything it needs has to run
+    def PrintStatus(self):
+        current = {}
+        for name in self.order:
+            stage = self.stages[name]
+            inputstages = self.GetInputStages(name)
+            manifest = ReadCheckpointManifest(name) if stage['checkpoint'] else None
+            inputmanifests = {inputstage: ReadCheckpointManifest(inputstage) for inputstage in inputstages}
+            current[name] = manifest is not None and all(current[inputstage] for inputstage in inputstages) \
+                and manifest['key'] == self.GetKey(name, {inputstage: inputmanifest['hash'] for inputstage, inputmanifest
+                                                          in inputmanifests.items()},
+                                                   self.GetSourceFingerprints(name, manifest))
+            if not stage['checkpoint']:
+                status = 'always run'
+            else:
+                status = 'checkpoint up to date' if current[name] else 'needs to run'
+            print(name.ljust(12) + ' inputs: ' + (', '.join(stage['inputs']) or '-') + ' - ' + status)
+
+
+def RunPipelineCommandLine(stages, arguments=None):
+    names = [stage['name'] for stage in stages]
+    parser = argparse.ArgumentParser(description='Run the analysis or some of its stages: ' + ', '.join(names))
+    parser.add_argument('stages', nargs='*', metavar='stage', help='stages to run (default all of them)')
+    parser.add_argument('--force', action='store_true', help='ignore the checkpoints and re-run')
+    parser.add_argument('--list', action='store_true', help='list the stages and the state of their checkpoints')
+    options = parser.parse_args(arguments)
+    unknown = [name for name in options.stages if name not in names]
+    if unknown:
+        parser.error('unknown stage ' + ', '.join(unknown) + ' (choose from ' + ', '.join(names) + ')')
+
+    pipeline = Pipeline(stages)
+    if options.list:
+        pipeline.PrintStatus()
+        return pipeline
+    pipeline.Run(options.stages or None, options.force)
+    return pipeline
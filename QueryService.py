@@ -0,0 +1,239 @@
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from AggregationCube import BuildAggregationCube, GetCubeStatistics
+from DelayBuckets import DELAY_BUCKET_KEYS, DELAY_PERIODS, GetDelayMean, RollUpDelays
+from LoadandCleanDatasets import AIRCRAFT_SOURCE_FILE, FLIGHTS_SOURCE_FILE
+from Pipeline import Pipeline
+
+# Local query service. Loads and merges the datasets once (through the pipeline, so the load/merge checkpoints are
+# used when they are up to date - see Pipeline) and keeps the merged frame and its aggregates in memory, then answers
+# queries over HTTP in milliseconds instead of re-running main.py:
+#
+#   python QueryService.py --port 8765 --refresh-every 300
+#
+#   GET  /query/variance?dimension=Aircraft_type&k=25&largest=false     block to air time variance by a dimension
+#   GET  /query/utilisation?tails=N407AN,N3FBAA&months=1,2             per tail per month utilisation of some tails
+#   GET  /query/delays?period=week&by=AIRLINE&statuses=1,2             flights/delay totals per day, week or month
+#   GET  /status                                                        what is loaded and the cache hits/misses
+#   POST /refresh                                                       reload if the source files have changed
+#
+# Answers are kept in an LRU cache keyed on the query and its parameters. The cache is cleared whenever the data is
+# reloaded. The service only listens on localhost by default.
+
+QUERY_HOST = os.environ.get('UCDPA_QUERY_HOST', '127.0.0.1')
+QUERY_PORT = int(os.environ.get('UCDPA_QUERY_PORT', '8765'))
+QUERY_CACHE_SIZE = 256
+VARIANCE_DIMENSIONS = ['Aircraft_type', 'Aircraft_family', 'AIRLINE', 'ORIGIN_AIRPORT', 'DESTINATION_AIRPORT',
+                       'MONTH', 'DAY_OF_WEEK']
+SERVICE_SOURCE_FILES = [AIRCRAFT_SOURCE_FILE, FLIGHTS_SOURCE_FILE]
+
+
+# Query parameters are text - helpers to read them
+def GetListParameter(parameters, name, convert=str):
+    value = parameters.get(name)
+    return None if not value else [convert(item) for item in value.split(',') if item != '']
+
+
+def GetBoolParameter(parameters, name, default):
+    value = parameters.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+def QueryVariance(data, parameters):
+    dimension = parameters.get('dimension', 'AIRLINE')
+    if dimension not in data['cube']:
+        raise ValueError('dimension must be one of ' + ', '.join(VARIANCE_DIMENSIONS))
+    statistics = GetCubeStatistics(data['cube'], dimension)
+    statistic = parameters.get('statistic', 'mean')
+    if statistic not in statistics.columns:
+        raise ValueError('statistic must be one of ' + ', '.join(statistics.columns))
+    statistics = statistics.sort_values(statistic, ascending=not GetBoolParameter(parameters, 'largest', True))
+    return statistics.head(int(parameters['k'])) if 'k' in parameters else statistics
+
+
+def QueryUtilisation(data, parameters):
+    tails = GetListParameter(parameters, 'tails')
+    if not tails:
+        raise ValueError('tails is required, e.g. tails=N407AN,N3FBAA')
+    return data['utilisation'].GetFleet(tails, periods=GetListParameter(parameters, 'months', int))
+
+
+def QueryDelays(data, parameters):
+    period = parameters.get('period', 'month')
+    by = GetListParameter(parameters, 'by') or []
+    if period not in DELAY_PERIODS or any(key not in DELAY_BUCKET_KEYS[1:] for key in by):
+        raise ValueError('period must be one of ' + ', '.join(DELAY_PERIODS) + ' and by any of '
+                         + ', '.join(DELAY_BUCKET_KEYS[1:]))
+    totals = RollUpDelays(data['delays'], period, by, GetListParameter(parameters, 'statuses', float))
+    return totals.assign(AVERAGE_ARRIVAL_DELAY=GetDelayMean(totals, 'ARRIVAL_DELAY'))
+
+
+# name -> function(data, parameters) returning a DataFrame
+QUERIES = {
+    'variance': QueryVariance,
+    'utilisation': QueryUtilisation,
+    'delays': QueryDelays,
+}
+
+
+class FlightQueryService:
+    def __init__(self, stages, cachesize=QUERY_CACHE_SIZE):
+        self.stages = stages
+        self.cachesize = cachesize
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.data = None
+        self.datahash = None
+        self.sourcestate = None
+        self.loaded = None
+        self.lock = threading.Lock()
+        self.refreshlock = threading.Lock()
+
+    # Size and modified time of the source files - a cheap check before asking the pipeline to hash them
+    def GetSourceState(self):
+        return [(os.stat(sourcefile).st_size, os.stat(sourcefile).st_mtime_ns) for sourcefile in SERVICE_SOURCE_FILES]
+
+    # (Re)load the merged dataset if the source files have changed (or force). Returns True if the data changed.
+    # The load/merge runs outside the query lock so queries are answered from the old data while it runs - only the
+    # swap to the new data is done under the lock. refreshlock stops two reloads running at once
+    def Refresh(self, force=False):
+        with self.refreshlock:
+            sourcestate = self.GetSourceState()
+            if not force and self.data is not None and sourcestate == self.sourcestate:
+                return False
+            pipeline = Pipeline(self.stages)
+            mergehash = pipeline.Resolve('merge')
+            self.sourcestate = sourcestate
+            if mergehash == self.datahash:
+                return False
+            outputs = dict(pipeline.GetOutputs('load'), **pipeline.GetOutputs('merge'))
+            outputs['cube'] = BuildAggregationCube(outputs['df'], VARIANCE_DIMENSIONS, 'BLOCK_FLIGHT_VARIANCE')
+            with self.lock:
+                self.data, self.datahash, self.loaded = outputs, mergehash, time.strftime('%Y-%m-%dT%H:%M:%S')
+                self.cache.clear()
+            return True
+
+    # The answer as a list of records (JSON text), from the cache if it has been asked before
+    def Query(self, name, parameters):
+        key = (name, tuple(sorted(parameters.items())))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key], True
+            data = self.data
+        result = QUERIES[name](data, parameters)
+        result = result.reset_index(drop=isinstance(result.index, pd.RangeIndex)).to_json(orient='records',
+                                                                                         date_format='iso')
+        with self.lock:
+            if data is self.data:   # don't cache an answer from data that was replaced while it was worked out
+                self.misses += 1
+                self.cache[key] = result
+                if len(self.cache) > self.cachesize:
+                    self.cache.popitem(last=False)
+        return result, False
+
+    def GetStatus(self):
+        with self.lock:
+            return {'loaded': self.loaded, 'merge_hash': self.datahash, 'rows': len(self.data['df']),
+                    'queries': sorted(QUERIES), 'cache_entries': len(self.cache), 'cache_hits': self.hits,
+                    'cache_misses': self.misses}
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def SendJson(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/status':
+            return self.SendJson(200, json.dumps(self.service.GetStatus()))
+        if not url.path.startswith('/query/'):
+            return self.SendJson(404, json.dumps({'error': 'unknown path ' + url.path}))
+        name = url.path[len('/query/'):]
+        if name not in QUERIES:
+            return self.SendJson(404, json.dumps({'error': 'unknown query ' + name + ' (choose from '
+                                                           + ', '.join(sorted(QUERIES)) + ')'}))
+        parameters = {parameter: values[-1] for parameter, values in parse_qs(url.query).items()}
+        started = time.perf_counter()
+        try:
+            records, cached = self.service.Query(name, parameters)
+        except ValueError as error:
+            return self.SendJson(400, json.dumps({'error': str(error)}))
+        except Exception as error:
+            # anything else is a bug in the query - answer rather than dropping the connection
+            return self.SendJson(500, json.dumps({'error': type(error).__name__ + ': ' + str(error)}))
+        # the records are already JSON text - put them in as they are
+        header = json.dumps({'query': name, 'parameters': parameters, 'cached': cached,
+                             'seconds': round(time.perf_counter() - started, 4)})
+        self.SendJson(200, header[:-1] + ', "rows": ' + records + '}')
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/refresh':
+            return self.SendJson(404, json.dumps({'error': 'unknown path ' + self.path}))
+        try:
+            reloaded = self.service.Refresh()
+        except Exception as error:
+            return self.SendJson(500, json.dumps({'error': type(error).__name__ + ': ' + str(error)}))
+        self.SendJson(200, json.dumps({'reloaded': reloaded, 'loaded': self.service.loaded}))
+
+    def log_message(self, format, *args):
+        print(self.address_string() + ' - ' + format % args)
+
+
+# Check the source files every interval seconds and reload when they change
+def StartRefreshing(service, interval):
+    def Refreshing():
+        while True:
+            time.sleep(interval)
+            if service.Refresh():
+                print('Source files changed - reloaded at ' + service.loaded)
+    thread = threading.Thread(target=Refreshing, daemon=True)
+    thread.start()
+    return thread
+
+
+def RunQueryServiceCommandLine(arguments=None):
+    parser = argparse.ArgumentParser(description='Serve queries over the merged flights dataset')
+    parser.add_argument('--host', default=QUERY_HOST)
+    parser.add_argument('--port', type=int, default=QUERY_PORT)
+    parser.add_argument('--refresh-every', type=float, help='seconds between checks for changed source files')
+    options = parser.parse_args(arguments)
+
+    from main import STAGES  # main.py sets up the stages (and the chart mode) when imported
+    service = FlightQueryService(STAGES)
+    service.Refresh(force=True)
+    if options.refresh_every:
+        StartRefreshing(service, options.refresh_every)
+
+    QueryRequestHandler.service = service
+    server = ThreadingHTTPServer((options.host, options.port), QueryRequestHandler)
+    print('Serving ' + str(len(service.data['df'])) + ' merged flights on http://' + options.host + ':'
+          + str(options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    RunQueryServiceCommandLine()
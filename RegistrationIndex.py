@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from DatasetCache import GetCachePath, PARQUET_AVAILABLE, WriteCachedFrame
+
+# Persistent registration index. Every aircraft registration / flight tail number gets an integer key (its position in
+# the index) which is shared by the flights and aircraft datasets. The join and fleet lookups then work on integer
+# arrays instead of strings. The index is saved in the cache folder and only ever appended to, so a registration keeps
+# the same key from one run to the next.
+
+REGISTRATION_INDEX_NAME = 'registration_index'
+MISSING_KEY = -1
+
+
+def LoadRegistrationIndex(*registrationcolumns):
+    registrations = pd.Index([], dtype=object)
+    if PARQUET_AVAILABLE and os.path.exists(GetCachePath(REGISTRATION_INDEX_NAME)):
+        registrations = pd.Index(pd.read_parquet(GetCachePath(REGISTRATION_INDEX_NAME))['Registration'], dtype=object)
+    return UpdateRegistrationIndex(registrations, *registrationcolumns)
+
+
+# Append any registrations we haven't seen before and save the index if it changed
+def UpdateRegistrationIndex(registrations, *registrationcolumns):
+    size = len(registrations)
+    for column in registrationcolumns:
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            found = column.cat.remove_unused_categories().cat.categories
+        else:
+            found = pd.Index(column.dropna().unique())
+        new = found[~found.isin(registrations)]
+        if len(new) > 0:
+            registrations = registrations.append(new.astype(object))
+    if len(registrations) > size and PARQUET_AVAILABLE:
+        WriteCachedFrame(REGISTRATION_INDEX_NAME, pd.DataFrame({'Registration': registrations}))
+    return registrations
+
+
+# Integer key for each value (MISSING_KEY for nulls or registrations not in the index). For categoricals only the
+# categories need to be looked up, the codes then give the key for every row
+def EncodeRegistrations(column, registrations):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categorykeys = registrations.get_indexer(column.cat.categories).astype('int32')
+        if len(categorykeys) == 0:
+            # no categories - every row is null (codes of -1 would index past the empty array)
+            return np.full(len(column), MISSING_KEY, dtype='int32')
+        codes = column.cat.codes.to_numpy()
+        return np.where(codes >= 0, categorykeys[codes], MISSING_KEY).astype('int32')
+    return registrations.get_indexer(column).astype('int32')
+
+
+# Boolean mask of the rows whose key is in the fleet - a single lookup into a True/False array per row
+def IsInFleet(keys, fleetkeys, registrations):
+    lookup = np.zeros(len(registrations) + 1, dtype=bool)
+    fleetkeys = np.asarray(fleetkeys)
+    lookup[fleetkeys[fleetkeys >= 0]] = True
+    keys = np.asarray(keys)
+    # MISSING_KEY (-1) lands on the extra False entry at the end
+    return lookup[keys]
+
+
+# Inner join of flights to aircraft on TAIL_NUMBER = Registration using the integer keys. Gives the same rows and
+# column names as pd.merge(flights, aircraft, how='inner', left_on='TAIL_NUMBER', right_on='Registration') plus a
+# TAIL_ID column with the key (rows stay in flights order). Also returns the join coverage
+def JoinFlightsToAircraft(flights, aircraft, registrations):
+    flightkeys = EncodeRegistrations(flights['TAIL_NUMBER'], registrations)
+    aircraftkeys = EncodeRegistrations(aircraft['Registration'], registrations)
+
+    # Aircraft rows sorted by key, with the number of rows for each key and where each key starts in the sorted order.
+    # A registration can appear more than once in the aircraft dataset and each copy gives a joined row, same as merge
+    order = np.argsort(aircraftkeys, kind='stable')
+    counts = np.bincount(aircraftkeys[aircraftkeys >= 0], minlength=len(registrations))
+    starts = np.cumsum(counts) - counts + np.count_nonzero(aircraftkeys < 0)
+
+    matches = np.where(flightkeys >= 0, counts[np.maximum(flightkeys, 0)], 0)
+    flightrows = np.repeat(np.arange(len(flights)), matches)
+    offsets = np.arange(len(flightrows)) - np.repeat(np.cumsum(matches) - matches, matches)
+    aircraftrows = order[np.repeat(starts[np.maximum(flightkeys, 0)], matches) + offsets]
+
+    left = flights.iloc[flightrows].reset_index(drop=True)
+    right = aircraft.iloc[aircraftrows].reset_index(drop=True)
+    overlap = left.columns.intersection(right.columns)
+    left = left.rename(columns={column: column + '_x' for column in overlap})
+    right = right.rename(columns={column: column + '_y' for column in overlap})
+    joined = pd.concat([left, right], axis=1)
+    joined['TAIL_ID'] = flightkeys[flightrows]
+
+    return joined, GetJoinCoverage(flightkeys, aircraftkeys, matches, registrations)
+
+
+def GetJoinCoverage(flightkeys, aircraftkeys, matches, registrations):
+    flighttails = np.unique(flightkeys[flightkeys >= 0])
+    matchedtails = np.intersect1d(flighttails, aircraftkeys[aircraftkeys >= 0])
+    unmatchedtails = np.setdiff1d(flighttails, matchedtails)
+    droppedflights = np.count_nonzero(matches == 0)
+    return {
+        'flight_tails': len(flighttails),
+        'matched_tails': len(matchedtails),
+        'unmatched_tails': len(unmatchedtails),
+        'unmatched_tail_numbers': registrations[unmatchedtails].tolist(),
+        'flights': len(flightkeys),
+        'flights_without_tail': int(np.count_nonzero(flightkeys < 0)),
+        'flights_dropped': int(droppedflights),
+        'flights_dropped_pct': round(100 * droppedflights / max(len(flightkeys), 1), 2),
+    }
+
+
+def PrintJoinCoverage(coverage):
+    print('Join coverage - tails matched: ' + str(coverage['matched_tails']) + ' of ' + str(coverage['flight_tails'])
+          + ', unmatched tails: ' + str(coverage['unmatched_tails'])
+          + ', flights dropped: ' + str(coverage['flights_dropped']) + ' of ' + str(coverage['flights'])
+          + ' (' + str(coverage['flights_dropped_pct']) + '%, ' + str(coverage['flights_without_tail'])
+          + ' with no tail number)')
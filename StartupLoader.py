@@ -0,0 +1,124 @@
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from ChartRenderer import ConfigureCharts, RenderChart, TakeDeferredCharts
+from DatasetSchema import ApplyAircraftSchema, ApplyFlightsSchema
+from Instrumentation import AddMeasurements, TakeMeasurements
+from LoadandCleanDatasets import GetAirlinesListFromAPI, GetAirportsListFromAPI, GetFlightsData, GetGlobalAircraftData
+
+# Loads the startup datasets at the same time instead of one after another - none of them depend on each other, so
+# the time until the analysis can start is the slowest source rather than the total of all of them.
+#   process - csv parsing/cleaning (CPU bound) runs in a worker process each
+#   thread  - API calls (waiting on the network) run on threads
+# Each source gives a future. A worker process doesn't send its frame back - it makes sure the dataset's parquet cache
+# (see DatasetCache) is up to date and returns the path (the process source functions take cacheonly=True for this).
+# Pickling a whole cleaned dataset through the pipe would take time and, for a moment, twice its memory. The frames are
+# read here, once, and run through their schema in the order of STARTUP_SOURCES so the shared categories (see
+# DatasetSchema) and the order of the charts come out the same as loading them one after another. Charts asked for
+# in the workers (the missing value charts on a cache rebuild) are passed back and rendered here, and so are the steps
+# they measured (see Instrumentation) so they show in the summary at the end of the run.
+#
+# Without fork (Windows) the process sources are loaded in this process while the threads run.
+#
+# main.py loads the csv (process) sources in its load stage and the API (thread) sources in its lookups stage, so the
+# API lookups can be refreshed on their own as their cache expires.
+
+# (name, process/thread, function, function applied to the result in this process)
+STARTUP_SOURCES = [
+    ('aircraft', 'process', GetGlobalAircraftData, ApplyAircraftSchema),
+    ('flights', 'process', GetFlightsData, ApplyFlightsSchema),
+    ('airlines', 'thread', GetAirlinesListFromAPI, None),
+    ('airports', 'thread', GetAirportsListFromAPI, None),
+]
+
+
+def RunSource(function):
+    started = time.time()
+    result = function()
+    return result, time.time() - started, [], []
+
+
+def RunSourceInProcess(function):
+    ConfigureCharts(mode='deferred')
+    TakeMeasurements()  # the forked worker starts with a copy of the steps already measured in the main process
+    result, elapsed, charts, measurements = RunSource(lambda: function(cacheonly=True))
+    return result, elapsed, TakeDeferredCharts(), TakeMeasurements()
+
+
+# A worker's result is the path of the parquet cache (or the frame itself when there is no cache)
+def ReadSourceResult(result):
+    return pd.read_parquet(result) if isinstance(result, str) else result
+
+
+# Start every source and return straight away with {'started', 'futures': {name: future}, 'pools'}. Each future
+# gives (result, seconds, charts, measurements)
+def StartLoading(sources=None):
+    sources = sources or STARTUP_SOURCES
+    processsources = [source for source in sources if source[1] == 'process']
+    threadsources = [source for source in sources if source[1] == 'thread']
+    loading = {'started': time.time(), 'futures': {}, 'pools': []}
+
+    # The worker processes are forked before any threads start - forking while the API threads hold open sockets or
+    # locks (requests, urllib3, logging) can leave the children deadlocked. A fork pool starts all its workers on the
+    # first submit
+    forking = processsources and 'fork' in multiprocessing.get_all_start_methods()
+    if forking:
+        processpool = ProcessPoolExecutor(max_workers=len(processsources),
+                                          mp_context=multiprocessing.get_context('fork'))
+        loading['pools'].append(processpool)
+        for name, kind, function, finish in processsources:
+            loading['futures'][name] = processpool.submit(RunSourceInProcess, function)
+
+    if threadsources:
+        threadpool = ThreadPoolExecutor(max_workers=len(threadsources))
+        loading['pools'].append(threadpool)
+        for name, kind, function, finish in threadsources:
+            loading['futures'][name] = threadpool.submit(RunSource, function)
+
+    if not forking:
+        for name, kind, function, finish in processsources:
+            future = Future()
+            try:
+                future.set_result(RunSource(function))
+            except Exception as error:
+                future.set_exception(error)
+            loading['futures'][name] = future
+    return loading
+
+
+# Wait for the sources started by StartLoading. Prints the time each one took and returns {name: result}
+def WaitForSources(loading, sources=None):
+    sources = sources or STARTUP_SOURCES
+    kinds = {name: kind for name, kind, function, finish in sources}
+    names = {future: name for name, future in loading['futures'].items()}
+    loaded = {}
+    try:
+        for future in as_completed(names):
+            name = names[future]
+            result, elapsed, charts, measurements = future.result()
+            print('Loaded ' + name + ' in ' + str(round(elapsed, 2)) + 's (' + kinds[name] + ')')
+            loaded[name] = (result, elapsed, charts)
+            AddMeasurements(measurements)
+    finally:
+        for pool in loading['pools']:
+            pool.shutdown()
+
+    results = {}
+    for name, kind, function, finish in sources:
+        result, elapsed, charts = loaded[name]
+        for chartname, drawfunction, args, kwargs in charts:
+            RenderChart(chartname, drawfunction, *args, **kwargs)
+        result = ReadSourceResult(result) if kind == 'process' else result
+        results[name] = finish(result) if finish else result
+
+    total = sum(elapsed for result, elapsed, charts in loaded.values())
+    print('Startup took ' + str(round(time.time() - loading['started'], 2)) + 's (' + str(round(total, 2))
+          + 's if loaded one after another)')
+    return results
+
+
+def LoadStartupSources(sources=None):
+    return WaitForSources(StartLoading(sources), sources)
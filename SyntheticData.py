@@ -0,0 +1,230 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from LoadandCleanDatasets import AIRCRAFT_SOURCE_FILE, FLIGHTS_SOURCE_FILE
+
+# Generates flights and aircraft csv files with the same columns as the real source files and similar cardinalities
+# and distributions (14 airlines, ~5000 tail numbers, ~320 airports, numeric airport ids in October, ~1.5% cancelled,
+# delay causes only on flights 15+ minutes late, an aircraft DB of ~470k mostly non-airline aircraft etc.) so the
+# pipeline can be tested and benchmarked at different sizes without the real data.
+#
+# The output only depends on the seed and the number of rows: the flights are generated in blocks of
+# SYNTHETIC_BLOCK_SIZE rows, each from its own seeded random generator, and appended to the file one block at a time
+# so 50M rows can be written without holding them in memory. e.g.
+#   python SyntheticData.py small --directory synthetic/small
+
+SYNTHETIC_SIZES = {'small': 100000, 'full': 5819079, 'large': 50000000}
+SYNTHETIC_BLOCK_SIZE = 1000000
+SYNTHETIC_SEED = 2015
+
+AIRLINE_SHARES = {'WN': 0.217, 'DL': 0.150, 'AA': 0.125, 'OO': 0.101, 'EV': 0.098, 'UA': 0.088, 'MQ': 0.050,
+                  'B6': 0.046, 'US': 0.034, 'AS': 0.030, 'NK': 0.020, 'F9': 0.016, 'HA': 0.013, 'VX': 0.012}
+AIRPORT_COUNT = 322
+TAILS_PER_FLIGHT = 1 / 1200   # ~4900 tails for the 5.8M flights in 2015
+MINIMUM_TAILS = 4900
+GENERAL_AVIATION_AIRCRAFT = 460000
+CANCELLATION_REASONS = {'A': 0.28, 'B': 0.54, 'C': 0.18, 'D': 0.0002}
+DELAY_CAUSES = ['AIR_SYSTEM_DELAY', 'SECURITY_DELAY', 'AIRLINE_DELAY', 'LATE_AIRCRAFT_DELAY', 'WEATHER_DELAY']
+DELAY_CAUSE_WEIGHTS = [0.6, 0.02, 1.0, 1.2, 0.15]
+
+FLIGHTS_COLUMNS = ['YEAR', 'MONTH', 'DAY', 'DAY_OF_WEEK', 'AIRLINE', 'FLIGHT_NUMBER', 'TAIL_NUMBER', 'ORIGIN_AIRPORT',
+                   'DESTINATION_AIRPORT', 'SCHEDULED_DEPARTURE', 'DEPARTURE_TIME', 'DEPARTURE_DELAY', 'TAXI_OUT',
+                   'WHEELS_OFF', 'SCHEDULED_TIME', 'ELAPSED_TIME', 'AIR_TIME', 'DISTANCE', 'WHEELS_ON', 'TAXI_IN',
+                   'SCHEDULED_ARRIVAL', 'ARRIVAL_TIME', 'ARRIVAL_DELAY', 'DIVERTED', 'CANCELLED', 'CANCELLATION_REASON',
+                   'AIR_SYSTEM_DELAY', 'SECURITY_DELAY', 'AIRLINE_DELAY', 'LATE_AIRCRAFT_DELAY', 'WEATHER_DELAY']
+AIRCRAFT_COLUMNS = ['icao24', 'Registration', 'Manufacturer', 'Aircraft_type', 'Aircraft_family', 'Serial_number',
+                    'Line_number', 'Company', 'Callsign', 'Classification', 'Emitter']
+
+# (manufacturer, company, aircraft types, family, share) of the airline fleet and of the rest of the aircraft DB
+AIRLINE_AIRCRAFT = [
+    ('Boeing', 'The Boeing Company', ['Boeing 737-800', 'Boeing 737-700', 'Boeing 757-200', 'Boeing 767-300ER'], '737', 0.45),
+    ('Airbus', 'Airbus SAS', ['Airbus A320-232', 'Airbus A321-231', 'Airbus A319-112'], 'A320', 0.30),
+    ('Bombardier', 'Bombardier Inc', ['Bombardier CRJ-200', 'Bombardier CRJ-900'], 'CRJ', 0.13),
+    ('Embraer', 'Embraer', ['Embraer ERJ-145', 'Embraer 175'], 'E-Jet', 0.10),
+    ('ATR', 'ATR', ['ATR 72-600', 'ATR 42-500'], 'ATR', 0.02),
+]
+OTHER_AIRCRAFT = [
+    ('Cessna', 'Cessna Aircraft Company', ['Cessna 172 Skyhawk', 'Cessna 182 Skylane', 'Cessna 208 Caravan'], 'Cessna', 0.42),
+    ('Piper', 'Piper Aircraft', ['Piper PA-28-181', 'Piper PA-32R-301'], 'Piper', 0.25),
+    ('Beechcraft', 'Textron Aviation', ['Beech A36 Bonanza', 'Beech King Air 350'], 'Beech', 0.12),
+    ('Cirrus', 'Cirrus Design', ['Cirrus SR22'], 'Cirrus', 0.08),
+    ('Robinson', 'Robinson Helicopter', ['Robinson R44 Raven'], 'Robinson', 0.05),
+    ('Boeing', 'The Boeing Company', ['Boeing 737-800', 'Boeing 777-300ER', 'Boeing 787-9'], '737', 0.05),
+    ('Airbus', 'Airbus SAS', ['Airbus A320-214', 'Airbus A350-941'], 'A320', 0.03),
+]
+
+
+# Generated values that have to be the same in every block (airports, tails)
+def GetSyntheticReference(rows, seed=SYNTHETIC_SEED):
+    random = np.random.default_rng([seed, 0])
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    codes = random.choice(26 ** 3, AIRPORT_COUNT, replace=False)
+    airports = np.array([''.join(letters[[code // 676, code // 26 % 26, code % 26]]) for code in codes], dtype=object)
+    airportids = (10000 + random.choice(6000, AIRPORT_COUNT, replace=False)).astype(str).astype(object)
+    # a few hubs get most of the traffic
+    weights = 1 / np.arange(1, AIRPORT_COUNT + 1) ** 0.9
+    location = np.column_stack([random.uniform(25, 48, AIRPORT_COUNT), random.uniform(-123, -70, AIRPORT_COUNT)])
+
+    tailcount = max(MINIMUM_TAILS, int(rows * TAILS_PER_FLIGHT))
+    tails = np.array(['N%d%s' % (number, ''.join(suffix)) for number, suffix in
+                      zip(random.choice(np.arange(100, 99999), tailcount, replace=False),
+                          random.choice(letters, (tailcount, 2)))], dtype=object)
+    tails = pd.unique(tails)
+    airlines = np.array(list(AIRLINE_SHARES), dtype=object)
+    shares = np.array(list(AIRLINE_SHARES.values()))
+    shares = shares / shares.sum()
+    # each airline has its own block of the tails, sized by its share of the flights
+    fleetsizes = np.maximum((shares * len(tails)).astype(int), 1)
+    fleetstarts = np.concatenate([[0], np.cumsum(fleetsizes)[:-1]])
+    return {'airports': airports, 'airportids': airportids, 'airportweights': weights / weights.sum(),
+            'airportlocations': location, 'tails': tails, 'airlines': airlines, 'airlineshares': shares,
+            'fleetstarts': fleetstarts, 'fleetsizes': fleetsizes}
+
+
+def ToClock(minutes):
+    minutes = np.mod(np.round(minutes), 24 * 60)
+    return (minutes // 60) * 100 + minutes % 60
+
+
+def GetDistances(reference, origins, destinations):
+    latitude, longitude = np.radians(reference['airportlocations']).T
+    a = np.sin((latitude[destinations] - latitude[origins]) / 2) ** 2 + np.cos(latitude[origins]) \
+        * np.cos(latitude[destinations]) * np.sin((longitude[destinations] - longitude[origins]) / 2) ** 2
+    return np.maximum(np.round(2 * 3959 * np.arcsin(np.sqrt(a))), 31).astype('int64')
+
+
+def GenerateFlightsBlock(reference, block, rows, seed=SYNTHETIC_SEED):
+    random = np.random.default_rng([seed, 1, block])
+    dates = np.datetime64('2015-01-01') + random.integers(0, 365, rows)
+    month = dates.astype('datetime64[M]').astype(int) % 12 + 1
+    day = (dates - dates.astype('datetime64[M]')).astype(int) + 1
+    dayofweek = (dates.astype('int64') + 3) % 7 + 1  # 1 = Monday
+
+    airline = random.choice(len(reference['airlines']), rows, p=reference['airlineshares'])
+    tail = reference['fleetstarts'][airline] + (random.random(rows) * reference['fleetsizes'][airline]).astype(int)
+    tailnumbers = reference['tails'][tail]
+    tailnumbers[random.random(rows) < 0.0025] = None
+
+    origin = random.choice(AIRPORT_COUNT, rows, p=reference['airportweights'])
+    destination = random.choice(AIRPORT_COUNT, rows, p=reference['airportweights'])
+    destination = np.where(destination == origin, (destination + 1) % AIRPORT_COUNT, destination)
+    # October 2015 uses numeric airport ids instead of the codes in the real data
+    october = month == 10
+    originnames = np.where(october, reference['airportids'][origin], reference['airports'][origin])
+    destinationnames = np.where(october, reference['airportids'][destination], reference['airports'][destination])
+
+    distance = GetDistances(reference, origin, destination)
+    scheduled = random.integers(5 * 60, 23 * 60, rows)
+    scheduledtime = np.round(distance / 7.8 + 35 + random.normal(0, 5, rows))
+    departuredelay = np.where(random.random(rows) < 0.62, np.round(random.normal(-3, 4, rows)),
+                              np.round(random.exponential(35, rows)))
+    taxiout = np.round(random.gamma(4, 4, rows)) + 1
+    airtime = np.maximum(np.round(distance / 8.3 + 10 + random.normal(0, 6, rows)), 7)
+    taxiin = np.round(random.gamma(2.5, 3, rows)) + 1
+    elapsed = taxiout + airtime + taxiin
+    arrivaldelay = departuredelay + elapsed - scheduledtime
+
+    cancelled = random.random(rows) < 0.0154
+    diverted = ~cancelled & (random.random(rows) < 0.0026)
+    reasons = np.array(list(CANCELLATION_REASONS), dtype=object)
+    reasonshares = np.array(list(CANCELLATION_REASONS.values()))
+    reason = np.where(cancelled, reasons[random.choice(len(reasons), rows, p=reasonshares / reasonshares.sum())], None)
+
+    flights = pd.DataFrame({
+        'YEAR': 2015, 'MONTH': month, 'DAY': day, 'DAY_OF_WEEK': dayofweek, 'AIRLINE': reference['airlines'][airline],
+        'FLIGHT_NUMBER': random.integers(1, 7000, rows), 'TAIL_NUMBER': tailnumbers, 'ORIGIN_AIRPORT': originnames,
+        'DESTINATION_AIRPORT': destinationnames, 'SCHEDULED_DEPARTURE': ToClock(scheduled),
+        'DEPARTURE_TIME': ToClock(scheduled + departuredelay).astype(float), 'DEPARTURE_DELAY': departuredelay,
+        'TAXI_OUT': taxiout, 'WHEELS_OFF': ToClock(scheduled + departuredelay + taxiout).astype(float),
+        'SCHEDULED_TIME': scheduledtime, 'ELAPSED_TIME': elapsed, 'AIR_TIME': airtime, 'DISTANCE': distance,
+        'WHEELS_ON': ToClock(scheduled + departuredelay + taxiout + airtime).astype(float), 'TAXI_IN': taxiin,
+        'SCHEDULED_ARRIVAL': ToClock(scheduled + scheduledtime).astype(int),
+        'ARRIVAL_TIME': ToClock(scheduled + departuredelay + elapsed).astype(float), 'ARRIVAL_DELAY': arrivaldelay,
+        'DIVERTED': diverted.astype(int), 'CANCELLED': cancelled.astype(int), 'CANCELLATION_REASON': reason,
+    })
+    # cancelled flights mostly never left the gate, diverted flights never arrived where they were going
+    notdeparted = cancelled & (random.random(rows) < 0.85)
+    flights.loc[notdeparted, ['DEPARTURE_TIME', 'DEPARTURE_DELAY', 'TAXI_OUT', 'WHEELS_OFF']] = np.nan
+    flights.loc[cancelled | diverted, ['ELAPSED_TIME', 'AIR_TIME', 'WHEELS_ON', 'TAXI_IN', 'ARRIVAL_TIME',
+                                       'ARRIVAL_DELAY']] = np.nan
+
+    # the delay causes are only filled in for flights 15+ minutes late and add up to the arrival delay
+    late = (flights['ARRIVAL_DELAY'] >= 15).to_numpy()
+    shares = random.dirichlet(DELAY_CAUSE_WEIGHTS, rows)
+    minutes = np.floor(shares * np.nan_to_num(flights['ARRIVAL_DELAY'].to_numpy())[:, None])
+    minutes[:, 3] += np.nan_to_num(flights['ARRIVAL_DELAY'].to_numpy()) - minutes.sum(axis=1)
+    for number, cause in enumerate(DELAY_CAUSES):
+        flights[cause] = np.where(late, minutes[:, number], np.nan)
+    return flights[FLIGHTS_COLUMNS]
+
+
+def GenerateAircraft(reference, seed=SYNTHETIC_SEED):
+    random = np.random.default_rng([seed, 2])
+    # most of the airline tails are in the aircraft DB (not all of them - same as the real data)
+    airlinetails = reference['tails'][random.random(len(reference['tails'])) < 0.93]
+    othertails = np.array(['N%dX%s' % (number, letter) for number, letter in
+                           zip(range(len(airlinetails), len(airlinetails) + GENERAL_AVIATION_AIRCRAFT),
+                               np.resize(list('ABCDEFGHJK'), GENERAL_AVIATION_AIRCRAFT))], dtype=object)
+
+    frames = []
+    for registrations, kinds in ((airlinetails, AIRLINE_AIRCRAFT), (othertails, OTHER_AIRCRAFT)):
+        rows = len(registrations)
+        shares = np.array([kind[4] for kind in kinds])
+        kind = random.choice(len(kinds), rows, p=shares / shares.sum())
+        typechoice = random.random(rows)
+        frames.append(pd.DataFrame({
+            'Registration': registrations,
+            'Manufacturer': np.array([kinds[k][0] for k in kind], dtype=object),
+            'Company': np.array([kinds[k][1] for k in kind], dtype=object),
+            'Aircraft_type': np.array([kinds[k][2][int(choice * len(kinds[k][2]))] for k, choice in zip(kind, typechoice)],
+                                      dtype=object),
+            'Aircraft_family': np.array([kinds[k][3] for k in kind], dtype=object),
+        }))
+    aircraft = pd.concat(frames, ignore_index=True)
+    aircraft = aircraft.iloc[random.permutation(len(aircraft))].reset_index(drop=True)
+    rows = len(aircraft)
+
+    # the manufacturer is often missing (then Company and/or the aircraft type give it away) and a few
+    # registrations/types are missing too
+    aircraft.loc[random.random(rows) < 0.6, 'Manufacturer'] = None
+    aircraft.loc[random.random(rows) < 0.5, 'Company'] = None
+    aircraft.loc[random.random(rows) < 0.03, 'Aircraft_type'] = None
+    aircraft.loc[random.random(rows) < 0.0001, 'Registration'] = None
+    aircraft['icao24'] = ['%06x' % number for number in random.choice(2 ** 24, rows, replace=False)]
+    aircraft['Serial_number'] = random.integers(1, 99999, rows)
+    aircraft['Line_number'] = np.where(random.random(rows) < 0.3, random.integers(1, 9999, rows).astype(float), np.nan)
+    aircraft['Callsign'] = np.where(random.random(rows) < 0.2, random.choice(['AAL', 'DAL', 'UAL', 'SWA', 'SKW'], rows),
+                                    None)
+    aircraft['Classification'] = random.choice(['L1P', 'L2J', 'H1T', 'L1T'], rows)
+    aircraft['Emitter'] = random.choice(['Light', 'Small', 'Large', 'Heavy', 'Rotorcraft'], rows)
+    return aircraft[AIRCRAFT_COLUMNS]
+
+
+# Write <directory>/flights-2015.csv and the aircraft csv. The files are saved with the row number as the first
+# column, same as the source files
+def GenerateSyntheticData(rows, directory, seed=SYNTHETIC_SEED):
+    os.makedirs(directory, exist_ok=True)
+    reference = GetSyntheticReference(rows, seed)
+
+    flightsfile = os.path.join(directory, FLIGHTS_SOURCE_FILE)
+    for block, start in enumerate(range(0, rows, SYNTHETIC_BLOCK_SIZE)):
+        flights = GenerateFlightsBlock(reference, block, min(SYNTHETIC_BLOCK_SIZE, rows - start), seed)
+        flights.index = pd.RangeIndex(start, start + len(flights))
+        flights.to_csv(flightsfile, mode='w' if block == 0 else 'a', header=block == 0)
+        print('Flights rows written: ' + str(start + len(flights)) + ' of ' + str(rows))
+
+    GenerateAircraft(reference, seed).to_csv(os.path.join(directory, AIRCRAFT_SOURCE_FILE))
+    return directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic flights and aircraft csv files')
+    parser.add_argument('size', help='number of flights rows or one of ' + ', '.join(SYNTHETIC_SIZES))
+    parser.add_argument('--directory', help='folder for the files (default synthetic/<size>)')
+    parser.add_argument('--seed', type=int, default=SYNTHETIC_SEED)
+    options = parser.parse_args()
+    rows = SYNTHETIC_SIZES[options.size] if options.size in SYNTHETIC_SIZES else int(options.size)
+    GenerateSyntheticData(rows, options.directory or os.path.join('synthetic', options.size), options.seed)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from DatasetCache import GetCachePath, WriteCachedFrame
+from RegistrationIndex import EncodeRegistrations
+
+# Utilisation per tail per month (or per day): flights, cycles, air time, block time and delay minutes. Built once from
+# the flights when they are loaded and topped up with Update() as new flights come in, so fleet utilisation questions
+# are answered from this small table rather than by filtering and grouping the full flights frame each time.
+#
+# The rows are sorted by the tail's registration index key (see RegistrationIndex) with the start row and number of
+# rows of every key kept alongside, so the rows for a fleet (a random sample, the corporate fleet from
+# getoracledataset etc.) are found by direct lookup, e.g.
+#   rollup = UtilisationRollup(flights, registrations)
+#   rollup.GetFleet(myfleet['Registration'])
+#
+# Sums are mergeable, so summaries of separate chunks/partitions (SummariseUtilisation) just add up. A cycle is a flight
+# that wasn't cancelled and delay minutes are the minutes of late arrival (early arrivals count as 0).
+
+UTILISATION_PERIODS = {'month': ['YEAR', 'MONTH'], 'day': ['DEPARTURE_DATE']}
+UTILISATION_COLUMNS = ['FLIGHTS', 'CYCLES', 'AIR_TIME', 'BLOCK_TIME', 'DELAY_MINUTES']
+
+
+# Per tail per period totals of some flights. Only the tail/period combinations that have flights are included
+def SummariseUtilisation(flights, period='month'):
+    keys = ['TAIL_NUMBER'] + UTILISATION_PERIODS[period]
+    values = flights[keys].copy()
+    values['FLIGHTS'] = np.ones(len(flights), dtype='int32')
+    values['CYCLES'] = (flights['CANCELLED'] == 0).astype('int32')
+    values['AIR_TIME'] = flights['AIR_TIME'].astype('float64')
+    values['BLOCK_TIME'] = flights['BLOCK_TIME'].astype('float64')
+    values['DELAY_MINUTES'] = flights['ARRIVAL_DELAY'].astype('float64').clip(lower=0)
+    if 'SAMPLE_WEIGHT' in flights.columns:
+        # a sampled flight stands for SAMPLE_WEIGHT flights (see FlightSampling) so the totals are estimates
+        values[UTILISATION_COLUMNS] = values[UTILISATION_COLUMNS].mul(flights['SAMPLE_WEIGHT'].astype('float64'), axis=0)
+    return CombineUtilisation(values, period)
+
+
+# Add up the rows for the same tail/period, e.g. summaries of different chunks
+def CombineUtilisation(summary, period='month'):
+    keys = ['TAIL_NUMBER'] + UTILISATION_PERIODS[period]
+    summary = summary.dropna(subset=['TAIL_NUMBER'])
+    if isinstance(summary['TAIL_NUMBER'].dtype, pd.CategoricalDtype):
+        summary = summary.assign(TAIL_NUMBER=summary['TAIL_NUMBER'].astype(str))
+    return summary.groupby(keys, sort=False)[UTILISATION_COLUMNS].sum().reset_index()
+
+
+class UtilisationRollup:
+    def __init__(self, flights, registrations, period='month'):
+        self.period = period
+        self.SetSummary(SummariseUtilisation(flights, period), registrations)
+
+    # Build from saved/partial summaries instead of the flights
+    @classmethod
+    def FromSummaries(cls, summaries, registrations, period='month'):
+        rollup = cls.__new__(cls)
+        rollup.period = period
+        columns = ['TAIL_NUMBER'] + UTILISATION_PERIODS[period] + UTILISATION_COLUMNS
+        summary = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame(columns=columns)
+        rollup.SetSummary(CombineUtilisation(summary, period), registrations)
+        return rollup
+
+    # Sort by tail key and work out where each key's rows start (same idea as JoinFlightsToAircraft). Tails that
+    # aren't in the registration index get MISSING_KEY and sort first, where no lookup will reach them
+    def SetSummary(self, summary, registrations):
+        self.registrations = registrations
+        keys = EncodeRegistrations(summary['TAIL_NUMBER'], registrations)
+        order = np.lexsort([summary[column].to_numpy() for column in reversed(UTILISATION_PERIODS[self.period])]
+                           + [keys])
+        self.summary = summary.iloc[order].reset_index(drop=True)
+        self.keys = keys[order]
+        self.counts = np.bincount(self.keys[self.keys >= 0], minlength=len(registrations))
+        self.starts = np.cumsum(self.counts) - self.counts + np.count_nonzero(self.keys < 0)
+
+    # Add new flights. Pass the registration index again if it has had tails added since
+    def Update(self, flights, registrations=None):
+        summary = pd.concat([self.summary, SummariseUtilisation(flights, self.period)], ignore_index=True)
+        self.SetSummary(CombineUtilisation(summary, self.period), self.registrations if registrations is None
+                        else registrations)
+
+    # Utilisation rows of the fleet (a list/Series of registrations), optionally only for some months/days
+    def GetFleet(self, fleet, periods=None):
+        fleetkeys = np.unique(EncodeRegistrations(pd.Series(fleet, dtype=object), self.registrations))
+        fleetkeys = fleetkeys[(fleetkeys >= 0) & (fleetkeys < len(self.counts))]
+        counts = self.counts[fleetkeys]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self.summary.iloc[np.repeat(self.starts[fleetkeys], counts) + offsets]
+        if periods is not None:
+            column = UTILISATION_PERIODS[self.period][-1]
+            rows = rows[rows[column].isin(periods)]
+        return rows.sort_values(['TAIL_NUMBER'] + UTILISATION_PERIODS[self.period]).reset_index(drop=True)
+
+    def Save(self, name=None):
+        WriteCachedFrame(name or 'utilisation_' + self.period, self.summary)
+
+    @classmethod
+    def Load(cls, registrations, period='month', name=None):
+        summary = pd.read_parquet(GetCachePath(name or 'utilisation_' + period))
+        return cls.FromSummaries([summary], registrations, period)
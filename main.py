@@ -1,7 +1,5 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import datetime as dt
 import random
 
@@ -22,64 +20,144 @@ import random
 #change display window for pycharm output to see more than 3 columns
 pd.options.display.width = 0
 
+# Charts are shown on screen by default. To run unattended (e.g. scheduled on a server) set UCDPA_CHART_MODE=headless
+# and every chart is saved to the charts folder instead, rendered in parallel worker processes - see ChartRenderer
+from ChartRenderer import FinishCharts, RenderChart
+from Charts import DrawCorrelationMatrix, DrawFramePlot, DrawPieAndCount, DrawSideBySide
+
 # ===============================
 # LOAD AND CLEAN DATASETS SECTION
 # ===============================
 
 # Get and load my core datasets. Note: cleaning of dataset also complete in these functions
 #-----------------------------------------------------
-from LoadandCleanDatasets import GetGlobalAircraftData, GetFlightsData, GetAirlinesListFromAPI, GetAirportsListFromAPI
+from AggregationCube import BuildAggregationCube, GetTopK
+from CorrelationMatrix import GetCorrelationMatrix
+from DataProfiler import ProfileReport
+from DatasetSchema import AlignSharedCategories, ApplyAircraftSchema, ApplyFlightsSchema
+from DelayBuckets import BuildDelayBuckets, CountFlightsBy, DELAY_CAUSES, GetDelayMean, RollUpDelays
+from FlightSampling import EstimateMeans, EstimateTotals, GetSampleSettings, IsSample, ParseSampleArguments, \
+    SAMPLE_COLUMNS
+from Instrumentation import PrintInstrumentationSummary
+from LoadandCleanDatasets import AIRCRAFT_SOURCE_FILE, FLIGHTS_SOURCE_FILE
+from AviationStackClient import GetCachePeriod
+from Pipeline import RunPipelineCommandLine, Stage
+from RegistrationIndex import JoinFlightsToAircraft, LoadRegistrationIndex, PrintJoinCoverage
+from StartupLoader import LoadStartupSources, STARTUP_SOURCES
+from UtilisationRollup import UtilisationRollup
+
+import AviationStackClient
+import DatasetSchema
+import DelayBuckets
+import FlightDerivations
+import FlightSampling
+import LoadandCleanDatasets
+import ManufacturerRules
+import RegistrationIndex
+import StartupLoader
+import UtilisationRollup as UtilisationRollupModule
+
+
+# The analysis is split into stages (load, lookups, merge and the 4 analysis sections) - see the STAGES list at the
+# bottom. The outputs of the load, lookups and merge stages are checkpointed, so e.g. 'python main.py section4' only
+# re-runs section 4 while working on its charts (see Pipeline)
+def LoadDatasets():
+    # The 2 core datasets are loaded at the same time (csv files in worker processes) - see StartupLoader. The time
+    # taken by each one is printed
+    sources = LoadStartupSources([source for source in STARTUP_SOURCES if source[1] == 'process'])
+
+    # 2 core datasets
+    aircraft = sources['aircraft']   # full global list of aircraft - see GetGlobalAircraftData for more info
+    flights = sources['flights']     # detailed list of flight data (5.8 million flights) - see GetFlightsData for more info
+    # Note: for multi-year/global flight data that won't fit in memory use GetFlightsDataChunks() to stream cleaned chunks
+
+    return {'aircraft': aircraft, 'flights': flights}
+
+
+# API feed for lookup data, fetched at the same time on threads. A stage of its own so the lookups are refreshed as
+# the API cache expires (its key has the cache period - see LookupSettings) without re-running the load or anything
+# after it
+def LoadLookups():
+    sources = LoadStartupSources([source for source in STARTUP_SOURCES if source[1] == 'thread'])
+    airlines = sources['airlines']
+    airports = sources['airports']
+
+    #print(airlines.info())
+    #print(airlines.head(15))
+    #print(airports.info())
+    #print(airports.head(15))
+
+    return {'airlines': airlines, 'airports': airports}
+
+
+def LookupSettings():
+    return {'api_cache_period': GetCachePeriod()}
+
+
+# The frames read back from a checkpoint have the categories of the run that saved them - register them with the
+# shared categories of this run, same as StartupLoader does
+def RestoreLoadedDatasets(outputs):
+    return dict(outputs, aircraft=ApplyAircraftSchema(outputs['aircraft']), flights=ApplyFlightsSchema(outputs['flights']))
 
-# 2 core datasets
-aircraft = GetGlobalAircraftData()   # full global list of aircraft - see function header for more info
-flights = GetFlightsData()           # detailed list of flight data (5.8 million flights) - see function header for more info
 
-#API feed for lookup data
-airlines = GetAirlinesListFromAPI()
-airports = GetAirportsListFromAPI()
+# ================================
+# MERGE DATASETS AND FINAL TIDY UP
+# ================================
 
+def MergeDatasets(aircraft, flights):
+    # Next task is to join the datasets with an inner join on tail number/registration. Note, this is the
+    # same data point although with different name on the separate datasets
 
-#print(airlines.info())
-#print(airlines.head(15))
-#print(airports.info())
-#print(airports.head(15))
+    # The join is done on integer keys from the persistent registration index (see RegistrationIndex) rather than with a
+    # pd.merge on the strings. Same rows as:
+    #   df = pd.merge(flights, aircraft,  how='inner', left_on = 'TAIL_NUMBER', right_on = 'Registration')
+    AlignSharedCategories(flights, aircraft)
+    registrations = LoadRegistrationIndex(aircraft['Registration'], flights['TAIL_NUMBER'])
+    df, coverage = JoinFlightsToAircraft(flights, aircraft, registrations)
+    PrintJoinCoverage(coverage)
 
+    # Per tail per month utilisation (flights, cycles, air/block time, delay minutes) built once here so the fleet
+    # utilisation in section 3 is a lookup - see UtilisationRollup
+    utilisation = UtilisationRollup(flights, registrations)
 
-# ================================
-# MERGE DATASETS AND FINAL TIDY UP
-# ================================
+    report = ProfileReport('merged', exclude=SAMPLE_COLUMNS)
+    report.AddStage('joined', df)
+    print(df.head(150))
+    print('Merged dataset memory usage (MB): ' + str(round(df.memory_usage(deep=True).sum() / (1024 * 1024), 1)))
 
-# Next task is to join the datasets with an inner join on tail number/registration. Note, this is the
-# same data point although with different name on the separate datasets
+    # Due to the nature of the datasets and also the timing of the datasets (Global fleet is current but flight
+    # data is US based only and from 2015) we will have flight data with no corresponding data in the global aircraft list.
+    # This is OK for assessment purposes and the final target is to replace the flights dataset with a realtime API to retrieve global
+    # flight data from the previous 3 months and extract my fleet from an internal corporate Oracle DB. Obviously I can't use this data
+    # for this course work but I have connected to the Oracle DB to retrieve my corporate fleet. I am leaving the code
+    # in this project file but have removed the connection into input requests - see OracleDatabaseAccess for more info.
 
-df = pd.merge(flights, aircraft,  how='inner', left_on = 'TAIL_NUMBER', right_on = 'Registration')
-print(df.head(150))
+    #Review list of Airlines
+    #print(df['Callsign'].unique())     # Commenting out for dev purposes only
 
-# Due to the nature of the datasets and also the timing of the datasets (Global fleet is current but flight
-# data is US based only and from 2015) we will have flight data with no corresponding data in the global aircraft list.
-# This is OK for assessment purposes and the final target is to replace the flights dataset with a realtime API to retrieve global
-# flight data from the previous 3 months and extract my fleet from an internal corporate Oracle DB. Obviously I can't use this data
-# for this course work but I have connected to the Oracle DB to retrieve my corporate fleet. I am leaving the code
-# in this project file but have removed the connection into input requests - see OracleDatabaseAccess for more info.
+    missing = df[df['Aircraft_type'].isnull()]
+    print(missing.head(10))
+    #if we still have missing Aircraft Type at this stage then remove
+    df = df.dropna(subset=['Aircraft_type'])
+    print(df.head(15))
 
-#Review list of Airlines
-#print(df['Callsign'].unique())     # Commenting out for dev purposes only
+    unique = df['Registration'].unique()
+    print(unique.size)
 
-missing = df[df['Aircraft_type'].isnull()]
-print(missing.head(10))
-#if we still have missing Aircraft Type at this stage then remove
-df = df.dropna(subset=['Aircraft_type'])
-print(df.head(15))
+    # Profile of the merged dataset before and after dropping the flights with no aircraft type - replaces info() and
+    # describe(). Saved to reports/merged.json/html
+    report.AddStage('without missing aircraft type', df)
+    report.Write()
 
-unique = df['Registration'].unique()
-print(unique.size)
+    # Check for missing core fields? commenting out now as only using for analysis purposes when developing
+    missing = df[df['Registration'].isnull()]  #change to check different columns
+    print(missing.head(20))
 
-print(df.info())  # commenting out - used for dev purposes [will clean up later]
-print(df.describe())
+    # Flight/delay totals per day, airline, delay status and cancellation reason built in one pass here, so the delay
+    # analysis in section 4 (and any daily/weekly/monthly roll-up) works from these rather than the rows - see DelayBuckets
+    delays = BuildDelayBuckets(df)
 
-# Check for missing core fields? commenting out now as only using for analysis purposes when developing
-missing = df[df['Registration'].isnull()]  #change to check different columns
-print(missing.head(20))
+    return {'df': df, 'registrations': registrations, 'utilisation': utilisation, 'delays': delays}
 
 
 # ====================
@@ -90,285 +168,271 @@ print(missing.head(20))
 # 1. INITIAL HIGH LEVEL REVIEW OF DATASETS
 # ========================================
 
-#Correlation Matrix - I saw this used in another area of Kaggle and thought it could be useful to identify data coralation
-corrmat = flights.corr()
-f, ax = plt.subplots(figsize=(12, 9))
-sns.heatmap(corrmat, vmax=.8, square=True)
-plt.title("Correlation Matrix - Flight Data", fontsize=14)
-plt.ylabel("Flight Data Fields")
-plt.xlabel("Flight Data Fields")
-plt.show()
-
-
-# pie plot to show flights stats by the days of week
-f,ax=plt.subplots(1,2,figsize=(14,6))
-df['DAY_OF_WEEK'].value_counts().plot.pie(autopct='%1.1f%%',ax=ax[0],shadow=True)
-ax[0].set_title('Day Of Week')
-ax[0].set_ylabel('')
-sns.countplot(x=df['DAY_OF_WEEK'], data=df, ax=ax[1])
-ax[1].set_title('Day Of Week')
-ax[1].set_ylabel('')
-ax[1].set_xlabel('')
-plt.show()
-
-# pie plot to show flights stats by month
-f,ax=plt.subplots(1,2,figsize=(14,6))
-df['MONTH'].value_counts().plot.pie(autopct='%1.1f%%',ax=ax[0],shadow=True)
-ax[0].set_title('Month')
-ax[0].set_ylabel('')
-sns.countplot(x=df['MONTH'], data=df, ax=ax[1])
-ax[1].set_title('Month')
-ax[1].set_ylabel('')
-ax[1].set_xlabel('')
-plt.show()
-
-
-# Complete some high level analysis on the global list of aircraft
-grouped = aircraft[['Manufacturer','ID']].groupby(['Manufacturer']).count()
-print(grouped)
-grouped.plot(kind="pie", figsize=(10, 9), subplots=True)
-plt.show()
-
-grouped = aircraft[['Aircraft_family','ID']].groupby(['Aircraft_family']).count()
-#grouped = grouped.nlargest(25,grouped['Aircraft_family'].value_counts())  #largest 25
-#grouped = grouped.groupby(['Aircraft_family']).size().sort_values(ascending=False)
-grouped = grouped.groupby('Aircraft_family').first()
-print(grouped)
-grouped.plot(kind="barh", figsize=(10, 9), subplots=True)
-plt.show()
-
-
-# TODO: show some visualizations on each dataset individually for demonstration purposes
-
-print(flights.info())
-print(flights.head(15))
+def ReviewDatasets(aircraft, flights, df):
+    #Correlation Matrix - I saw this used in another area of Kaggle and thought it could be useful to identify data coralation
+    # Built one chunk at a time (same result as flights.corr()) so it also works on streamed data, e.g.
+    # GetCorrelationMatrix(GetFlightsDataChunks()). For a quick look use sample=0.05 which also gives confidence intervals
+    # When the flights are a stratified sample (see FlightSampling) the rows are weighted so it stands for all the flights
+    corrmat = GetCorrelationMatrix(flights, weight='SAMPLE_WEIGHT' if IsSample(flights) else None,
+                                   exclude=SAMPLE_COLUMNS)
+    RenderChart("Correlation Matrix - Flight Data", DrawCorrelationMatrix, corrmat, "Correlation Matrix - Flight Data",
+                "Flight Data Fields")
+
+
+    # pie plot to show flights stats by the days of week (with a count plot of the same counts)
+    counts = df['DAY_OF_WEEK'].value_counts()
+    RenderChart('Day Of Week', DrawPieAndCount, counts, 'Day Of Week', order=counts.sort_index().index)
+
+    # pie plot to show flights stats by month
+    counts = df['MONTH'].value_counts()
+    RenderChart('Month', DrawPieAndCount, counts, 'Month', order=counts.sort_index().index)
 
 
+    # Complete some high level analysis on the global list of aircraft
+    grouped = aircraft[['Manufacturer','ID']].groupby(['Manufacturer']).count()
+    print(grouped)
+    RenderChart('Aircraft by Manufacturer', DrawFramePlot, grouped, kind="pie", figsize=(10, 9), subplots=True)
+
+    grouped = aircraft[['Aircraft_family','ID']].groupby(['Aircraft_family']).count()
+    #grouped = grouped.nlargest(25,grouped['Aircraft_family'].value_counts())  #largest 25
+    #grouped = grouped.groupby(['Aircraft_family']).size().sort_values(ascending=False)
+    grouped = grouped.groupby('Aircraft_family').first()
+    print(grouped)
+    RenderChart('Aircraft by Family', DrawFramePlot, grouped, kind="barh", figsize=(10, 9), subplots=True)
+
+
+    # TODO: show some visualizations on each dataset individually for demonstration purposes
+
+    # see reports/flights.html for the flights data profile
+    print(flights.head(15))
+
 
 # =================================
 # 2. ANALYSE BLOCK TIME VS AIR TIME
 # =================================
 
-# NOTE: BLOCK_TIME AND BLOCK_FLIGHT_VARIANCE ARE ADDED CALCULATED FIELDS DURING THE DATA LOAD AND CLEAN FUNCTION
-
-# Block to Air time mean variance by Aircraft Type
-# Bar Chart with 25 highest Block to Air time variance by aircraft types
-grouped = df[['Aircraft_type','BLOCK_FLIGHT_VARIANCE']].groupby(['Aircraft_type']).mean() #groupby with mean
-grouped = grouped.nlargest(25,['BLOCK_FLIGHT_VARIANCE'])  #largest 25
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_type'],ascending=True) #sort order
-grouped.plot(kind="barh", figsize=(14, 9))    # set horizontal bar chart and size
-#plt.legend(['Block to Flight time Variance'], loc='upper right')
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Highest Block to Air time variance by Aircraft Type", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Aircraft Type")
-plt.show()
-
-print(grouped)
-
-# Bar Chart with 25 lowest Block to Air time variance by aircraft types
-grouped = df[['Aircraft_type','BLOCK_FLIGHT_VARIANCE']].groupby(['Aircraft_type']).mean()
-grouped = grouped.nsmallest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_type'], ascending=False)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Lowest Block to Air time variance by Aircraft Type", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Aircraft Type")
-plt.show()
-print(grouped)
-
-# Block to Air time mean variance by Aircraft Family
-# Bar Chart with 25 highest Block to Air time variance by aircraft Family
-grouped = df[['Aircraft_family','BLOCK_FLIGHT_VARIANCE']].groupby(['Aircraft_family']).mean() #groupby with mean'
-grouped = grouped.nlargest(25,['BLOCK_FLIGHT_VARIANCE'])  #largest 25
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_family'],ascending=True) #sort order
-grouped.plot(kind="barh", figsize=(14, 9))    # set horizontal bar chart and size
-#plt.legend(['Block to Flight time Variance'], loc='upper right')
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Highest Block to Air time variance by Aircraft Family", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Aircraft Family")
-plt.show()
-print(grouped)
-
-# Bar Chart with 25 lowest Block to Air time variance by aircraft Family
-grouped = df[['Aircraft_family','BLOCK_FLIGHT_VARIANCE']].groupby(['Aircraft_family']).mean()
-grouped = grouped.nsmallest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_family'], ascending=False)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Lowest Block to Air time variance by Aircraft Family", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Aircraft Family")
-plt.show()
-print(grouped)
-
-# Block to Air time mean variance by Airline
-# Bar Chart with 25 highest Block to Air time variance by Airline
-grouped = df[['AIRLINE','BLOCK_FLIGHT_VARIANCE']].groupby(['AIRLINE']).mean()
-grouped = grouped.nlargest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'AIRLINE'],ascending=True)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Highest Block to Air time variance by Airline", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Airline")
-plt.show()
-print(grouped)
-
-# Bar Chart with 25 lowest Block to Air time variance by Airline
-grouped = df[['AIRLINE','BLOCK_FLIGHT_VARIANCE']].groupby(['AIRLINE']).mean()
-grouped = grouped.nsmallest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'AIRLINE'], ascending=False)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Lowest Block to Air time variance by Airline", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Airline")
-plt.show()
-print(grouped)
-
-
-# Block to Air time mean variance by Route (origin airport)
-# Bar Chart with 25 highest Block to Air time variance by Route (origin airport)
-grouped = df[['ORIGIN_AIRPORT','BLOCK_FLIGHT_VARIANCE']].groupby(['ORIGIN_AIRPORT']).mean()
-grouped = grouped.nlargest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE','ORIGIN_AIRPORT'],ascending=True)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Highest Block to Air time variance by Route (Origin Airport)", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Route (Origin Airport)")
-plt.show()
-print(grouped)
-
-# Bar Chart with 25 lowest Block to Air time variance by Route (origin airport)
-grouped = df[['ORIGIN_AIRPORT','BLOCK_FLIGHT_VARIANCE']].groupby(['ORIGIN_AIRPORT']).mean()
-grouped = grouped.nsmallest(25,['BLOCK_FLIGHT_VARIANCE'])
-grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE','ORIGIN_AIRPORT'], ascending=False)
-grouped.plot(kind="barh", figsize=(10, 9))
-plt.legend('', frameon=False)  # hide legend
-plt.title("25 Lowest Block to Air time variance by Route (Origin Airport)", fontsize=14)
-plt.ylabel("Variance of Block to Flight Time (minutes)")
-plt.xlabel("Route (Origin Airport)")
-plt.show()
-print(grouped)
+def AnalyseBlockTime(df):
+    # NOTE: BLOCK_TIME AND BLOCK_FLIGHT_VARIANCE ARE ADDED CALCULATED FIELDS DURING THE DATA LOAD AND CLEAN FUNCTION
+
+    # Count/mean/variance of BLOCK_FLIGHT_VARIANCE for every dimension below in one pass over the merged dataset - the
+    # highest and lowest 25 for each dimension are then taken from the cube (see AggregationCube). When the flights are a
+    # sample (see FlightSampling) the cube is weighted so the counts and means are estimates for all the flights
+    dimensions = ['Aircraft_type', 'Aircraft_family', 'AIRLINE', 'ORIGIN_AIRPORT']
+    cube = BuildAggregationCube(df, dimensions, 'BLOCK_FLIGHT_VARIANCE', weight='SAMPLE_WEIGHT' if IsSample(df) else None)
+
+    # Block to Air time mean variance by Aircraft Type
+    # Bar Chart with 25 highest Block to Air time variance by aircraft types
+    grouped = GetTopK(cube, 'Aircraft_type', 25, largest=True)  #largest 25
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_type'],ascending=True) #sort order
+    RenderChart("25 Highest Block to Air time variance by Aircraft Type", DrawFramePlot, grouped, kind="barh", figsize=(14, 9), legend=False,
+                title="25 Highest Block to Air time variance by Aircraft Type",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Aircraft Type")
+
+    print(grouped)
+
+    # Bar Chart with 25 lowest Block to Air time variance by aircraft types
+    grouped = GetTopK(cube, 'Aircraft_type', 25, largest=False)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_type'], ascending=False)
+    RenderChart("25 Lowest Block to Air time variance by Aircraft Type", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Lowest Block to Air time variance by Aircraft Type",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Aircraft Type")
+    print(grouped)
+
+    # Block to Air time mean variance by Aircraft Family
+    # Bar Chart with 25 highest Block to Air time variance by aircraft Family
+    grouped = GetTopK(cube, 'Aircraft_family', 25, largest=True)  #largest 25
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_family'],ascending=True) #sort order
+    RenderChart("25 Highest Block to Air time variance by Aircraft Family", DrawFramePlot, grouped, kind="barh", figsize=(14, 9), legend=False,
+                title="25 Highest Block to Air time variance by Aircraft Family",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Aircraft Family")
+    print(grouped)
+
+    # Bar Chart with 25 lowest Block to Air time variance by aircraft Family
+    grouped = GetTopK(cube, 'Aircraft_family', 25, largest=False)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'Aircraft_family'], ascending=False)
+    RenderChart("25 Lowest Block to Air time variance by Aircraft Family", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Lowest Block to Air time variance by Aircraft Family",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Aircraft Family")
+    print(grouped)
+
+    # Block to Air time mean variance by Airline
+    # Bar Chart with 25 highest Block to Air time variance by Airline
+    grouped = GetTopK(cube, 'AIRLINE', 25, largest=True)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'AIRLINE'],ascending=True)
+    RenderChart("25 Highest Block to Air time variance by Airline", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Highest Block to Air time variance by Airline",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Airline")
+    print(grouped)
+
+    # Bar Chart with 25 lowest Block to Air time variance by Airline
+    grouped = GetTopK(cube, 'AIRLINE', 25, largest=False)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE', 'AIRLINE'], ascending=False)
+    RenderChart("25 Lowest Block to Air time variance by Airline", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Lowest Block to Air time variance by Airline",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Airline")
+    print(grouped)
+
+
+    # Block to Air time mean variance by Route (origin airport)
+    # Bar Chart with 25 highest Block to Air time variance by Route (origin airport)
+    grouped = GetTopK(cube, 'ORIGIN_AIRPORT', 25, largest=True)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE','ORIGIN_AIRPORT'],ascending=True)
+    RenderChart("25 Highest Block to Air time variance by Route (Origin Airport)", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Highest Block to Air time variance by Route (Origin Airport)",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Route (Origin Airport)")
+    print(grouped)
+
+    # Bar Chart with 25 lowest Block to Air time variance by Route (origin airport)
+    grouped = GetTopK(cube, 'ORIGIN_AIRPORT', 25, largest=False)
+    grouped = grouped.sort_values(by=['BLOCK_FLIGHT_VARIANCE','ORIGIN_AIRPORT'], ascending=False)
+    RenderChart("25 Lowest Block to Air time variance by Route (Origin Airport)", DrawFramePlot, grouped, kind="barh", figsize=(10, 9), legend=False,
+                title="25 Lowest Block to Air time variance by Route (Origin Airport)",
+                ylabel="Variance of Block to Flight Time (minutes)", xlabel="Route (Origin Airport)")
+    print(grouped)
+
+    # Sampled flights - the highest and lowest 25 of each dimension again with the error bounds of the estimates
+    if IsSample(df):
+        for dimension in dimensions:
+            estimates = EstimateMeans(df, dimension, 'BLOCK_FLIGHT_VARIANCE')
+            print(pd.concat([estimates.nlargest(25, 'estimate'), estimates.nsmallest(25, 'estimate')]))
 
 
 # ===================================
 # 3. FLIGHT HOURS PER MONTH BY TAIL
 # ===================================
 
-# The section is in progress and will be utilised fully after the assessment as hitting a corporate Oracle DB.
-# For the purpose of the assessment I am generating a random list of ID's and using this to extract a 'simulated fleet' of aircraft
-#
-
-# Generate random numbers between 1 and 500000
-randomlist = random.sample(range(10, 500000), 3500)
-print(randomlist)
-
-# Using the random list to generate a random fleet of aircraft  and use this to select against flights
-# This will be replaced by my company's actual fleet after the assessment
-myfleet = aircraft.loc[aircraft['ID'].isin(randomlist)]
-print('==================================MY FLEET===================================')
-print(myfleet.info())
-myfleet_flights = df.loc[df['TAIL_NUMBER'].isin(myfleet['Registration'])]
-print(myfleet_flights)
-
-# Not using as part of the assessment but used in testing. This is hitting a corporate DB so obviously can't include here
-#from OracleDatabaseAccess import getoracledataset
-#myfleet = getoracledataset('***add fleetview here***')
-
-# Quick check on monthly utilisation by fleet sample
-monthly_hours = myfleet_flights[['TAIL_NUMBER', 'MONTH', 'AIR_TIME']].groupby(['TAIL_NUMBER', 'MONTH']).sum()
-print(monthly_hours)
-monthly_hours.plot(kind="line", figsize=(14, 9), )    # set horizontal bar chart and size
-#######plt.legend(['Block to Flight time Variance'], loc='upper right')
-plt.legend('', frameon=False)  # hide legend
-plt.title("My Fleet - Monthly Aircraft Utilisation", fontsize=14)
-plt.ylabel("Flight Time (minutes)")
-plt.xlabel("Aircraft")
-plt.show()
-
-
-#Sample of full fleet for Jan
-df_month = df.loc[df['MONTH'] == 1]
-monthly_hours = df_month[['TAIL_NUMBER', 'MONTH', 'AIR_TIME']].groupby(['TAIL_NUMBER', 'MONTH']).sum()
-print(monthly_hours)
-monthly_hours.plot(kind="line", figsize=(14, 9), )    # set horizontal bar chart and size
-#######plt.legend(['Block to Flight time Variance'], loc='upper right')
-plt.legend('', frameon=False)  # hide legend
-plt.title("My Fleet - Monthly Aircraft Utilisation", fontsize=14)
-plt.ylabel("Flight Time (minutes)")
-plt.xlabel("Aircraft")
-plt.show()
-
+def AnalyseFleetUtilisation(aircraft, flights, utilisation):
+    # The section is in progress and will be utilised fully after the assessment as hitting a corporate Oracle DB.
+    # For the purpose of the assessment I am generating a random list of ID's and using this to extract a 'simulated fleet' of aircraft
+    #
+
+    # Generate random numbers between 1 and 500000
+    randomlist = random.sample(range(10, 500000), 3500)
+    print(randomlist)
+
+    # Using the random list to generate a random fleet of aircraft  and use this to select against flights
+    # This will be replaced by my company's actual fleet after the assessment
+    myfleet = aircraft.loc[aircraft['ID'].isin(randomlist)]
+    print('==================================MY FLEET===================================')
+    print(myfleet.info())
+    # (aircraft with no type are left out, same as the merged dataset)
+    myfleet_utilisation = utilisation.GetFleet(myfleet.loc[myfleet['Aircraft_type'].notnull(), 'Registration'])
+    print(myfleet_utilisation)
+
+    # Not using as part of the assessment but used in testing. This is hitting a corporate DB so obviously can't include here
+    #from OracleDatabaseAccess import getoracledataset
+    #myfleet = getoracledataset('***add fleetview here***')
+
+    # Quick check on monthly utilisation by fleet sample - looked up in the utilisation rollup rather than filtering and
+    # grouping the merged frame
+    monthly_hours = myfleet_utilisation.set_index(['TAIL_NUMBER', 'MONTH'])[['AIR_TIME']]
+    print(monthly_hours)
+    RenderChart("My Fleet - Monthly Aircraft Utilisation", DrawFramePlot, monthly_hours, kind="line", figsize=(14, 9), legend=False,
+                title="My Fleet - Monthly Aircraft Utilisation", ylabel="Flight Time (minutes)", xlabel="Aircraft")
+
+    # Sampled flights - the utilisation above is scaled up from the sample (see FlightSampling). The estimates for one
+    # tail are rough, so show the fleet's total air time per month with its error bounds
+    if IsSample(flights):
+        fleetflights = flights[flights['TAIL_NUMBER'].isin(myfleet_utilisation['TAIL_NUMBER'].unique())]
+        print(EstimateTotals(fleetflights, ['MONTH'], 'AIR_TIME'))
+
+
+    #Sample of full fleet for Jan
+    # (the full fleet is every aircraft with a type, i.e. everything left in the merged dataset)
+    fullfleet = aircraft.loc[aircraft['Aircraft_type'].notnull(), 'Registration']
+    monthly_hours = utilisation.GetFleet(fullfleet, periods=[1]).set_index(['TAIL_NUMBER', 'MONTH'])[['AIR_TIME']]
+    print(monthly_hours)
+    RenderChart("Full Fleet Sample - January Utilisation", DrawFramePlot, monthly_hours, kind="line", figsize=(14, 9), legend=False,
+                title="My Fleet - Monthly Aircraft Utilisation", ylabel="Flight Time (minutes)", xlabel="Aircraft")
 
 
 # ==========================
 # 4. ANALYSE FLIGHT DELAY STATS
 # ==========================
 
-
-# Display visual of delayed flight
-delayed_subset = df
-f,ax=plt.subplots(1,2,figsize=(14,8))
-df['DELAY_STATUS'].value_counts().plot.pie(explode=[0.05,0.05,0.05,0,0],autopct='%1.1f%%',ax=ax[0],shadow=True)
-ax[0].set_title('Delay Status')
-ax[0].set_ylabel('')
-sns.countplot(x=df['DELAY_STATUS'],order = df['DELAY_STATUS'].value_counts().index, data=df, ax=ax[1])
-ax[1].set_title('Delay Status')
-ax[0].legend(ncol = 2, loc = 'lower right')
-ax[1].legend(ncol = 2, loc = 'lower right')
-plt.show()
-
-print('Status : flight was on time (0), slightly delayed (1), highly delayed (2), diverted (3), or cancelled (4)')
-
-# Display a visual of cancelled flights
-cancelled_flights = df[(df.DELAY_STATUS == 4)]
-#print(cancelled_flights.info())
-f,ax=plt.subplots(1,2,figsize=(14,8))
-cancelled_flights['CANCELLATION_REASON'].value_counts().plot.pie(autopct='%1.1f%%',ax=ax[0],shadow=True)
-ax[0].set_ylabel('')
-ax[0].legend(ncol = 2, loc = 'upper right')
-ax[1].legend(ncol = 2, loc = 'upper right')
-sns.countplot(x=df['CANCELLATION_REASON'], order = cancelled_flights['CANCELLATION_REASON'].value_counts().index, data=cancelled_flights, ax=ax[1])
-plt.show()
-#print('0 = carrier, 1 = weather, 2 = NAS')
-
-cancelled_flights[['DEPARTURE_DATE','CANCELLATION_REASON']].groupby(['DEPARTURE_DATE']).count().plot()
-plt.show()
-
-
-# Delayed Flights
-
-delayed_flights = df[(df.DELAY_STATUS >= 1) &(df.DELAY_STATUS < 3)]
-
-#Hide this chart
-#sns.distplot(x=delayed_flights['ARRIVAL_DELAY'])
-#plt.show()
-
-f,ax=plt.subplots(1,2,figsize=(14,8))
-delayed_flights[['MONTH','ARRIVAL_DELAY']].groupby(['MONTH']).mean().plot(ax=ax[0])
-ax[0].set_title('Average delay by month')
-delayed_flights[['MONTH','ARRIVAL_DELAY']].groupby(['MONTH']).sum().plot(ax=ax[1])
-ax[1].set_title('Number of minutes delayed by month')
-ax[0].legend(ncol = 2, loc = 'upper right')
-ax[1].legend(ncol = 2, loc = 'upper right')
-plt.show()
-
-#sns.jointplot(x='DEPARTURE_TIME',y='ARRIVAL_DELAY',data=delayed_flights,kind='reg', color='b',fit_reg = True)
-#plt.show()
-
-df2 = delayed_flights.filter(['MONTH','AIRLINE_DELAY','WEATHER_DELAY','AIR_SYSTEM_DELAY','SECURITY_DELAY','LATE_AIRCRAFT_DELAY'], axis=1)
-df2 = df2.groupby('MONTH')['LATE_AIRCRAFT_DELAY','AIRLINE_DELAY','WEATHER_DELAY','AIR_SYSTEM_DELAY','SECURITY_DELAY'].sum().plot()
-df2.legend(loc='upper right', shadow=True)
-plt.show()
-
-#scatterplot - removing this. It is nice but not sure what it is telling me and it is slow
-#sns.set()
-#cols = ['ARRIVAL_DELAY', 'AIRLINE_DELAY', 'LATE_AIRCRAFT_DELAY', 'AIR_SYSTEM_DELAY', 'WEATHER_DELAY']
-#sns.pairplot(delayed_flights[cols], size = 2.5)
-#plt.show()
-
+def AnalyseDelays(delays, df):
+    # All the charts below come from the delay buckets built in the merge (see DelayBuckets) - same counts and totals
+    # as filtering and grouping the merged dataset. df is only used for the error bounds when the flights are a sample
+
+    # Display visual of delayed flight
+    RenderChart('Delay Status', DrawPieAndCount, CountFlightsBy(delays, 'DELAY_STATUS'), 'Delay Status', figsize=(14, 8),
+                explode=[0.05,0.05,0.05,0,0], legendloc='lower right')
+
+    print('Status : flight was on time (0), slightly delayed (1), highly delayed (2), diverted (3), or cancelled (4)')
+
+    # Display a visual of cancelled flights
+    RenderChart('Cancellation Reason', DrawPieAndCount, CountFlightsBy(delays, 'CANCELLATION_REASON', statuses=[4]),
+                figsize=(14, 8), legendloc='upper right')
+    #print('0 = carrier, 1 = weather, 2 = NAS')
+
+    # cancelled flights with a reason per day
+    cancelled_flights = RollUpDelays(delays, 'day', by=['CANCELLATION_REASON'], statuses=[4])
+    RenderChart('Cancellations by Date', DrawFramePlot,
+                cancelled_flights.groupby(level='DEPARTURE_DATE')[['FLIGHTS']].sum()
+                .rename(columns={'FLIGHTS': 'CANCELLATION_REASON'}))
+
+
+    # Delayed Flights (slightly and highly delayed) per month
+
+    delayed_flights = RollUpDelays(delays, 'month', statuses=[1, 2])
+
+    #Hide this chart
+    #sns.distplot(x=delayed_flights['ARRIVAL_DELAY'])
+    #plt.show()
+
+    RenderChart('Delay by Month', DrawSideBySide,
+                GetDelayMean(delayed_flights, 'ARRIVAL_DELAY').to_frame(), 'Average delay by month',
+                delayed_flights[['ARRIVAL_DELAY']], 'Number of minutes delayed by month')
+
+    #sns.jointplot(x='DEPARTURE_TIME',y='ARRIVAL_DELAY',data=delayed_flights,kind='reg', color='b',fit_reg = True)
+    #plt.show()
+
+    RenderChart('Delay Causes by Month', DrawFramePlot, delayed_flights[DELAY_CAUSES], legend={'loc': 'upper right', 'shadow': True})
+
+    # Sampled flights - the buckets are scaled up from the sample (see FlightSampling), these are the estimates behind
+    # the charts with their error bounds
+    if IsSample(df):
+        print(EstimateTotals(df, ['DELAY_STATUS']))
+        print(EstimateTotals(df[df['DELAY_STATUS'] == 4], ['CANCELLATION_REASON']))
+        delayed = df[df['DELAY_STATUS'].isin([1, 2])]
+        print(EstimateTotals(delayed, ['MONTH'], 'ARRIVAL_DELAY'))
+        print(EstimateMeans(delayed, ['MONTH'], 'ARRIVAL_DELAY'))
+
+    #scatterplot - removing this. It is nice but not sure what it is telling me and it is slow
+    #sns.set()
+    #cols = ['ARRIVAL_DELAY', 'AIRLINE_DELAY', 'LATE_AIRCRAFT_DELAY', 'AIR_SYSTEM_DELAY', 'WEATHER_DELAY']
+    #sns.pairplot(delayed_flights[cols], size = 2.5)
+    #plt.show()
+
+
+# =============
+# RUN THE STAGES
+# =============
+
+STAGES = [
+    Stage('load', LoadDatasets, outputs=['aircraft', 'flights'],
+          codeobjects=[StartupLoader, LoadandCleanDatasets, DatasetSchema, FlightDerivations, ManufacturerRules,
+                       FlightSampling],
+          sourcefiles=[AIRCRAFT_SOURCE_FILE, FLIGHTS_SOURCE_FILE], restore=RestoreLoadedDatasets,
+          settings=GetSampleSettings),
+    Stage('lookups', LoadLookups, outputs=['airlines', 'airports'],
+          codeobjects=[StartupLoader, LoadandCleanDatasets, AviationStackClient],
+          settings=LookupSettings),
+    Stage('merge', MergeDatasets, inputs=['aircraft', 'flights'],
+          outputs=['df', 'registrations', 'utilisation', 'delays'],
+          codeobjects=[RegistrationIndex, UtilisationRollupModule, DelayBuckets]),
+    Stage('section1', ReviewDatasets, inputs=['aircraft', 'flights', 'df'], checkpoint=False),
+    Stage('section2', AnalyseBlockTime, inputs=['df'], checkpoint=False),
+    Stage('section3', AnalyseFleetUtilisation, inputs=['aircraft', 'flights', 'utilisation'], checkpoint=False),
+    Stage('section4', AnalyseDelays, inputs=['delays', 'df'], checkpoint=False),
+]
+
+if __name__ == '__main__':
+    # --sample 0.05 / --sample-rows 200000 and --seed 7 run everything on a stratified sample of the flights
+    RunPipelineCommandLine(STAGES, ParseSampleArguments())
+
+    # Wait for any charts still being saved (headless mode)
+    FinishCharts()
+
+    # Time/memory/rows of each step when run with UCDPA_INSTRUMENT=1 (or =memory) - see Instrumentation
+    PrintInstrumentationSummary()
@@ -0,0 +1,151 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import AviationStackClient
+from AviationStackClient import AviationStackError, GetAviationStackData, GetPage, GetSession
+
+# Runs the client against a local stub of the aviationstack API - no network or access key needed
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, so connection reuse by the shared session can be seen
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        offset, limit = int(parameters.get('offset', 0)), int(parameters.get('limit', 100))
+        with server.lock:
+            server.requests.append((url.path, offset, self.client_address[1], parameters.get('access_key')))
+            failures = server.failures.get(offset, [])
+            status = failures.pop(0) if failures else 200
+        if status == 200:
+            records = server.records[offset:offset + limit]
+            body = {'pagination': {'offset': offset, 'limit': limit, 'count': len(records),
+                                   'total': len(server.records)}, 'data': records}
+        else:
+            body = {'error': {'code': status}}
+        text = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.records = [{'airport_name': 'Airport ' + str(number), 'iata_code': 'A%02d' % number,
+                       'country': {'name': 'Ireland'}} for number in range(250)]
+    server.requests = []
+    server.failures = {}    # offset -> status codes to send before the page
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def options(stub, tmp_path, monkeypatch):
+    AviationStackClient.API_SESSIONS.clear()
+    sleeps = []
+    monkeypatch.setattr(AviationStackClient.time, 'sleep', sleeps.append)
+    yield {'baseurl': 'http://127.0.0.1:' + str(stub.server_address[1]) + '/v1', 'accesskey': 'test-key',
+           'cachedirectory': str(tmp_path / 'api'), 'backoff': 0.5, 'retries': 2, 'sleeps': sleeps}
+    AviationStackClient.API_SESSIONS.clear()
+
+
+def Fetch(options, endpoint='airports', **kwargs):
+    return GetAviationStackData(endpoint, **dict({name: value for name, value in options.items() if name != 'sleeps'},
+                                                 **kwargs))
+
+
+def test_every_page_is_fetched_and_flattened(stub, options):
+    data = Fetch(options, pagesize=100)
+    assert len(data) == 250
+    assert data['iata_code'].tolist() == [record['iata_code'] for record in stub.records]
+    assert 'country.name' in data.columns
+    assert sorted(offset for path, offset, port, key in stub.requests) == [0, 100, 200]
+    assert all(path == '/v1/airports' and key == 'test-key' for path, offset, port, key in stub.requests)
+
+
+def test_maxpages_limits_the_pages(stub, options):
+    assert len(Fetch(options, pagesize=50, maxpages=2)) == 100
+    assert len(stub.requests) == 2
+
+
+# 25 pages of 10 - only API_MAX_PAGES of them unless maxpages says otherwise
+def test_pages_are_bounded_by_default(stub, options):
+    assert len(Fetch(options, pagesize=10)) == 10 * AviationStackClient.API_MAX_PAGES
+    assert len(stub.requests) == AviationStackClient.API_MAX_PAGES
+    assert len(Fetch(options, pagesize=10, maxpages=None)) == 250
+
+
+def test_retries_with_backoff_on_429_and_5xx(stub, options):
+    stub.failures = {0: [429, 503], 100: [500]}
+    data = Fetch(options, pagesize=100, workers=1)
+    assert len(data) == 250
+    assert [offset for path, offset, port, key in stub.requests].count(0) == 3
+    assert options['sleeps'] == [0.5, 1.0, 0.5]    # doubled after each retry of the same page
+
+
+def test_gives_up_after_the_retries(stub, options):
+    stub.failures = {0: [503, 503, 503]}
+    with pytest.raises(AviationStackError):
+        Fetch(options)
+    assert len(stub.requests) == 3
+    assert options['sleeps'] == [0.5, 1.0]
+
+
+def test_shared_session_reuses_the_connection(stub, options):
+    Fetch(options, pagesize=100, workers=1)
+    assert GetSession() is GetSession()
+    assert len({port for path, offset, port, key in stub.requests}) == 1
+
+
+def test_pages_are_cached_until_the_ttl(stub, options):
+    first = Fetch(options, pagesize=100)
+    assert len(stub.requests) == 3
+    again = Fetch(options, pagesize=100)
+    assert len(stub.requests) == 3      # all from the cache
+    assert again.equals(first)
+    Fetch(options, pagesize=100, ttl=-1)   # expired
+    assert len(stub.requests) == 6
+
+
+def test_offline_uses_the_recorded_pages(stub, options):
+    Fetch(options, pagesize=100)
+    stub.records = []
+    offline = Fetch(options, pagesize=100, offline=True)
+    assert len(offline) == 250
+    with pytest.raises(AviationStackError):
+        Fetch(options, endpoint='airlines', offline=True)
+
+
+def test_api_error_is_raised_and_not_cached(stub, options):
+    page = {name: value for name, value in options.items() if name not in ('sleeps', 'retries', 'backoff')}
+    stub.failures = {0: [404]}
+    with pytest.raises(requests.HTTPError):
+        GetPage('airports', {'limit': 100, 'offset': 0}, retries=0, **page)
+    assert len(GetPage('airports', {'limit': 100, 'offset': 0}, **page)['data']) == 100
+
+
+def test_access_key_is_needed_only_for_requests(stub, options, monkeypatch):
+    monkeypatch.setattr(AviationStackClient, 'API_ACCESS_KEY', None)
+    keyless = dict(options, accesskey=None)
+    with pytest.raises(AviationStackError, match='AVIATIONSTACK_ACCESS_KEY'):
+        Fetch(keyless)
+    assert stub.requests == []
+    Fetch(options, pagesize=100)
+    assert len(Fetch(keyless, pagesize=100)) == 250     # all from the cache
@@ -0,0 +1,15 @@
+import os
+
+import ChartRenderer
+from ChartRenderer import GetChartFileStem
+
+
+def test_file_is_named_after_the_chart(monkeypatch):
+    monkeypatch.setitem(ChartRenderer.CHART_SETTINGS, 'directory', 'charts')
+    monkeypatch.setattr(ChartRenderer, 'RENDERED_CHARTS', [(os.path.join('charts', 'month'), [])])
+    # the same file whatever was drawn before it in the run
+    assert GetChartFileStem('Delay by Month') == os.path.join('charts', 'delay_by_month')
+    assert GetChartFileStem('25 Highest Block to Air time variance by Route (Origin Airport)') == \
+        os.path.join('charts', '25_highest_block_to_air_time_variance_by_route_origin_airport')
+    # a name already used in this run
+    assert GetChartFileStem('Month') == os.path.join('charts', 'month_2')
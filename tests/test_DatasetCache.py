@@ -0,0 +1,22 @@
+import pandas as pd
+
+import DatasetCache
+from DatasetCache import LoadCachedDataset
+
+
+def test_read_false_gives_the_cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(DatasetCache, 'CACHE_DIRECTORY', str(tmp_path / 'cache'))
+    sourcefile = tmp_path / 'fleet.csv'
+    sourcefile.write_text('REGISTRATION,SEATS\nEI-DEA,180\nEI-FRA,189\n')
+    builds = []
+
+    def Build():
+        builds.append(1)
+        return pd.read_csv(sourcefile)
+
+    path = LoadCachedDataset('fleet', str(sourcefile), Build, 1, read=False)
+    assert path == DatasetCache.GetCachePath('fleet')
+    assert LoadCachedDataset('fleet', str(sourcefile), Build, 1, read=False) == path   # up to date - not rebuilt
+    assert len(builds) == 1
+    pd.testing.assert_frame_equal(pd.read_parquet(path), LoadCachedDataset('fleet', str(sourcefile), Build, 1))
+    assert len(builds) == 1
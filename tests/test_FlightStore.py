@@ -0,0 +1,88 @@
+import pytest
+
+import FlightStore
+import SyntheticData
+
+# A small synthetic flights file (all 12 months of 2015, rows in no particular month order) ingested into a store in
+# a temporary folder
+FLIGHTS_ROWS = 6000
+
+
+@pytest.fixture(scope='module')
+def flights():
+    return SyntheticData.GenerateFlightsBlock(SyntheticData.GetSyntheticReference(FLIGHTS_ROWS), 0, FLIGHTS_ROWS)
+
+
+@pytest.fixture
+def flightsfile(flights, tmp_path):
+    path = tmp_path / 'flights.csv'
+    flights.to_csv(path)
+    return str(path)
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'store')
+
+
+def Ingest(sourcefile, directory, chunksize, **options):
+    return FlightStore.IngestFlightsFile(sourcefile, chunksize=chunksize, windowmonths=None, directory=directory,
+                                         **options)
+
+
+def test_one_part_per_partition(flightsfile, directory):
+    summary = Ingest(flightsfile, directory, 1000)
+    assert summary['parts_added'] == 12
+    assert len(FlightStore.GetStoreParts(directory)) == 12
+    assert len(FlightStore.LoadFlightStore(directory=directory)) == FLIGHTS_ROWS
+
+
+@pytest.mark.parametrize('replace', [False, True])
+def test_reingest_with_a_different_chunksize_changes_nothing(flightsfile, directory, replace):
+    Ingest(flightsfile, directory, 1000)
+    parts = FlightStore.GetStoreParts(directory)
+    summary = Ingest(flightsfile, directory, 700, replace=replace)
+    assert summary['rows_cleaned'] == 0
+    assert summary['parts_unchanged'] == 12
+    assert FlightStore.GetStoreParts(directory) == parts
+    assert len(FlightStore.LoadFlightStore(directory=directory)) == FLIGHTS_ROWS
+
+
+# The same file with more rows on the end - only the new rows are cleaned and the aggregates cover every row
+def test_growing_file_adds_only_the_new_rows(flights, flightsfile, directory, tmp_path):
+    partial = str(tmp_path / 'partial.csv')
+    flights.iloc[:4000].to_csv(partial)
+    Ingest(partial, directory, 1500)
+    summary = Ingest(flightsfile, directory, 2500)
+    assert summary['rows_already_stored'] == 4000
+    assert summary['rows_cleaned'] == FLIGHTS_ROWS - 4000
+    store = FlightStore.LoadFlightStore(directory=directory)
+    assert len(store) == FLIGHTS_ROWS
+    cubes = FlightStore.GetStoreAggregateFrames('variance_cube', directory)
+    assert sum(frame.loc[frame['dimension'] == 'MONTH', 'count'].sum() for frame in cubes) == \
+        store['BLOCK_FLIGHT_VARIANCE'].count()
+
+
+def test_replace_swaps_the_partitions_in_the_ingest(flights, flightsfile, directory, tmp_path):
+    Ingest(flightsfile, directory, 1000)
+    corrected = str(tmp_path / 'corrected.csv')
+    january = flights[flights['MONTH'] == 1]
+    january.iloc[:100].to_csv(corrected)
+    summary = Ingest(corrected, directory, 1000, replace=True)
+    assert summary['parts_added'] == 1 and summary['parts_removed'] == 1
+    store = FlightStore.LoadFlightStore(directory=directory)
+    assert len(store) == FLIGHTS_ROWS - len(january) + 100
+    assert (store['MONTH'] == 1).sum() == 100
+
+
+# A change to the aggregation code drops the saved aggregates, which are then rebuilt from the parts
+def test_aggregates_are_rebuilt_when_their_code_changes(flightsfile, directory, monkeypatch):
+    Ingest(flightsfile, directory, 1000)
+    partition, parthash = FlightStore.GetStoreParts(directory)[0]
+    path = FlightStore.GetPartPath(directory, partition, parthash, 'delay_buckets')
+    FlightStore.DelayBuckets.BuildDelayBuckets(FlightStore.LoadFlightStore(directory=directory).iloc[:0]).to_parquet(
+        path, index=False)   # a stale saved aggregate
+    monkeypatch.setattr(FlightStore, 'GetAggregatesFingerprint', lambda: 'changed')
+    frames = FlightStore.GetStoreAggregateFrames('delay_buckets', directory)
+    assert all(len(frame) > 0 for frame in frames)
+    assert FlightStore.ReadStoreManifest(directory)['aggregates'] == 'changed'
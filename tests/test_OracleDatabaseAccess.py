@@ -0,0 +1,83 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import OracleDatabaseAccess
+from OracleDatabaseAccess import WriteChunksToCache, getoracledataset, getoracledatasetchunks
+
+# A local SQLite database stands in for the Oracle DB - any SQLAlchemy connection string works
+FLEET_ROWS = [
+    ('EI-DEA', 'A320', None, 180),
+    ('EI-DEB', 'A320', None, 180),
+    ('EI-FRA', 'B737', 'leased', 189),
+    ('EI-LRA', 'A330', None, None),
+    ('EI-DVM', 'A320', 'sharklets', 186),
+]
+
+
+@pytest.fixture
+def connectionstring(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the dataset cache is written to ./cache
+    database = sqlite3.connect(str(tmp_path / 'fleet.db'))
+    database.execute('CREATE TABLE FLEET (REGISTRATION TEXT, FLEET_TYPE TEXT, NOTES TEXT, SEATS INTEGER)')
+    database.executemany('INSERT INTO FLEET VALUES (?, ?, ?, ?)', FLEET_ROWS)
+    database.commit()
+    database.close()
+    yield 'sqlite:///' + str(tmp_path / 'fleet.db')
+    OracleDatabaseAccess.CloseOracleEngines()
+
+
+def test_chunks_have_chunksize_rows(connectionstring):
+    chunks = list(getoracledatasetchunks('FLEET', chunksize=2, connectionstring=connectionstring))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert pd.concat(chunks)['REGISTRATION'].tolist() == [row[0] for row in FLEET_ROWS]
+
+
+def test_only_the_columns_asked_for_are_selected(connectionstring):
+    data = getoracledataset('FLEET', columns=['REGISTRATION', 'SEATS'], connectionstring=connectionstring)
+    assert list(data.columns) == ['REGISTRATION', 'SEATS']
+    assert len(data) == len(FLEET_ROWS)
+
+
+def test_where_runs_with_bind_parameters(connectionstring):
+    data = getoracledataset('FLEET', columns=['REGISTRATION'], where='FLEET_TYPE = :fleet', params={'fleet': 'A320'},
+                            chunksize=2, connectionstring=connectionstring)
+    assert data['REGISTRATION'].tolist() == ['EI-DEA', 'EI-DEB', 'EI-DVM']
+
+
+def test_cache_is_written_in_chunks(connectionstring):
+    data = getoracledataset('FLEET', chunksize=2, connectionstring=connectionstring, cachename='fleet')
+    assert os.path.exists(os.path.join('cache', 'fleet.parquet'))
+    assert not os.path.exists(os.path.join('cache', 'fleet.parquet.tmp'))
+    pd.testing.assert_frame_equal(data, pd.read_parquet(os.path.join('cache', 'fleet.parquet')))
+    assert data['REGISTRATION'].tolist() == [row[0] for row in FLEET_ROWS]
+
+
+# NOTES is all null in the first chunk (and SEATS in the second) - the cache schema takes the type from a later chunk
+def test_cache_with_a_column_all_null_in_the_first_chunk(connectionstring):
+    data = getoracledataset('FLEET', chunksize=2, connectionstring=connectionstring, cachename='fleet')
+    assert data['NOTES'].isna().tolist() == [True, True, False, True, False]
+    assert data['NOTES'].dropna().tolist() == ['leased', 'sharklets']
+    assert data['SEATS'].isna().tolist() == [False, False, False, True, False]
+
+
+def test_cache_of_no_rows(connectionstring):
+    data = getoracledataset('FLEET', columns=['REGISTRATION'], where='1 = 0', connectionstring=connectionstring,
+                            cachename='empty')
+    assert data.empty
+    assert list(data.columns) == ['REGISTRATION']
+
+
+def test_failed_cache_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def FailingChunks():
+        yield pd.DataFrame({'REGISTRATION': ['EI-DEA'], 'NOTES': [None]})
+        yield pd.DataFrame({'REGISTRATION': ['EI-DEB'], 'NOTES': ['leased']})
+        raise RuntimeError('connection lost')
+
+    with pytest.raises(RuntimeError):
+        WriteChunksToCache('fleet', FailingChunks())
+    assert os.listdir('cache') == []
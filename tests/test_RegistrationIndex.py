@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from RegistrationIndex import MISSING_KEY, EncodeRegistrations
+
+REGISTRATIONS = pd.Index(['EI-DEA', 'EI-DEB', 'EI-FRA'], dtype=object)
+
+
+def test_categorical_and_object_columns_get_the_same_keys():
+    values = ['EI-FRA', None, 'EI-DEA', 'N123', 'EI-FRA']
+    expected = [2, MISSING_KEY, 0, MISSING_KEY, 2]
+    assert EncodeRegistrations(pd.Series(values, dtype=object), REGISTRATIONS).tolist() == expected
+    assert EncodeRegistrations(pd.Series(values, dtype='category'), REGISTRATIONS).tolist() == expected
+
+
+# An all-null categorical has no categories at all
+def test_categorical_with_no_categories_is_all_missing():
+    for column in [pd.Series([None, None, None], dtype='category'), pd.Series([], dtype='category')]:
+        keys = EncodeRegistrations(column, REGISTRATIONS)
+        assert keys.dtype == np.int32
+        assert keys.tolist() == [MISSING_KEY] * len(column)
+    assert EncodeRegistrations(pd.Series(['EI-DEA'], dtype='category'), pd.Index([], dtype=object)).tolist() == \
+        [MISSING_KEY]